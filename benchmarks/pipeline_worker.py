@@ -0,0 +1,59 @@
+"""
+Benchmark worker: runs process_menu_request for a workload in this process and
+prints a JSON report on the last line of stdout.
+
+Started by run_benchmark in pipeline mode, with the app environment (stub URLs,
+fake credentials) already set, so main is imported fresh for every level.
+"""
+import sys
+import json
+import time
+import resource
+import asyncio
+import contextlib
+
+
+async def run(config: dict) -> dict:
+    # Print output from the app goes to stderr, keeping stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        import main
+
+        latencies, started_at, timeouts = {}, {}, 0
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in config["workload"]:
+            queue.put_nowait(item)
+
+        async def user():
+            nonlocal timeouts
+            while not queue.empty():
+                item = queue.get_nowait()
+                # Wall-clock start, so run_benchmark can line it up with the Twilio stub's reply times
+                started_at[item["from_number"]] = time.time()
+                started = time.perf_counter()
+                try:
+                    await asyncio.wait_for(
+                        main.process_menu_request(item["from_number"], [item["media_url"]], item["question"]),
+                        timeout=config["timeout"]
+                    )
+                    latencies[item["from_number"]] = time.perf_counter() - started
+                except asyncio.TimeoutError:
+                    timeouts += 1
+
+        async with main.lifespan(main.app):
+            run_started = time.perf_counter()
+            await asyncio.gather(*(user() for _ in range(config["concurrency"])))
+            duration = time.perf_counter() - run_started
+
+    return {
+        "latencies": latencies,
+        "started_at": started_at,
+        "timeouts": timeouts,
+        "duration_s": duration,
+        # ru_maxrss is in KB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+if __name__ == "__main__":
+    report = asyncio.run(run(json.loads(sys.argv[1])))
+    print(json.dumps(report))
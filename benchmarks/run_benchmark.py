@@ -0,0 +1,356 @@
+"""
+Offline load test for MenuMate against local OpenAI, Serper and Twilio stubs.
+
+Drives either the real /webhook endpoint (app running under uvicorn) or
+process_menu_request directly, at one or more concurrency levels, and reports
+webhook response time, end-to-end latency percentiles, throughput and peak RSS.
+Results are written as JSON so two runs can be compared.
+
+Usage:
+    python -m benchmarks.run_benchmark --requests 200 --concurrency 1,8,32 --output base.json
+    python -m benchmarks.run_benchmark --profile benchmarks/profiles/degraded.json --output new.json
+    python -m benchmarks.run_benchmark --compare base.json new.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from typing import Dict, List, Optional
+
+import httpx
+
+from .stubs import StubServers, load_profile, media_url
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Reply bodies that mean the job failed or was turned away
+FAILURE_PREFIXES = ("❌", "⚠️", "⏳", "⏱️", "📸")
+
+# How long to keep collecting follow-up messages after the last first reply
+SETTLE_SECONDS = 2.0
+
+
+def percentiles(values: List[float], scale: float = 1.0) -> Dict:
+    """Return count, mean, p50/p90/p95/p99 and max of values (multiplied by scale)."""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(value * scale for value in values)
+
+    def pick(fraction: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 3)
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 3),
+        "p50": pick(0.50),
+        "p90": pick(0.90),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": round(ordered[-1], 3),
+    }
+
+
+def peak_rss_mb(pid: int) -> Optional[float]:
+    """Return a process's peak resident set size in MB (Linux only, None elsewhere)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def app_environment(stubs: StubServers, workdir: str, overrides: Dict[str, str]) -> Dict[str, str]:
+    """Environment for the app under test: stub endpoints, fake credentials, cold caches."""
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": "sk-bench",
+        "OPENAI_BASE_URL": stubs.openai_base_url,
+        "SERPER_API_KEY": "bench",
+        "SERPER_BASE_URL": stubs.serper_base_url,
+        "TWILIO_ACCOUNT_SID": "ACbench",
+        "TWILIO_AUTH_TOKEN": "bench",
+        "TWILIO_API_BASE_URL": stubs.twilio_base_url,
+        "CACHE_DB_PATH": "",
+        "METRICS_LOG_SPANS": "false",
+        "PYTHONUNBUFFERED": "1",
+    })
+    env.update(overrides)
+    return env
+
+
+def build_workload(twilio_base_url: str, distinct_menus: int, level: int, count: int, seed: int) -> List[Dict]:
+    """One request per simulated user, each with its own phone number and a menu drawn from the pool."""
+    rng = random.Random(seed + level)
+    return [
+        {
+            "from_number": f"+1999{level:03d}{i:06d}",
+            "message_sid": f"SMbench{level:03d}{i:06d}",
+            "media_url": media_url(twilio_base_url, rng.randrange(distinct_menus)),
+            "question": "What should I order?",
+        }
+        for i in range(count)
+    ]
+
+
+async def wait_until_ready(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"App did not become ready at {url}")
+
+
+async def run_webhook_level(
+    stubs: StubServers,
+    level: int,
+    count: int,
+    args: argparse.Namespace,
+    env: Dict[str, str],
+    workdir: str
+) -> Dict:
+    """Start the app under uvicorn, send count webhooks with level in flight, and measure replies."""
+    log_path = os.path.join(workdir, f"app-c{level}.log")
+    log = open(log_path, "w")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+         "--port", str(args.app_port), "--log-level", "warning"],
+        cwd=REPO_ROOT, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    app_url = f"http://127.0.0.1:{args.app_port}"
+    try:
+        await wait_until_ready(f"{app_url}/health")
+        workload = build_workload(stubs.twilio_base_url, stubs.profile["distinct_menus"], level, count, args.seed)
+        webhook_times, first_replies, started = [], {}, {}
+        timeouts = 0
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in workload:
+            queue.put_nowait(item)
+
+        async def user(client: httpx.AsyncClient):
+            nonlocal timeouts
+            while not queue.empty():
+                item = queue.get_nowait()
+                replied = stubs.wait_for_message(item["from_number"])
+                started[item["from_number"]] = t0 = time.perf_counter()
+                await client.post(f"{app_url}/webhook", data={
+                    "From": f"whatsapp:{item['from_number']}",
+                    "Body": item["question"],
+                    "NumMedia": "1",
+                    "MediaUrl0": item["media_url"],
+                    "MessageSid": item["message_sid"],
+                })
+                webhook_times.append(time.perf_counter() - t0)
+                try:
+                    await asyncio.wait_for(replied.wait(), timeout=args.timeout)
+                    first_replies[item["from_number"]] = stubs.messages[item["from_number"]][0][0] - t0
+                except asyncio.TimeoutError:
+                    timeouts += 1
+
+        stats_before = stubs.stats()
+        run_started = time.perf_counter()
+        async with httpx.AsyncClient(timeout=30) as client:
+            await asyncio.gather(*(user(client) for _ in range(level)))
+        duration = time.perf_counter() - run_started
+        await asyncio.sleep(SETTLE_SECONDS)
+        rss = peak_rss_mb(process.pid)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        log.close()
+
+    return summarize_level(stubs, level, workload, started, first_replies, webhook_times,
+                           timeouts, duration, rss, stats_before, log_path)
+
+
+async def run_pipeline_level(
+    stubs: StubServers,
+    level: int,
+    count: int,
+    args: argparse.Namespace,
+    env: Dict[str, str],
+    workdir: str
+) -> Dict:
+    """
+    Run process_menu_request in a fresh worker process (see pipeline_worker) and measure it.
+    The worker reports per-request latencies; reply bodies are read from the Twilio stub.
+    """
+    workload = build_workload(stubs.twilio_base_url, stubs.profile["distinct_menus"], level, count, args.seed)
+    log_path = os.path.join(workdir, f"pipeline-c{level}.log")
+    stats_before = stubs.stats()
+    with open(log_path, "w") as log:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "benchmarks.pipeline_worker",
+            json.dumps({"workload": workload, "concurrency": level, "timeout": args.timeout}),
+            cwd=REPO_ROOT, env=env, stdout=asyncio.subprocess.PIPE, stderr=log
+        )
+        stdout, _ = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(f"Pipeline worker failed, see {log_path}")
+    await asyncio.sleep(SETTLE_SECONDS)
+    report = json.loads(stdout.decode().strip().splitlines()[-1])
+
+    # Stub reply times are on our perf_counter clock; convert the worker's wall-clock
+    # start times onto it. The worker's latency covers the whole job, i.e. the last
+    # reply, so the first reply is measured from the stub's timestamps instead.
+    clock_offset = time.time() - time.perf_counter()
+    started, first_replies = {}, {}
+    for number, started_at in report["started_at"].items():
+        started[number] = started_at - clock_offset
+        if number in report["latencies"] and stubs.messages.get(number):
+            first_replies[number] = stubs.messages[number][0][0] - started[number]
+    return summarize_level(stubs, level, workload, started, first_replies, [],
+                           report["timeouts"], report["duration_s"], report["peak_rss_mb"],
+                           stats_before, log_path)
+
+
+def summarize_level(stubs, level, workload, started, first_replies, webhook_times,
+                    timeouts, duration, rss, stats_before, log_path) -> Dict:
+    last_replies, failed = [], 0
+    for item in workload:
+        messages = stubs.messages.get(item["from_number"], [])
+        if not messages or item["from_number"] not in started:
+            continue
+        last_replies.append(messages[-1][0] - started[item["from_number"]])
+        if any(body.startswith(FAILURE_PREFIXES) for _, body in messages):
+            failed += 1
+    stats_after = stubs.stats()
+    completed = len(first_replies)
+    return {
+        "concurrency": level,
+        "requests": len(workload),
+        "completed": completed,
+        "failed_replies": failed,
+        "timeouts": timeouts,
+        "duration_s": round(duration, 2),
+        "throughput_rps": round(completed / duration, 3) if duration else 0.0,
+        "webhook_ms": percentiles(webhook_times, scale=1000),
+        "first_reply_s": percentiles(list(first_replies.values())),
+        "last_reply_s": percentiles(last_replies),
+        "peak_rss_mb": rss,
+        "stub_calls": {
+            name: {key: stats_after[name][key] - stats_before[name][key] for key in stats_after[name]}
+            for name in stats_after
+        },
+        "app_log": log_path,
+    }
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    profile = load_profile(args.profile)
+    stubs = StubServers(profile, base_port=args.stub_port)
+    await stubs.start()
+    workdir = tempfile.mkdtemp(prefix="menumate-bench-")
+    overrides = dict(item.split("=", 1) for item in args.env)
+    levels = [int(level) for level in args.concurrency.split(",")]
+    results = []
+    try:
+        for level in levels:
+            env = app_environment(stubs, workdir, overrides)
+            # A fresh job store per level, so nothing is resumed from the previous one
+            env["JOB_DB_PATH"] = os.path.join(workdir, f"jobs-c{level}.db")
+            print(f"Running {args.requests} requests at concurrency {level} ({args.mode} mode)...", file=sys.stderr)
+            run_level = run_webhook_level if args.mode == "webhook" else run_pipeline_level
+            result = await run_level(stubs, level, args.requests, args, env, workdir)
+            results.append(result)
+            print_level(result)
+    finally:
+        await stubs.stop()
+
+    return {
+        "mode": args.mode,
+        "profile": profile,
+        "app_env": overrides,
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "levels": results,
+        "saturation_throughput_rps": max((level["throughput_rps"] for level in results), default=0.0),
+    }
+
+
+def print_level(result: Dict):
+    first = result["first_reply_s"]
+    webhook = result["webhook_ms"]
+    print(
+        f"c={result['concurrency']:>3}  done={result['completed']}/{result['requests']}  "
+        f"failed={result['failed_replies']}  timeouts={result['timeouts']}  "
+        f"throughput={result['throughput_rps']:.2f}/s  "
+        f"reply p50={first.get('p50')}s p95={first.get('p95')}s p99={first.get('p99')}s  "
+        + (f"webhook p99={webhook['p99']}ms  " if webhook.get("count") else "")
+        + f"rss={result['peak_rss_mb']}MB"
+    )
+
+
+def compare(base_path: str, new_path: str):
+    """Print the change in the headline numbers between two result files, per concurrency level."""
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    def delta(old, value) -> str:
+        if old is None or value is None:
+            return f"{old} -> {value}"
+        change = f" ({(value - old) / old * 100:+.1f}%)" if old else ""
+        return f"{old} -> {value}{change}"
+
+    new_levels = {level["concurrency"]: level for level in new["levels"]}
+    for old in base["levels"]:
+        level = new_levels.get(old["concurrency"])
+        if not level:
+            continue
+        print(f"concurrency {old['concurrency']}:")
+        print(f"  throughput/s    {delta(old['throughput_rps'], level['throughput_rps'])}")
+        for key in ("p50", "p95", "p99"):
+            print(f"  reply {key}  (s)  {delta(old['first_reply_s'].get(key), level['first_reply_s'].get(key))}")
+        print(f"  webhook p99 ms  {delta(old['webhook_ms'].get('p99'), level['webhook_ms'].get('p99'))}")
+        print(f"  failed          {delta(old['failed_replies'] + old['timeouts'], level['failed_replies'] + level['timeouts'])}")
+        print(f"  peak RSS MB     {delta(old['peak_rss_mb'], level['peak_rss_mb'])}")
+    print(f"saturation throughput/s {delta(base['saturation_throughput_rps'], new['saturation_throughput_rps'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["webhook", "pipeline"], default="webhook",
+                        help="Drive the /webhook endpoint or call process_menu_request directly")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per concurrency level")
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated concurrency levels")
+    parser.add_argument("--profile", help="JSON stub profile (latency, error and 429 settings)")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra environment for the app under test (repeatable)")
+    parser.add_argument("--timeout", type=float, default=180.0, help="Seconds to wait for each reply")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the menu each request sends")
+    parser.add_argument("--stub-port", type=int, default=18700, help="First of three ports for the stubs")
+    parser.add_argument("--app-port", type=int, default=18710, help="Port for the app in webhook mode")
+    parser.add_argument("--output", help="Write results JSON here")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="Compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = asyncio.run(run(args))
+    print(f"Saturation throughput: {results['saturation_throughput_rps']:.2f} requests/s")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
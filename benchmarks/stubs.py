@@ -0,0 +1,425 @@
+"""
+Local stand-ins for the OpenAI, Serper and Twilio APIs, for offline benchmarks.
+
+Each endpoint draws its latency from a configurable distribution and can fail
+with 5xx errors or 429s, either at random or above a requests-per-second cap.
+Twilio message sends are recorded with timestamps so the benchmark can measure
+end-to-end latency per user.
+"""
+import io
+import json
+import math
+import time
+import random
+import asyncio
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from PIL import Image, ImageDraw
+
+# Default behavior per endpoint. A profile file overrides any of these fields.
+DEFAULT_PROFILE = {
+    "openai_vision": {"latency": {"dist": "lognormal", "median": 3.0, "p99": 8.0}},
+    "openai_text": {"latency": {"dist": "lognormal", "median": 2.0, "p99": 6.0}},
+    "openai_images": {"latency": {"dist": "lognormal", "median": 10.0, "p99": 20.0}},
+    "serper_search": {"latency": {"dist": "lognormal", "median": 0.6, "p99": 2.0}},
+    "serper_images": {"latency": {"dist": "lognormal", "median": 0.8, "p99": 2.5}},
+    "twilio_messages": {"latency": {"dist": "lognormal", "median": 0.3, "p99": 1.0}},
+    "twilio_media": {"latency": {"dist": "lognormal", "median": 0.2, "p99": 0.8}},
+    "image_host": {"latency": {"dist": "lognormal", "median": 0.1, "p99": 0.5}},
+    # Distinct menus (photos and restaurants) requests are drawn from; fewer means warmer caches
+    "distinct_menus": 50,
+    # Size of the generated menu photos, like a phone camera
+    "menu_photo_size": [3024, 4032],
+}
+
+# z-score of the 99th percentile of a standard normal distribution
+Z_99 = 2.326
+
+DISHES = [
+    "Duck Confit", "French Onion Soup", "Nicoise Salad", "Steak Frites", "Ratatouille",
+    "Bouillabaisse", "Coq au Vin", "Creme Brulee", "Tarte Tatin", "Moules Marinieres",
+    "Croque Monsieur", "Quiche Lorraine", "Beef Bourguignon", "Escargots", "Chocolate Mousse",
+]
+
+
+def load_profile(path: Optional[str]) -> Dict:
+    """Return the default profile merged with the JSON profile at path (if any)."""
+    profile = json.loads(json.dumps(DEFAULT_PROFILE))
+    if path:
+        with open(path) as f:
+            overrides = json.load(f)
+        for key, value in overrides.items():
+            if isinstance(value, dict) and isinstance(profile.get(key), dict):
+                profile[key].update(value)
+            else:
+                profile[key] = value
+    return profile
+
+
+def sample_latency(latency: Dict) -> float:
+    """
+    Draw one latency in seconds from a distribution spec.
+
+    Supported specs: {"dist": "fixed", "value": s}, {"dist": "uniform", "min": a, "max": b}
+    and {"dist": "lognormal", "median": m, "p99": p} (heavy right tail, like real APIs).
+    """
+    dist = latency.get("dist", "fixed")
+    if dist == "uniform":
+        return random.uniform(latency["min"], latency["max"])
+    if dist == "lognormal":
+        median = latency["median"]
+        sigma = math.log(max(latency["p99"], median) / median) / Z_99
+        return random.lognormvariate(math.log(median), sigma)
+    return float(latency.get("value", 0.0))
+
+
+class EndpointBehavior:
+    """Latency, error and rate-limit behavior of one stub endpoint, plus its counters."""
+
+    def __init__(self, name: str, config: Dict):
+        self.name = name
+        self.latency = config.get("latency", {"dist": "fixed", "value": 0.0})
+        self.error_rate = config.get("error_rate", 0.0)
+        self.rate_429 = config.get("rate_429", 0.0)
+        # Requests per second above which every request gets a 429 (None = unlimited)
+        self.max_rps = config.get("max_rps")
+        # Share of the latency spent before the first chunk of a streamed response
+        self.first_chunk_share = config.get("first_chunk_share", 0.2)
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self._window_start = time.monotonic()
+        self._window_count = 0
+
+    def _over_rate_limit(self) -> bool:
+        if not self.max_rps:
+            return False
+        now = time.monotonic()
+        if now - self._window_start >= 1.0:
+            self._window_start, self._window_count = now, 0
+        self._window_count += 1
+        return self._window_count > self.max_rps
+
+    async def respond(self) -> Optional[int]:
+        """
+        Wait out the sampled latency and decide the outcome.
+
+        Returns:
+            None for success, or the HTTP status code to fail with (429 or 500)
+        """
+        self.requests += 1
+        if self._over_rate_limit() or random.random() < self.rate_429:
+            self.throttled += 1
+            # Rate limits are answered fast, like the real APIs
+            await asyncio.sleep(min(0.05, sample_latency(self.latency)))
+            return 429
+        await asyncio.sleep(sample_latency(self.latency))
+        if random.random() < self.error_rate:
+            self.errors += 1
+            return 500
+        return None
+
+    async def respond_streaming(self) -> Tuple[Optional[int], float]:
+        """
+        Like respond(), but only wait out the time to the first chunk.
+
+        Returns:
+            (None or the HTTP status code to fail with, seconds to spread over the remaining chunks)
+        """
+        self.requests += 1
+        if self._over_rate_limit() or random.random() < self.rate_429:
+            self.throttled += 1
+            await asyncio.sleep(min(0.05, sample_latency(self.latency)))
+            return 429, 0.0
+        latency = sample_latency(self.latency)
+        await asyncio.sleep(latency * self.first_chunk_share)
+        if random.random() < self.error_rate:
+            self.errors += 1
+            return 500, 0.0
+        return None, latency * (1 - self.first_chunk_share)
+
+    def stats(self) -> Dict:
+        return {"requests": self.requests, "errors": self.errors, "throttled": self.throttled}
+
+
+def media_url(twilio_base_url: str, menu_id: int) -> str:
+    """URL of a stub menu photo, in the shape of a Twilio Media URL."""
+    return f"{twilio_base_url}/2010-04-01/Accounts/ACbench/Messages/MMbench/Media/{menu_id}"
+
+
+def make_menu_photo(menu_id: int, size: List[int]) -> bytes:
+    """
+    Draw a fake menu photo. Each menu_id gets its own layout, so different menus
+    differ in content hash and perceptual hash alike.
+    """
+    rng = random.Random(menu_id)
+    width, height = size
+    image = Image.new("RGB", (width, height), (rng.randint(200, 255), rng.randint(200, 240), rng.randint(180, 230)))
+    draw = ImageDraw.Draw(image)
+    # A few large dark panels (photos, headers) dominate the coarse structure
+    for _ in range(rng.randint(6, 12)):
+        x, y = rng.randrange(width), rng.randrange(height)
+        shade = rng.randint(0, 160)
+        draw.rectangle([x, y, x + rng.randint(width // 8, width // 2), y + rng.randint(height // 10, height // 3)],
+                       fill=(shade, shade, shade))
+    # Lines of "text"
+    line_height = max(20, height // rng.randint(30, 60))
+    for line in range(2, height // line_height - 2):
+        y = line * line_height
+        x_end = rng.randint(width // 3, width - width // 10)
+        draw.rectangle([width // 10, y, x_end, y + line_height // 3], fill=(40, 30, 20))
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=90)
+    return output.getvalue()
+
+
+def make_dish_photo() -> bytes:
+    output = io.BytesIO()
+    Image.new("RGB", (640, 480), (180, 120, 60)).save(output, "JPEG", quality=80)
+    return output.getvalue()
+
+
+class StubServers:
+    """
+    The three stub APIs, each served by uvicorn on its own local port in the current event loop.
+
+    Usage:
+        stubs = StubServers(profile)
+        await stubs.start()
+        ... point the app at stubs.openai_base_url, stubs.serper_base_url, stubs.twilio_base_url
+        await stubs.stop()
+    """
+
+    def __init__(self, profile: Dict, host: str = "127.0.0.1", base_port: int = 18700):
+        self.profile = profile
+        self.host = host
+        self.ports = {"openai": base_port, "serper": base_port + 1, "twilio": base_port + 2}
+        self.behaviors = {
+            name: EndpointBehavior(name, profile.get(name, {}))
+            for name in (
+                "openai_vision", "openai_text", "openai_images", "serper_search",
+                "serper_images", "twilio_messages", "twilio_media", "image_host",
+            )
+        }
+        self.menu_photos: Dict[int, bytes] = {}
+        self.dish_photo = make_dish_photo()
+        # to_number -> [(timestamp, body)]
+        self.messages: Dict[str, List] = {}
+        self._message_waiters: Dict[str, asyncio.Event] = {}
+        self._servers: List[uvicorn.Server] = []
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def openai_base_url(self) -> str:
+        return f"http://{self.host}:{self.ports['openai']}/v1"
+
+    @property
+    def serper_base_url(self) -> str:
+        return f"http://{self.host}:{self.ports['serper']}"
+
+    @property
+    def twilio_base_url(self) -> str:
+        return f"http://{self.host}:{self.ports['twilio']}"
+
+    def media_url(self, menu_id: int) -> str:
+        return media_url(self.twilio_base_url, menu_id)
+
+    def image_url(self, name: str) -> str:
+        return f"http://{self.host}:{self.ports['serper']}/img/{name}.jpg"
+
+    def restaurant_for(self, key: str) -> str:
+        """Pick a restaurant deterministically from some request content."""
+        index = int(hashlib.sha1(key.encode()).hexdigest(), 16) % self.profile["distinct_menus"]
+        return f"Bistro Number {index}"
+
+    def wait_for_message(self, to_number: str) -> asyncio.Event:
+        """Return an event that is set when the first message to to_number arrives."""
+        return self._message_waiters.setdefault(to_number, asyncio.Event())
+
+    def stats(self) -> Dict:
+        return {name: behavior.stats() for name, behavior in self.behaviors.items()}
+
+    def _error(self, status: int, message: str) -> JSONResponse:
+        headers = {"Retry-After": "1"} if status == 429 else {}
+        return JSONResponse({"error": {"message": message, "type": "stub_error", "code": status}}, status, headers=headers)
+
+    async def _stream_chunks(self, content: str, duration: float, completion_id: str, model: str):
+        """Server-sent chat completion chunks of content, evenly spread over duration seconds."""
+        pieces = [content[i:i + 8] for i in range(0, len(content), 8)]
+        for piece in pieces:
+            await asyncio.sleep(duration / len(pieces))
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        done = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+        yield f"data: {json.dumps(done)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    def _openai_app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.post("/v1/chat/completions")
+        async def chat_completions(request: Request):
+            body = await request.json()
+            messages = body.get("messages", [])
+            user_content = messages[-1].get("content") if messages else ""
+            is_vision = isinstance(user_content, list)
+            behavior = self.behaviors["openai_vision" if is_vision else "openai_text"]
+            if body.get("stream"):
+                status, rest = await behavior.respond_streaming()
+            else:
+                status, rest = await behavior.respond(), 0.0
+            if status:
+                return self._error(status, f"stub {behavior.name} failure")
+
+            if is_vision or "JSON parser" in json.dumps(messages[0]):
+                # Menu analysis (single pass, or the structuring step of two-pass)
+                image_part = next((part for part in user_content if part.get("type") == "image_url"), {}) if is_vision else {}
+                key = image_part.get("image_url", {}).get("url", "")[-4096:] or json.dumps(messages)[-4096:]
+                content = json.dumps({
+                    "restaurant_name": self.restaurant_for(key),
+                    "menu_items": DISHES,
+                    "cuisine_type": "french",
+                    "language": "English",
+                    "analysis": "A French bistro menu with classic dishes.",
+                })
+            else:
+                content = json.dumps({
+                    "best_reviewed": {"dish": "Duck Confit", "explanation": "Crispy and rich.", "highlights": "Loved by reviewers."},
+                    "worst_reviewed": {"dish": "Escargots", "explanation": "Mixed reviews.", "complaints": "Too much garlic."},
+                    "diet_option": {"dish": "Nicoise Salad", "explanation": "Light and fresh.", "ingredients": "Tuna, egg, greens, olives."},
+                })
+            if body.get("stream"):
+                return StreamingResponse(
+                    self._stream_chunks(content, rest, f"chatcmpl-stub-{behavior.requests}", body.get("model", "gpt-4o")),
+                    media_type="text/event-stream"
+                )
+            return {
+                "id": f"chatcmpl-stub-{behavior.requests}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "gpt-4o"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 1000, "completion_tokens": 200, "total_tokens": 1200},
+            }
+
+        @app.post("/v1/images/generations")
+        async def image_generations(request: Request):
+            status = await self.behaviors["openai_images"].respond()
+            if status:
+                return self._error(status, "stub image generation failure")
+            return {"created": int(time.time()), "data": [{"url": self.image_url("generated")}]}
+
+        return app
+
+    def _serper_app(self) -> FastAPI:
+        app = FastAPI()
+
+        def search_result(query: Dict) -> Dict:
+            q = query.get("q", "")
+            return {"organic": [
+                {
+                    "title": f"{q} - Reviews",
+                    "snippet": "Great duck confit, the escargots were disappointing, salad was fresh.",
+                    "link": f"https://maps.google.com/?q={hashlib.md5(q.encode()).hexdigest()[:8]}&review={i}",
+                }
+                for i in range(query.get("num", 5))
+            ]}
+
+        def images_result(query: Dict) -> Dict:
+            name = hashlib.md5(query.get("q", "").encode()).hexdigest()[:8]
+            return {"images": [
+                {"imageUrl": self.image_url(f"{name}-{i}"), "link": f"https://maps.google.com/photo/{name}/{i}"}
+                for i in range(query.get("num", 5))
+            ]}
+
+        async def handle(request: Request, behavior_name: str, build) -> Response:
+            status = await self.behaviors[behavior_name].respond()
+            if status:
+                return self._error(status, f"stub {behavior_name} failure")
+            body = await request.json()
+            # Serper accepts a list of queries in one request and answers with a list
+            if isinstance(body, list):
+                return JSONResponse([build(query) for query in body])
+            return JSONResponse(build(body))
+
+        @app.post("/search")
+        async def search(request: Request):
+            return await handle(request, "serper_search", search_result)
+
+        @app.post("/images")
+        async def images(request: Request):
+            return await handle(request, "serper_images", images_result)
+
+        @app.api_route("/img/{name}.jpg", methods=["GET", "HEAD"])
+        async def image(name: str):
+            status = await self.behaviors["image_host"].respond()
+            if status:
+                return Response(status_code=status)
+            return Response(self.dish_photo, media_type="image/jpeg")
+
+        return app
+
+    def _twilio_app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.post("/2010-04-01/Accounts/{account_sid}/Messages.json")
+        async def create_message(account_sid: str, request: Request):
+            form = await request.form()
+            status = await self.behaviors["twilio_messages"].respond()
+            if status:
+                return JSONResponse({"code": 20429 if status == 429 else 20500, "message": "stub failure", "status": status}, status)
+            to_number = str(form.get("To", "")).replace("whatsapp:", "")
+            self.messages.setdefault(to_number, []).append((time.perf_counter(), str(form.get("Body", ""))))
+            self.wait_for_message(to_number).set()
+            sid = f"SM{hashlib.md5(f'{to_number}{time.time()}'.encode()).hexdigest()}"
+            return JSONResponse({
+                "sid": sid, "account_sid": account_sid, "to": form.get("To"), "from": form.get("From"),
+                "body": form.get("Body"), "status": "queued", "num_media": "1" if form.get("MediaUrl") else "0",
+            }, 201)
+
+        @app.get("/2010-04-01/Accounts/{account_sid}/Messages/{message_sid}/Media/{menu_id}")
+        async def media(account_sid: str, message_sid: str, menu_id: int):
+            status = await self.behaviors["twilio_media"].respond()
+            if status:
+                return Response(status_code=status)
+            photo = self.menu_photos.get(menu_id)
+            if photo is None:
+                photo = await asyncio.to_thread(make_menu_photo, menu_id, self.profile["menu_photo_size"])
+                self.menu_photos[menu_id] = photo
+            return Response(photo, media_type="image/jpeg")
+
+        return app
+
+    async def start(self):
+        """Start all three stub servers and wait until they accept connections."""
+        apps = {"openai": self._openai_app(), "serper": self._serper_app(), "twilio": self._twilio_app()}
+        for name, app in apps.items():
+            config = uvicorn.Config(app, host=self.host, port=self.ports[name], log_level="warning", access_log=False)
+            server = uvicorn.Server(config)
+            self._servers.append(server)
+            self._tasks.append(asyncio.create_task(server.serve()))
+        while not all(server.started for server in self._servers):
+            await asyncio.sleep(0.05)
+
+    async def stop(self):
+        for server in self._servers:
+            server.should_exit = True
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._servers.clear()
+        self._tasks.clear()
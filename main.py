@@ -7,32 +7,145 @@ from fastapi import FastAPI, Request
 from fastapi.responses import Response
 from dotenv import load_dotenv
 import asyncio
-from typing import Optional
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 import time
 
 from utils.openai_helper import (
     analyze_menu_image,
-    summarize_reviews_and_recommend,
-    generate_dish_image
+    stream_recommendation,
+    generate_dish_image,
+    get_openai_stats,
+    close_openai_client
+)
+from utils.search_helper import (
+    search_google_reviews,
+    search_dish_image,
+    get_review_link_for_dish,
+    normalize_restaurant_name,
+    get_serper_batch_stats
 )
-from utils.search_helper import search_google_reviews, search_dish_image, get_review_link_for_dish
 from utils.whatsapp_helper import (
     send_whatsapp_message,
     format_recommendation_message,
+    format_follow_up_message,
     download_twilio_media,
-    download_and_verify_image_url
+    is_twilio_media_url,
+    download_and_verify_image_url,
+    first_accessible_image_url,
+    start_whatsapp_sender,
+    stop_whatsapp_sender,
+    get_sender_stats
+)
+from utils.cache_helper import PendingMenuStore, get_cache_stats
+from utils.http_helper import start_http_client, close_http_client
+from utils.image_helper import preprocess_menu_image, get_image_stats
+from utils.metrics_helper import span, set_request_id, render_metrics, render_stats_gauges
+from utils.resilience_helper import get_resilience_stats
+from utils.job_helper import (
+    JobScheduler,
+    JobStore,
+    LatencyBudget,
+    spawn_background,
+    JOB_BUDGET_MIN_STAGE_SECONDS,
+    JOB_BUDGET_REVIEW_SEARCH_MIN_SECONDS,
+    JOB_MAX_IN_FLIGHT,
+    JOB_QUEUE_SIZE,
+    JOB_STORE_ENABLED,
+    JOB_DB_PATH
 )
+from utils.pipeline_helper import Pipeline, Stage, StopPipeline
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI(title="MenuMate API", version="1.0.0")
 
-# In-memory cache to store menu images when waiting for restaurant name
-# Format: {phone_number: {"image_url": str, "user_question": str, "timestamp": float}}
-# Cache expires after 10 minutes
-pending_menu_cache = {}
-CACHE_EXPIRY_SECONDS = 600  # 10 minutes
+# Menu jobs run on a fixed worker pool behind a bounded queue. When the queue is
+# full the user gets a "busy" reply instead of another unbounded background task.
+menu_jobs = JobScheduler("menu", max_in_flight=JOB_MAX_IN_FLIGHT, queue_size=JOB_QUEUE_SIZE)
+
+# Durable record of webhook jobs by MessageSid (deduplication + resume after restart)
+job_store = JobStore(JOB_DB_PATH) if JOB_STORE_ENABLED else None
+
+BUSY_MESSAGE = "⏳ MenuMate is very busy right now. Please send your menu photo again in a minute!"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start shared clients and workers on startup; drain and close them on shutdown."""
+    await start_http_client()
+    start_whatsapp_sender()
+    menu_jobs.start()
+    pending_menus.start_sweeper()
+    if job_store:
+        job_store.start_purger()
+        # Resume jobs interrupted by the last restart or redeploy
+        for job_id, payload in job_store.take_interrupted():
+            print(f"Resuming interrupted job {job_id}")
+            if not menu_jobs.submit(
+                run_menu_job,
+                job_id,
+                payload["from_number"],
+                # Jobs recorded before multi-image support stored a single image_url
+                payload.get("image_urls") or [payload["image_url"]],
+                payload["user_question"]
+            ):
+                job_store.mark_finished(job_id, "rejected")
+    yield
+    # Let running menu jobs finish (and queue their replies) before the sender drains
+    await menu_jobs.stop()
+    await pending_menus.stop_sweeper()
+    if job_store:
+        await job_store.stop_purger()
+    await stop_whatsapp_sender()
+    await close_http_client()
+    await close_openai_client()
+
+
+app = FastAPI(title="MenuMate API", version="1.0.0", lifespan=lifespan)
+
+# Menus whose restaurant name couldn't be found, parked per phone number until
+# the user replies with the name (the finished analysis, bounded by bytes)
+pending_menus = PendingMenuStore(
+    "pending_menus",
+    max_entries=int(os.getenv("PENDING_MENU_MAX_ENTRIES", "1000")),
+    max_bytes=int(os.getenv("PENDING_MENU_MAX_BYTES", str(8 * 1024 * 1024))),
+    ttl_seconds=float(os.getenv("PENDING_MENU_TTL_SECONDS", "600")),
+    sweep_seconds=float(os.getenv("PENDING_MENU_SWEEP_SECONDS", "60"))
+)
+
+# Per-branch timeouts (seconds) for the review link / dish image fan-out.
+# A branch that exceeds its timeout is dropped; the message is sent without it.
+# Each is also capped by whatever is left of the job's latency budget.
+LINK_LOOKUP_TIMEOUT_SECONDS = float(os.getenv("LINK_LOOKUP_TIMEOUT_SECONDS", "8"))
+DISH_IMAGE_TIMEOUT_SECONDS = float(os.getenv("DISH_IMAGE_TIMEOUT_SECONDS", "45"))
+
+# Start the review search from the message text while the menu image is still
+# being analyzed. The result is used only if the name turns out to be right.
+SPECULATIVE_REVIEW_SEARCH = os.getenv("SPECULATIVE_REVIEW_SEARCH", "true").lower() == "true"
+
+# Maximum photos analyzed per message (Twilio allows up to 10 per WhatsApp message)
+MAX_MENU_IMAGES = int(os.getenv("MAX_MENU_IMAGES", "5"))
+
+# Send the text recommendation as soon as it's ready; review links and the
+# dish photo follow in a second message
+PROGRESSIVE_REPLIES = os.getenv("PROGRESSIVE_REPLIES", "true").lower() == "true"
+
+# Rotate, downscale and re-encode menu photos before vision analysis
+IMAGE_PREPROCESSING = os.getenv("IMAGE_PREPROCESSING", "true").lower() == "true"
+# Photos preprocessed at once; each decode holds a full image in memory
+IMAGE_PREPROCESS_CONCURRENCY = int(os.getenv("IMAGE_PREPROCESS_CONCURRENCY", "2"))
+preprocess_semaphore = asyncio.Semaphore(IMAGE_PREPROCESS_CONCURRENCY)
+
+# Default questions that should never be mistaken for a restaurant name
+DEFAULT_QUESTIONS = ["what should i order?", "what should i order", "what to eat here", ""]
+
+# Messages asking for a fresh recommendation bypass the recommendation cache
+RETRY_PHRASES = ["try again", "retry", "something else", "other options", "another suggestion"]
+
+# Placeholder dish names that should never trigger link or image lookups
+BEST_DISH_PLACEHOLDERS = ["ask the waiter for recommendations", "not available", "n/a"]
+OTHER_DISH_PLACEHOLDERS = ["not available", "n/a"]
 
 
 @app.get("/")
@@ -53,165 +166,594 @@ async def health():
     return {"status": "ok"}
 
 
-async def process_menu_request(
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: per-stage latency histograms, error counters and in-flight gauges."""
+    body = render_metrics([
+        *render_stats_gauges("menumate_menu_jobs", {"": menu_jobs.stats()}, help_text="Menu job worker pool"),
+        *render_stats_gauges("menumate_whatsapp_sender", {"": get_sender_stats()}, help_text="Outbound WhatsApp send queue"),
+        *render_stats_gauges("menumate_openai", get_openai_stats(), label="model_family", help_text="OpenAI concurrency limiter"),
+        *render_stats_gauges("menumate_cache", get_cache_stats(), label="cache", help_text="In-process cache"),
+        *render_stats_gauges(
+            "menumate_circuit_breaker", get_resilience_stats(), label="dependency",
+            help_text="External API circuit breaker and retry counters"
+        ),
+        *render_stats_gauges(
+            "menumate_serper_batch", get_serper_batch_stats(), label="endpoint",
+            help_text="Batched Serper per-dish queries"
+        ),
+    ])
+    return Response(content=body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/stats")
+async def stats():
+    """Cache hit/miss counters, OpenAI concurrency and send queue depth, for sizing caches and limits."""
+    return {
+        "caches": get_cache_stats(),
+        "openai": get_openai_stats(),
+        "whatsapp_sender": get_sender_stats(),
+        "menu_jobs": menu_jobs.stats(),
+        "job_store": job_store.stats() if job_store else None,
+        "circuit_breakers": get_resilience_stats(),
+        "serper_batches": get_serper_batch_stats(),
+        "image_preprocessing": get_image_stats()
+    }
+
+
+def guess_restaurant_name_from_message(user_question: Optional[str]) -> Optional[str]:
+    """
+    Guess a restaurant name from the user's text message.
+    
+    A short message that isn't a question or one of the default prompts is
+    treated as the restaurant name.
+    
+    Returns:
+        The guessed restaurant name, or None if the message doesn't look like one
+    """
+    if not user_question or user_question.lower() in DEFAULT_QUESTIONS:
+        return None
+    # "Try again" and friends ask for a new recommendation; they never name a restaurant
+    if wants_fresh_recommendation(user_question):
+        return None
+    potential_name = user_question.strip()
+    if potential_name.endswith("?") or len(potential_name.split()) > 5:
+        return None
+    return potential_name
+
+
+def wants_fresh_recommendation(user_question: Optional[str]) -> bool:
+    """Return True if the user is asking for a new recommendation rather than a repeat."""
+    if not user_question:
+        return False
+    question = user_question.lower()
+    return any(phrase in question for phrase in RETRY_PHRASES)
+
+
+async def find_dish_image(
+    restaurant_name: Optional[str],
+    dish_name: str,
+    cuisine_type: str,
+    budget: Optional[LatencyBudget] = None
+) -> tuple[Optional[str], Optional[str], Optional[str]]:
+    """
+    Find a real photo of the dish, falling back to DALL-E 3.
+    
+    The top image search results are verified concurrently and the first
+    reachable one is used; DALL-E only runs if none of them is.
+    
+    With a latency budget, DALL-E is skipped once too little time is left for
+    it, and so is the image search after that.
+    
+    Returns:
+        Tuple of (image_url, image_source, review_link); all None if no usable image
+    """
+    print(f"Searching for real photo of dish: {dish_name}")
+    
+    # First, try to find a real photo from Google Images (often from reviews)
+    if restaurant_name and (budget is None or budget.allows("image_search")):
+        candidates = await search_dish_image(restaurant_name, dish_name)
+        if candidates:
+            with span("verification") as stage:
+                index = await first_accessible_image_url([image_url for image_url, _ in candidates])
+                if index is None:
+                    stage.fail("unreachable")
+            if index is not None:
+                image_url, review_link = candidates[index]
+                print(f"Found real photo from Google Images (candidate {index + 1} of {len(candidates)})")
+                return image_url, "google", review_link
+            print(f"None of the {len(candidates)} Google Images results is accessible")
+    
+    # If no real photo found, generate one with DALL-E 3
+    if budget is None or budget.allows("image_generation"):
+        print(f"No real photo found, generating image with DALL-E 3 for: {dish_name}")
+        dish_image_url = await generate_dish_image(
+            restaurant_name or "restaurant",
+            dish_name,
+            cuisine_type
+        )
+        if dish_image_url:
+            print(f"Generated image with DALL-E 3: {dish_image_url[:80]}...")
+            # Generated URLs are one-off, so their verification isn't cached
+            with span("verification") as stage:
+                verified_url = await download_and_verify_image_url(dish_image_url, use_cache=False)
+                if not verified_url:
+                    stage.fail("unreachable")
+            if verified_url:
+                return verified_url, "generated", None
+            print("Warning: Generated image URL is not accessible")
+    
+    print("Failed to find or generate dish image, will send without image")
+    return None, None, None
+
+
+async def send_message_with_image(
     from_number: str,
+    message: str,
+    image_url: Optional[str],
+    dish_name: str
+):
+    """
+    Send a message with the dish photo attached, falling back to separate
+    messages and then to text only if Twilio rejects the media.
+    """
+    if not image_url:
+        # Send message without image
+        print("ℹ️ Sending message without image (no image available or verification failed)")
+        await send_whatsapp_message(from_number, message)
+        return
+    
+    print(f"🖼️ Sending message with dish image URL: {image_url[:80]}...")
+    
+    # Try sending message with image first
+    success = await send_whatsapp_message(
+        from_number,
+        message,
+        media_url=image_url
+    )
+    
+    if success:
+        print("✅ Message with image sent successfully!")
+        return
+    
+    # Fallback: Try sending image as separate message first, then text
+    print("⚠️ Failed to send with image, trying separate messages...")
+    image_only_success = await send_whatsapp_message(
+        from_number,
+        f"🖼️ Here's what {dish_name} looks like:",
+        media_url=image_url
+    )
+    
+    if image_only_success:
+        print("✅ Image sent separately, now sending text message...")
+    else:
+        print("⚠️ Failed to send image separately, sending text only...")
+    await send_whatsapp_message(from_number, message)
+
+
+async def analyze_menu_page(
     image_url: str,
     user_question: str
-):
+) -> Tuple[Optional[dict], Optional[str]]:
     """
-    Process menu analysis in the background.
-    This function runs after we've responded to Twilio.
+    Download one menu photo (if it's a Twilio Media URL) and analyze it with GPT-4o.
+    
+    Returns:
+        (menu_analysis, None) on success, or (None, message for the user) on failure
     """
-    try:
-        # Step 1: Download and convert Twilio media if needed
-        # Twilio Media URLs require authentication, so we download and convert to base64
-        processed_image_url = image_url
-        
-        if image_url and "api.twilio.com" in image_url:
-            # This is a Twilio Media URL - download and convert to base64
-            print(f"Downloading Twilio media: {image_url}")
-            downloaded_image = await download_twilio_media(image_url)
-            if downloaded_image:
-                processed_image_url = downloaded_image
-                print("Successfully downloaded and converted Twilio media")
-            else:
-                await send_whatsapp_message(
-                    from_number,
-                    "⚠️ Sorry, I couldn't download the image from Twilio. Please try sending it again."
-                )
-                return
-        
-        # Step 2: Analyze the menu image with GPT-4o
-        menu_analysis = await analyze_menu_image(processed_image_url, user_question)
-        
-        if "error" in menu_analysis:
-            await send_whatsapp_message(
-                from_number,
-                f"⚠️ Sorry, I had trouble analyzing the image. Error: {menu_analysis.get('error', 'Unknown error')}"
-            )
-            return
-        
-        restaurant_name = menu_analysis.get("restaurant_name")
-        # Handle null values (could be None, "null", or empty string)
-        if not restaurant_name or restaurant_name in ["null", "None", ""]:
-            restaurant_name = None
-        
-        menu_items = menu_analysis.get("menu_items", [])
-        cuisine_type = menu_analysis.get("cuisine_type", "unknown")
-        
-        # Step 2.5: Check if user provided restaurant name in the text message
-        if not restaurant_name:
-            if user_question and user_question.lower() not in ["what should i order?", "what should i order", "what to eat here",""]:
-                # Try to extract restaurant name from user question
-                # If it's a simple name (not a question), use it
-                potential_name = user_question.strip()
-                # If it doesn't look like a question, treat as restaurant name
-                if not potential_name.endswith("?") and len(potential_name.split()) <= 5:
-                    restaurant_name = potential_name
-                    print(f"Using restaurant name from user message: {restaurant_name}")
+    # Step 1: Download Twilio media if needed
+    # Twilio Media URLs require authentication, so we download the raw bytes ourselves.
+    # The image is held once as bytes; the base64 data URL is only built for the OpenAI call.
+    image = image_url
+    image_bytes = None
+    content_type = "image/jpeg"
+    
+    if is_twilio_media_url(image_url):
+        # This is a Twilio Media URL - stream it down with a size cap
+        print(f"Downloading Twilio media: {image_url}")
+        with span("media_download") as stage:
+            downloaded = await download_twilio_media(image_url)
+            if not downloaded:
+                stage.fail("rejected")
+        if not downloaded:
+            return None, "⚠️ Sorry, I couldn't download that image. It may be too large or not a photo - please try sending it again."
+        image_bytes, content_type = downloaded
+        image = image_bytes
+        print(f"Successfully downloaded Twilio media ({len(image_bytes)} bytes, {content_type})")
+    
+    # Step 1.5: Rotate, downscale and re-encode the photo before sending it to the model
+    detail = "high"
+    if image_bytes and IMAGE_PREPROCESSING:
+        async with preprocess_semaphore:
+            with span("preprocess"):
+                preprocessed = await asyncio.to_thread(preprocess_menu_image, image_bytes)
+        if preprocessed:
+            image = preprocessed["image_bytes"]
+            content_type = preprocessed["content_type"]
+            detail = preprocessed["detail"]
+    
+    # Step 2: Analyze the menu image with GPT-4o
+    # The analysis cache is keyed by the original downloaded bytes, not the preprocessed ones
+    menu_analysis = await analyze_menu_image(
+        image,
+        user_question,
+        image_bytes=image_bytes,
+        detail=detail,
+        content_type=content_type
+    )
+    
+    if "error" in menu_analysis:
+        return None, f"⚠️ Sorry, I had trouble analyzing the image. Error: {menu_analysis.get('error', 'Unknown error')}"
+    
+    return menu_analysis, None
+
+
+def most_common(values: List[str]) -> Optional[str]:
+    """Return the most frequent value, preferring the earliest on ties (None if empty)."""
+    counts: Dict[str, int] = {}
+    for value in values:
+        counts[value] = counts.get(value, 0) + 1
+    return max(counts, key=counts.get) if counts else None
+
+
+def merge_menu_analyses(analyses: List[dict]) -> dict:
+    """
+    Combine the analyses of several pages of one menu into a single analysis.
+    
+    Menu items are concatenated in page order without duplicates. The restaurant
+    name is the one most pages agree on (compared after normalization), and the
+    cuisine type and language are the most common known values.
+    
+    Args:
+        analyses: Successful per-page analyses, in page order
         
-        # Step 3: Search for Google Reviews (only if restaurant name is available)
-        reviews_data = "No reviews available."
-        if restaurant_name:
-            reviews_data = await search_google_reviews(restaurant_name)
+    Returns:
+        One analysis in the same shape as a single-page analysis
+    """
+    if len(analyses) == 1:
+        return analyses[0]
+    
+    menu_items = []
+    seen_items = set()
+    for analysis in analyses:
+        for item in analysis.get("menu_items") or []:
+            key = " ".join(str(item).casefold().split())
+            if key and key not in seen_items:
+                seen_items.add(key)
+                menu_items.append(item)
+    
+    # Each page votes for its (normalized) name; keep the first spelling seen for the winner
+    names = {}
+    name_votes = []
+    for analysis in analyses:
+        name = analysis.get("restaurant_name")
+        key = normalize_restaurant_name(name) if name not in ["null", "None"] else ""
+        if key:
+            names.setdefault(key, name)
+            name_votes.append(key)
+    restaurant_key = most_common(name_votes)
+    if len(names) > 1:
+        print(f"Pages disagree on the restaurant name {list(names.values())}, using: {names[restaurant_key]}")
+    
+    def most_common_known(field: str) -> str:
+        values = [analysis.get(field) for analysis in analyses]
+        return most_common([value for value in values if value and value != "unknown"]) or "unknown"
+    
+    analysis_text = "\n\n".join(
+        f"[Page {page}] {analysis.get('analysis', '')}" for page, analysis in enumerate(analyses, start=1)
+    )
+    return {
+        "restaurant_name": names[restaurant_key] if restaurant_key else None,
+        "menu_items": menu_items,
+        "cuisine_type": most_common_known("cuisine_type"),
+        "language": most_common_known("language"),
+        "analysis": analysis_text,
+        "raw_analysis": analysis_text,
+        "pages": len(analyses),
+    }
+
+
+async def download_and_analyze_menu(
+    from_number: str,
+    image_urls: List[str],
+    user_question: str,
+    budget: Optional[LatencyBudget] = None
+) -> Optional[dict]:
+    """
+    Download and analyze every attached menu photo concurrently and merge the results.
+    
+    Pages are independent, so the total latency is that of the slowest page.
+    A page that fails (or outlasts the latency budget) is skipped as long as
+    at least one page succeeds.
+    
+    Returns:
+        Merged menu analysis, or None if every page failed (the user has
+        already been told)
+    """
+    async def analyze_page_within_budget(image_url: str) -> Tuple[Optional[dict], Optional[str]]:
+        # Reading the menu is required, so it gets at least JOB_BUDGET_MIN_STAGE_SECONDS
+        timeout = budget.timeout(floor=JOB_BUDGET_MIN_STAGE_SECONDS) if budget else None
+        try:
+            return await asyncio.wait_for(analyze_menu_page(image_url, user_question), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"⏱️ Menu page {image_url} timed out after {timeout:.0f}s")
+            return None, "⏱️ Sorry, reading your menu took too long. Please try sending it again in a moment."
+    
+    results = await asyncio.gather(*(
+        analyze_page_within_budget(image_url) for image_url in image_urls
+    ))
+    
+    analyses = [analysis for analysis, _ in results if analysis is not None]
+    errors = [error for _, error in results if error]
+    if not analyses:
+        await send_whatsapp_message(from_number, errors[0])
+        return None
+    if errors:
+        print(f"Skipping {len(errors)} of {len(image_urls)} menu pages that failed: {errors}")
+    
+    return merge_menu_analyses(analyses)
+
+
+# Menu pipeline stages. Each stage function takes the pipeline values it
+# declares as inputs (keyword arguments of the same name); MENU_PIPELINE and
+# FOLLOW_UP_PIPELINE below wire them into a graph.
+
+def start_speculative_review_search(user_question: str) -> Optional[Tuple[str, asyncio.Task]]:
+    """
+    Start a review search for a restaurant name guessed from the message text.
+    
+    Runs alongside media download and vision analysis; the result is used only
+    if the menu turns out to name the same restaurant.
+    
+    Returns:
+        (guessed name, running search task), or None if the message names no restaurant
+    """
+    speculative_name = guess_restaurant_name_from_message(user_question)
+    if not speculative_name:
+        return None
+    print(f"Speculatively searching reviews for: {speculative_name}")
+    return speculative_name, asyncio.create_task(search_google_reviews(speculative_name))
+
+
+def cancel_speculative_review_search(speculative_reviews: Optional[Tuple[str, asyncio.Task]]):
+    """Never leave the speculative search running past the job (early return or error)."""
+    if speculative_reviews and not speculative_reviews[1].done():
+        speculative_reviews[1].cancel()
+
+
+async def analyze_menu_photos(
+    from_number: str,
+    image_urls: List[str],
+    user_question: str,
+    budget: LatencyBudget
+) -> dict:
+    """Steps 1-2: Download and analyze the menu images; stop the pipeline if none could be read."""
+    menu_analysis = await download_and_analyze_menu(from_number, image_urls, user_question, budget)
+    if menu_analysis is None:
+        raise StopPipeline("no menu page could be analyzed")
+    return menu_analysis
+
+
+def park_unnamed_menu(
+    from_number: str,
+    restaurant_name: Optional[str],
+    menu_analysis: dict,
+    user_question: str
+) -> bool:
+    """
+    Park the menu when no restaurant name was found, so a follow-up text with
+    the name resumes from the review search instead of re-reading the photo.
+    A menu that did name its restaurant replaces anything parked earlier.
+    
+    Returns:
+        True if the menu was parked
+    """
+    if restaurant_name:
+        pending_menus.discard(from_number)
+        return False
+    parked = pending_menus.park(from_number, {
+        "menu_analysis": menu_analysis,
+        "user_question": user_question,
+    })
+    if parked:
+        print(f"Parked menu for {from_number} until the restaurant name arrives")
+    return parked
+
+
+def extract_menu_details(menu_analysis: dict, user_question: str) -> dict:
+    """
+    Pick the restaurant name, cuisine type and menu items out of the menu analysis.
+    Falls back to a restaurant name given in the message text.
+    """
+    restaurant_name = menu_analysis.get("restaurant_name")
+    # Handle null values (could be None, "null", or empty string)
+    if not restaurant_name or restaurant_name in ["null", "None", ""]:
+        restaurant_name = None
+    
+    # Step 2.5: Check if user provided restaurant name in the text message
+    if not restaurant_name:
+        potential_name = guess_restaurant_name_from_message(user_question)
+        if potential_name:
+            restaurant_name = potential_name
+            print(f"Using restaurant name from user message: {restaurant_name}")
+    
+    return {
+        "restaurant_name": restaurant_name,
+        "cuisine_type": menu_analysis.get("cuisine_type", "unknown"),
+        "menu_items": menu_analysis.get("menu_items", []),
+    }
+
+
+def menu_display_name(restaurant_name: Optional[str], parked: bool) -> str:
+    """Restaurant line of the reply; only invite a reply with the name if the menu is waiting for it."""
+    if restaurant_name:
+        return restaurant_name
+    if parked:
+        return "We could not identify your restaurant name from the menu image. Reply with the restaurant name and I'll check what reviewers say about these dishes"
+    return "We could not identify your restaurant name from the menu image"
+
+
+async def search_reviews(
+    restaurant_name: Optional[str],
+    speculative_reviews: Optional[Tuple[str, asyncio.Task]]
+) -> str:
+    """Step 3: Search for Google Reviews (only if restaurant name is available)."""
+    if speculative_reviews:
+        speculative_name, speculative_task = speculative_reviews
+        if restaurant_name and normalize_restaurant_name(restaurant_name) == normalize_restaurant_name(speculative_name):
+            print("Using speculative review search result")
+            return await speculative_task
+        print(f"Discarding speculative review search for: {speculative_name}")
+        speculative_task.cancel()
+    
+    if restaurant_name:
+        return await search_google_reviews(restaurant_name)
+    
+    # No restaurant name found - proceed without reviews, analyze menu only
+    print("No restaurant name found. Proceeding with menu analysis only (no review search).")
+    return "No reviews available. Analyzing menu items only."
+
+
+async def recommend_dishes(
+    reviews: str,
+    menu_items: List[str],
+    restaurant_name: Optional[str],
+    user_question: str
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Step 4: Summarize reviews and get three recommendations.
+    
+    Streams the completion and publishes each dish name as soon as the model
+    has written it, so the link and photo lookups for the best dish start
+    while the explanations are still being generated.
+    """
+    async for section, value in stream_recommendation(
+        reviews,
+        menu_items,
+        restaurant_name or "the restaurant",
+        use_cache=not wants_fresh_recommendation(user_question)
+    ):
+        if section == "recommendation":
+            yield "recommendation", value
         else:
-            # No restaurant name found - proceed without reviews, analyze menu only
-            print("No restaurant name found. Proceeding with menu analysis only (no review search).")
-            reviews_data = "No reviews available. Analyzing menu items only."
-        
-        # Step 4: Summarize reviews and get three recommendations
-        recommendation = await summarize_reviews_and_recommend(
-            reviews_data,
-            menu_items,
-            restaurant_name or "the restaurant"
-        )
-        
-        best_reviewed = recommendation.get("best_reviewed", {
+            yield f"{section}_dish", value["dish"]
+
+
+def split_recommendation(recommendation: dict) -> dict:
+    """Split the recommendation into its three dishes, filling in placeholders for missing ones."""
+    return {
+        "best_reviewed": recommendation.get("best_reviewed", {
             "dish": "Ask the waiter for recommendations",
             "explanation": "Based on available information.",
             "highlights": "No reviews available."
-        })
-        worst_reviewed = recommendation.get("worst_reviewed", {
+        }),
+        "worst_reviewed": recommendation.get("worst_reviewed", {
             "dish": "Not available",
             "explanation": "Unable to determine.",
             "complaints": "No complaints data available."
-        })
-        diet_option = recommendation.get("diet_option", {
+        }),
+        "diet_option": recommendation.get("diet_option", {
             "dish": "Not available",
             "explanation": "Unable to determine.",
             "ingredients": "No ingredient data available."
-        })
-        
-        # Step 4.5: Get review links for each dish
-        best_dish_name = best_reviewed.get("dish", "")
-        worst_dish_name = worst_reviewed.get("dish", "")
-        diet_dish_name = diet_option.get("dish", "")
-        
-        best_review_link = None
-        worst_review_link = None
-        diet_review_link = None
-        
-        if restaurant_name:
-            if best_dish_name and best_dish_name.lower() not in ["ask the waiter for recommendations", "not available", "n/a"]:
-                print(f"Getting review link for best reviewed dish: {best_dish_name}")
-                best_review_link = await get_review_link_for_dish(restaurant_name, best_dish_name)
-            
-            if worst_dish_name and worst_dish_name.lower() not in ["not available", "n/a"]:
-                print(f"Getting review link for worst reviewed dish: {worst_dish_name}")
-                worst_review_link = await get_review_link_for_dish(restaurant_name, worst_dish_name)
-            
-            if diet_dish_name and diet_dish_name.lower() not in ["not available", "n/a"]:
-                print(f"Getting review link for diet option: {diet_dish_name}")
-                diet_review_link = await get_review_link_for_dish(restaurant_name, diet_dish_name)
-        
-        # Step 5: Find or generate dish image for best reviewed option
-        dish_image_url = None
-        image_source = None  # Track where the image came from
-        review_link = None  # Track review link if from Google
-        
-        best_dish = best_reviewed.get("dish", "")
-        if best_dish and best_dish.lower() not in ["ask the waiter for recommendations", "not available", "n/a"]:
-            print(f"Searching for real photo of dish: {best_dish}")
-            
-            # First, try to find a real photo from Google Images (often from reviews)
-            if restaurant_name:
-                image_url, source_link = await search_dish_image(restaurant_name, best_dish)
-                if image_url:
-                    dish_image_url = image_url
-                    review_link = source_link
-                    image_source = "google"
-                    print(f"Found real photo from Google Images")
-            
-            # If no real photo found, generate one with DALL-E 3
-            if not dish_image_url:
-                print(f"No real photo found, generating image with DALL-E 3 for: {best_dish}")
-                dish_image_url = await generate_dish_image(
-                    restaurant_name or "restaurant",
-                    best_dish,
-                    cuisine_type
-                )
-                if dish_image_url:
-                    image_source = "generated"
-                    print(f"Generated image with DALL-E 3")
-            
-            if dish_image_url:
-                print(f"Successfully found/generated dish image: {dish_image_url[:80]}...")
-                # Verify the URL is accessible before sending
-                verified_url = await download_and_verify_image_url(dish_image_url)
-                if verified_url:
-                    dish_image_url = verified_url
-                    print("Image URL verified and ready to send")
-                else:
-                    print("Warning: Image URL is not accessible, will send without image")
-                    dish_image_url = None
-                    image_source = None
-                    review_link = None
-            else:
-                print("Failed to find or generate dish image, will send without image")
-        
-        # Step 6: Format and send response
+        }),
+    }
+
+
+def is_real_dish(dish_name: Optional[str], placeholders: List[str]) -> bool:
+    """Return True if a recommended dish name is an actual dish rather than a placeholder."""
+    return bool(dish_name) and dish_name.lower() not in placeholders
+
+
+def review_link_stage(
+    dish_key: str,
+    label: str,
+    placeholders: List[str],
+    budget_step: Optional[str] = None
+) -> Stage:
+    """
+    Build the step 4.5 stage that looks up a review link for one recommended dish.
+    
+    Args:
+        dish_key: Recommendation section of the dish ("best_reviewed", "worst_reviewed", "diet_option")
+        label: How the dish is described in the log
+        placeholders: Dish names that mean "no dish" and skip the lookup
+        budget_step: Latency budget step that drops this lookup when time runs low
+    """
+    dish_value = f"{dish_key}_dish"
+    
+    def wanted(values: dict) -> bool:
+        if not values["restaurant_name"] or not is_real_dish(values[dish_value], placeholders):
+            return False
+        return budget_step is None or values["budget"].allows(budget_step)
+    
+    async def lookup(restaurant_name: str, **dishes) -> Optional[str]:
+        dish_name = dishes[dish_value]
+        print(f"Getting review link for {label}: {dish_name}")
+        return await get_review_link_for_dish(restaurant_name, dish_name)
+    
+    output = f"{dish_key.split('_')[0]}_review_link"
+    return Stage(
+        output,
+        lookup,
+        inputs=("restaurant_name", dish_value),
+        when=wanted,
+        optional=True,
+        timeout=lambda values: values["budget"].timeout(LINK_LOOKUP_TIMEOUT_SECONDS)
+    )
+
+
+async def find_best_dish_image(
+    restaurant_name: Optional[str],
+    best_reviewed_dish: str,
+    cuisine_type: str,
+    budget: LatencyBudget
+) -> Optional[Tuple[str, str, Optional[str]]]:
+    """Step 5: Photo of the best reviewed dish, as (image_url, image_source, review_link)."""
+    image_url, image_source, review_link = await find_dish_image(
+        restaurant_name,
+        best_reviewed_dish,
+        cuisine_type,
+        budget
+    )
+    return (image_url, image_source, review_link) if image_url else None
+
+
+async def send_recommendation_text(
+    from_number: str,
+    display_name: str,
+    best_reviewed: dict,
+    worst_reviewed: dict,
+    diet_option: dict
+) -> bool:
+    """Step 6a: With PROGRESSIVE_REPLIES the text recommendation goes out as soon as it exists."""
+    message = format_recommendation_message(display_name, best_reviewed, worst_reviewed, diet_option)
+    await send_whatsapp_message(from_number, message)
+    return True
+
+
+async def send_recommendation_extras(
+    from_number: str,
+    display_name: str,
+    best_reviewed: dict,
+    worst_reviewed: dict,
+    diet_option: dict,
+    sent_text: Optional[bool],
+    best_review_link: Optional[str],
+    worst_review_link: Optional[str],
+    diet_review_link: Optional[str],
+    dish_image: Optional[Tuple[str, str, Optional[str]]]
+) -> bool:
+    """
+    Step 6: Send the review links and dish photo, as a follow-up to the text
+    already sent or, without PROGRESSIVE_REPLIES, together with it.
+    """
+    image_url, image_source, review_link = dish_image or (None, None, None)
+    best_dish = best_reviewed.get("dish", "")
+    
+    if not PROGRESSIVE_REPLIES:
         message = format_recommendation_message(
-            restaurant_name or "We could not identify your restaurant name from the menu image, but you can make a new request with the restaurant name in the text message and menu image",
+            display_name,
             best_reviewed,
             worst_reviewed,
             diet_option,
@@ -221,47 +763,197 @@ async def process_menu_request(
             worst_review_link,
             diet_review_link
         )
+        await send_message_with_image(from_number, message, image_url, best_dish)
+        return True
+    
+    # Step 6b: Links and photo follow when they're ready
+    follow_up = format_follow_up_message(
+        best_reviewed,
+        worst_reviewed,
+        diet_option,
+        image_source,
+        review_link,
+        best_review_link,
+        worst_review_link,
+        diet_review_link
+    )
+    if follow_up:
+        await send_message_with_image(from_number, follow_up, image_url, best_dish)
+    return True
+
+
+# Steps 3-6, shared by both entry points. The review links and dish photo only
+# need a dish name, so they start as soon as the streamed recommendation names
+# each dish and run concurrently with the rest of the completion, each other
+# and sending the text.
+REPLY_STAGES = [
+    Stage(
+        "reviews",
+        search_reviews,
+        inputs=("restaurant_name", "speculative_reviews"),
+        # Gets what's left of the budget, but never less than a normal search
+        # needs; if it still times out the recommendation goes without reviews
+        timeout=lambda values: values["budget"].timeout(floor=JOB_BUDGET_REVIEW_SEARCH_MIN_SECONDS),
+        optional=True,
+        default="No reviews available.",
+        checkpoint=True
+    ),
+    Stage(
+        "recommendation",
+        recommend_dishes,
+        inputs=("reviews", "menu_items", "restaurant_name", "user_question"),
+        outputs=("best_reviewed_dish", "worst_reviewed_dish", "diet_option_dish", "recommendation"),
+        timeout=lambda values: values["budget"].timeout(floor=JOB_BUDGET_MIN_STAGE_SECONDS),
+        checkpoint=True
+    ),
+    Stage(
+        "dishes",
+        split_recommendation,
+        inputs=("recommendation",),
+        outputs=("best_reviewed", "worst_reviewed", "diet_option")
+    ),
+    review_link_stage("best_reviewed", "best reviewed dish", BEST_DISH_PLACEHOLDERS),
+    review_link_stage("worst_reviewed", "worst reviewed dish", OTHER_DISH_PLACEHOLDERS, "worst_links"),
+    review_link_stage("diet_option", "diet option", OTHER_DISH_PLACEHOLDERS, "diet_links"),
+    Stage(
+        "dish_image",
+        find_best_dish_image,
+        inputs=("restaurant_name", "best_reviewed_dish", "cuisine_type", "budget"),
+        when=lambda values: is_real_dish(values["best_reviewed_dish"], BEST_DISH_PLACEHOLDERS),
+        optional=True,
+        timeout=lambda values: values["budget"].timeout(DISH_IMAGE_TIMEOUT_SECONDS)
+    ),
+    Stage(
+        "sent_text",
+        send_recommendation_text,
+        inputs=("from_number", "display_name", "best_reviewed", "worst_reviewed", "diet_option"),
+        when=lambda values: PROGRESSIVE_REPLIES,
+        checkpoint=True
+    ),
+    Stage(
+        "sent",
+        send_recommendation_extras,
+        inputs=(
+            "from_number", "display_name", "best_reviewed", "worst_reviewed", "diet_option", "sent_text",
+            "best_review_link", "worst_review_link", "diet_review_link", "dish_image"
+        ),
+        checkpoint=True
+    ),
+]
+
+# Menu photos from a webhook. The speculative review search has no inputs
+# beyond the message text, so it starts at once and overlaps the vision call.
+MENU_PIPELINE = Pipeline(
+    "menu",
+    [
+        Stage(
+            "speculative_reviews",
+            start_speculative_review_search,
+            inputs=("user_question",),
+            when=lambda values: SPECULATIVE_REVIEW_SEARCH and "reviews" not in values,
+            cleanup=cancel_speculative_review_search
+        ),
+        Stage(
+            "menu_analysis",
+            analyze_menu_photos,
+            inputs=("from_number", "image_urls", "user_question", "budget"),
+            checkpoint=True
+        ),
+        Stage(
+            "menu_details",
+            extract_menu_details,
+            inputs=("menu_analysis", "user_question"),
+            outputs=("restaurant_name", "cuisine_type", "menu_items")
+        ),
+        Stage(
+            "parked",
+            park_unnamed_menu,
+            inputs=("from_number", "restaurant_name", "menu_analysis", "user_question")
+        ),
+        Stage(
+            "display_name",
+            menu_display_name,
+            inputs=("restaurant_name", "parked")
+        ),
+        *REPLY_STAGES,
+    ],
+    initial_values=("from_number", "image_urls", "user_question", "budget")
+)
+
+
+def extract_parked_menu_details(menu_analysis: dict, restaurant_name: str) -> dict:
+    """Pick the cuisine type and menu items of a parked menu; the restaurant name came in the follow-up."""
+    return {
+        "display_name": restaurant_name,
+        "cuisine_type": menu_analysis.get("cuisine_type", "unknown"),
+        "menu_items": menu_analysis.get("menu_items", []),
+    }
+
+
+# A parked menu plus the restaurant name from a follow-up text. The menu was
+# already analyzed, so the run starts at the review search: no second vision call.
+FOLLOW_UP_PIPELINE = Pipeline(
+    "follow_up",
+    [
+        Stage(
+            "menu_details",
+            extract_parked_menu_details,
+            inputs=("menu_analysis", "restaurant_name"),
+            outputs=("display_name", "cuisine_type", "menu_items")
+        ),
+        *REPLY_STAGES,
+    ],
+    initial_values=(
+        "from_number", "menu_analysis", "user_question", "restaurant_name", "speculative_reviews", "budget"
+    )
+)
+
+
+async def run_menu_pipeline(
+    pipeline: Pipeline,
+    values: dict,
+    checkpoints: Optional[dict] = None,
+    save_checkpoint=None
+) -> bool:
+    """
+    Run a menu pipeline for one request, telling the user if it fails.
+    
+    Args:
+        pipeline: MENU_PIPELINE or FOLLOW_UP_PIPELINE
+        values: Initial pipeline values, including from_number and a LatencyBudget as budget
+        checkpoints: Stage outputs saved by an earlier attempt of the same job
+        save_checkpoint: Callback to record a finished stage
         
-        # Send message with image if available
-        if dish_image_url:
-            print(f"🖼️ Sending message with dish image URL: {dish_image_url[:80]}...")
+    Returns:
+        True if the pipeline ran to the end, False if it stopped early, ran out
+        of budget or raised (the user has been sent an error reply)
+    """
+    from_number = values["from_number"]
+    budget = values["budget"]
+    try:
+        if await pipeline.run(values, checkpoints=checkpoints, save_checkpoint=save_checkpoint) is None:
+            return False
+        dropped = f", dropped: {', '.join(budget.dropped)}" if budget.dropped else ""
+        print(f"Job finished in {budget.elapsed():.1f}s of its {budget.total_seconds:.0f}s budget{dropped}")
+        return True
             
-            # Try sending message with image first
-            success = await send_whatsapp_message(
+    except asyncio.TimeoutError:
+        # A required stage (the recommendation) outlasted its floor; nothing useful to send
+        print(f"⏱️ Job ran out of its {budget.total_seconds:.0f}s latency budget after {budget.elapsed():.1f}s")
+        try:
+            await send_whatsapp_message(
                 from_number,
-                message,
-                media_url=dish_image_url
+                "⏱️ Sorry, this is taking longer than expected. Please try again in a moment."
             )
-            
-            if success:
-                print("✅ Message with image sent successfully!")
-            else:
-                # Fallback: Try sending image as separate message first, then text
-                print("⚠️ Failed to send with image, trying separate messages...")
-                image_only_success = await send_whatsapp_message(
-                    from_number,
-                    f"🖼️ Here's what {best_dish} looks like:",
-                    media_url=dish_image_url
-                )
-                
-                if image_only_success:
-                    print("✅ Image sent separately, now sending text message...")
-                    await send_whatsapp_message(from_number, message)
-                else:
-                    print("⚠️ Failed to send image separately, sending text only...")
-                    await send_whatsapp_message(from_number, message)
-        else:
-            # Send message without image
-            print("ℹ️ Sending message without image (no image available or verification failed)")
-            await send_whatsapp_message(from_number, message)
-            
+        except:
+            pass
     except Exception as e:
         import traceback
         error_traceback = traceback.format_exc()
         
         # Print detailed error to console for debugging
         print("=" * 60)
-        print("ERROR IN BACKGROUND PROCESSING:")
+        print(f"ERROR IN BACKGROUND PROCESSING ({pipeline.name} pipeline):")
         print("=" * 60)
         print(f"Error: {str(e)}")
         print(f"Type: {type(e).__name__}")
@@ -277,201 +969,122 @@ async def process_menu_request(
             )
         except:
             pass
+    return False
 
 
-async def process_menu_request_with_restaurant_name(
+async def process_menu_request(
     from_number: str,
-    processed_image_url: str,
+    image_urls: List[str],
     user_question: str,
+    job_id: Optional[str] = None
+) -> bool:
+    """
+    Process menu analysis in the background.
+    This function runs after we've responded to Twilio.
+    
+    All attached photos are treated as pages of the same menu and feed a
+    single recommendation.
+    
+    When job_id is given, the output of each finished stage (menu analysis,
+    reviews, recommendation) is checkpointed in the job store, and a resumed
+    job skips every stage that already has a checkpoint.
+    
+    Every attempt runs under a LatencyBudget of JOB_BUDGET_SECONDS. The
+    review search gets what's left of it, and the optional lookups after the
+    recommendation are dropped one by one as it runs out.
+    
+    Returns:
+        True if the request was answered, False if the user got an error reply
+    """
+    checkpoints = job_store.get_checkpoints(job_id) if job_id and job_store else {}
+    if checkpoints:
+        print(f"Resuming job {job_id} after stages: {', '.join(checkpoints)}")
+    if checkpoints.get("sent"):
+        return True
+    
+    def save_checkpoint(stage: str, value):
+        if job_id and job_store:
+            job_store.save_checkpoint(job_id, stage, value)
+    
+    return await run_menu_pipeline(
+        MENU_PIPELINE,
+        {
+            "from_number": from_number,
+            "image_urls": image_urls,
+            "user_question": user_question,
+            "budget": LatencyBudget(),
+        },
+        checkpoints=checkpoints,
+        save_checkpoint=save_checkpoint
+    )
+
+
+async def run_menu_job(
+    job_id: Optional[str],
+    from_number: str,
+    image_urls: List[str],
+    user_question: str
+):
+    """
+    Run one menu job from the worker pool and record its outcome in the job store.
+    
+    If the worker is cancelled mid-job (shutdown), the job is left unfinished
+    and is resumed from its checkpoints on the next startup.
+    
+    Every span logged while the job runs carries its request ID (the MessageSid
+    when there is one).
+    """
+    set_request_id(job_id)
+    if job_id and job_store:
+        job_store.mark_started(job_id)
+    with span("job"):
+        succeeded = await process_menu_request(from_number, image_urls, user_question, job_id=job_id)
+    if job_id and job_store:
+        job_store.mark_finished(job_id, "done" if succeeded else "failed")
+
+
+async def process_menu_request_with_restaurant_name(
+    from_number: str,
     restaurant_name: str
 ):
     """
-    Process menu analysis when we have a stored image and restaurant name.
-    This is used when user sends restaurant name separately after sending menu image.
+    Finish a parked menu once the user has sent the restaurant name separately.
+    
+    Resumes from the review search with the analysis saved from the first
+    message, so the menu photo is not sent to the vision model again.
     """
-    try:
-        # Step 2: Analyze the menu image with GPT-4o
-        menu_analysis = await analyze_menu_image(processed_image_url, user_question)
-        
-        if "error" in menu_analysis:
-            await send_whatsapp_message(
-                from_number,
-                f"⚠️ Sorry, I had trouble analyzing the image. Error: {menu_analysis.get('error', 'Unknown error')}"
-            )
-            return
-        
-        menu_items = menu_analysis.get("menu_items", [])
-        cuisine_type = menu_analysis.get("cuisine_type", "unknown")
-        
-        # We already have restaurant_name from the parameter, so skip extraction
-        
-        # Step 3: Search for Google Reviews
-        reviews_data = "No reviews available."
-        if restaurant_name:
-            reviews_data = await search_google_reviews(restaurant_name)
-        elif menu_items:
-            # Try searching with cuisine type and first menu item
-            search_query = f"{cuisine_type} restaurant"
-            reviews_data = await search_google_reviews(search_query)
-        
-        # Step 4: Summarize reviews and get three recommendations
-        recommendation = await summarize_reviews_and_recommend(
-            reviews_data,
-            menu_items,
-            restaurant_name or "the restaurant"
-        )
-        
-        best_reviewed = recommendation.get("best_reviewed", {
-            "dish": "Ask the waiter for recommendations",
-            "explanation": "Based on available information.",
-            "highlights": "No reviews available."
-        })
-        worst_reviewed = recommendation.get("worst_reviewed", {
-            "dish": "Not available",
-            "explanation": "Unable to determine.",
-            "complaints": "No complaints data available."
-        })
-        diet_option = recommendation.get("diet_option", {
-            "dish": "Not available",
-            "explanation": "Unable to determine.",
-            "ingredients": "No ingredient data available."
-        })
-        
-        # Step 4.5: Get review links for each dish
-        best_dish_name = best_reviewed.get("dish", "")
-        worst_dish_name = worst_reviewed.get("dish", "")
-        diet_dish_name = diet_option.get("dish", "")
-        
-        best_review_link = None
-        worst_review_link = None
-        diet_review_link = None
-        
-        if restaurant_name:
-            if best_dish_name and best_dish_name.lower() not in ["ask the waiter for recommendations", "not available", "n/a"]:
-                print(f"Getting review link for best reviewed dish: {best_dish_name}")
-                best_review_link = await get_review_link_for_dish(restaurant_name, best_dish_name)
-            
-            if worst_dish_name and worst_dish_name.lower() not in ["not available", "n/a"]:
-                print(f"Getting review link for worst reviewed dish: {worst_dish_name}")
-                worst_review_link = await get_review_link_for_dish(restaurant_name, worst_dish_name)
-            
-            if diet_dish_name and diet_dish_name.lower() not in ["not available", "n/a"]:
-                print(f"Getting review link for diet option: {diet_dish_name}")
-                diet_review_link = await get_review_link_for_dish(restaurant_name, diet_dish_name)
-        
-        # Step 5: Find or generate dish image for best reviewed option
-        dish_image_url = None
-        image_source = None  # Track where the image came from
-        review_link = None  # Track review link if from Google
-        
-        best_dish = best_reviewed.get("dish", "")
-        if best_dish and best_dish.lower() not in ["ask the waiter for recommendations", "not available", "n/a"]:
-            print(f"Searching for real photo of dish: {best_dish}")
-            
-            # First, try to find a real photo from Google Images (often from reviews)
-            if restaurant_name:
-                image_url, source_link = await search_dish_image(restaurant_name, best_dish)
-                if image_url:
-                    dish_image_url = image_url
-                    review_link = source_link
-                    image_source = "google"
-                    print(f"Found real photo from Google Images")
-            
-            # If no real photo found, generate one with DALL-E 3
-            if not dish_image_url:
-                print(f"No real photo found, generating image with DALL-E 3 for: {best_dish}")
-                dish_image_url = await generate_dish_image(
-                    restaurant_name or "restaurant",
-                    best_dish,
-                    cuisine_type
-                )
-                if dish_image_url:
-                    image_source = "generated"
-                    print(f"Generated image with DALL-E 3")
-            
-            if dish_image_url:
-                print(f"Successfully found/generated dish image: {dish_image_url[:80]}...")
-                # Verify the URL is accessible before sending
-                verified_url = await download_and_verify_image_url(dish_image_url)
-                if verified_url:
-                    dish_image_url = verified_url
-                    print("Image URL verified and ready to send")
-                else:
-                    print("Warning: Image URL is not accessible, will send without image")
-                    dish_image_url = None
-                    image_source = None
-                    review_link = None
-            else:
-                print("Failed to find or generate dish image, will send without image")
-        
-        # Step 6: Format and send response
-        message = format_recommendation_message(
-            restaurant_name or "Restaurant",
-            best_reviewed,
-            worst_reviewed,
-            diet_option,
-            image_source,
-            review_link,
-            best_review_link,
-            worst_review_link,
-            diet_review_link
+    parked = pending_menus.take(from_number)
+    if parked is None:
+        # Expired or already used by another follow-up
+        await send_whatsapp_message(
+            from_number,
+            "📸 Please send the menu photo again along with the restaurant name!"
         )
-        
-        # Send message with image if available
-        if dish_image_url:
-            print(f"🖼️ Sending message with dish image URL: {dish_image_url[:80]}...")
-            
-            # Try sending message with image first
-            success = await send_whatsapp_message(
-                from_number,
-                message,
-                media_url=dish_image_url
-            )
-            
-            if success:
-                print("✅ Message with image sent successfully!")
-            else:
-                # Fallback: Try sending image as separate message first, then text
-                print("⚠️ Failed to send with image, trying separate messages...")
-                image_only_success = await send_whatsapp_message(
-                    from_number,
-                    f"🖼️ Here's what {best_dish} looks like:",
-                    media_url=dish_image_url
-                )
-                
-                if image_only_success:
-                    print("✅ Image sent separately, now sending text message...")
-                    await send_whatsapp_message(from_number, message)
-                else:
-                    print("⚠️ Failed to send image separately, sending text only...")
-                    await send_whatsapp_message(from_number, message)
-        else:
-            # Send message without image
-            print("ℹ️ Sending message without image (no image available or verification failed)")
-            await send_whatsapp_message(from_number, message)
-            
-    except Exception as e:
-        import traceback
-        error_traceback = traceback.format_exc()
-        
-        # Print detailed error to console for debugging
-        print("=" * 60)
-        print("ERROR IN BACKGROUND PROCESSING (WITH RESTAURANT NAME):")
-        print("=" * 60)
-        print(f"Error: {str(e)}")
-        print(f"Type: {type(e).__name__}")
-        print("\nFull traceback:")
-        print(error_traceback)
-        print("=" * 60)
-        
-        # Send error message to user
-        try:
-            await send_whatsapp_message(
-                from_number,
-                f"❌ Sorry, an error occurred while processing your request. Please try again."
-            )
-        except:
-            pass
+        return
+    
+    print(f"Resuming parked menu for {from_number} with restaurant name: {restaurant_name}")
+    await run_menu_pipeline(
+        FOLLOW_UP_PIPELINE,
+        {
+            "from_number": from_number,
+            "menu_analysis": parked["menu_analysis"],
+            "user_question": parked["user_question"],
+            "restaurant_name": restaurant_name,
+            "speculative_reviews": None,
+            "budget": LatencyBudget(),
+        }
+    )
+
+
+async def run_follow_up_job(
+    job_id: Optional[str],
+    from_number: str,
+    restaurant_name: str
+):
+    """Run a follow-up naming the restaurant of a parked menu from the worker pool."""
+    set_request_id(job_id)
+    with span("job"):
+        await process_menu_request_with_restaurant_name(from_number, restaurant_name)
 
 
 @app.post("/webhook")
@@ -480,7 +1093,8 @@ async def webhook(request: Request):
     Handle incoming WhatsApp webhook from Twilio.
     
     CRITICAL: This endpoint responds immediately (within 5 seconds) to prevent
-    Twilio 11200 errors. All processing happens in the background using asyncio.create_task.
+    Twilio 11200 errors. All processing happens in the background on the menu job
+    worker pool; if its queue is full the user gets a "busy" reply instead.
     
     Twilio sends form data with:
     - From: sender's WhatsApp number
@@ -495,39 +1109,66 @@ async def webhook(request: Request):
         from_number = form_data.get("From", "").replace("whatsapp:", "")
         body = form_data.get("Body", "").strip()
         num_media = int(form_data.get("NumMedia", "0"))
+        message_sid = form_data.get("MessageSid") or None
+        
+        # Get every attached image URL (several photos = several pages of one menu)
+        image_urls = [
+            form_data.get(f"MediaUrl{i}")
+            for i in range(min(num_media, MAX_MENU_IMAGES))
+            if form_data.get(f"MediaUrl{i}")
+        ]
+        if num_media > MAX_MENU_IMAGES:
+            print(f"Received {num_media} images, analyzing the first {MAX_MENU_IMAGES}")
+        
+        # Get user question or use default
+        user_question = body if body else "What should I order?"
         
-        # Get image URL if present
-        image_url = None
-        if num_media > 0:
-            image_url = form_data.get("MediaUrl0")
+        # Record the message before answering, so Twilio retries are dropped
+        # and the job survives a restart
+        if message_sid and job_store:
+            payload = {"from_number": from_number, "image_urls": image_urls, "user_question": user_question}
+            if not job_store.record(message_sid, payload, status="queued" if image_urls else "done"):
+                print(f"Duplicate webhook delivery for {message_sid}, ignoring")
+                return Response(content="Thank you for using MenuMate! We will start working on your request, you are almost ready to order!", status_code=200)
         
         # Validate we have an image
-        if not image_url:
+        if not image_urls:
+            # A short text right after a menu we couldn't name is the restaurant name
+            restaurant_name = guess_restaurant_name_from_message(body)
+            if restaurant_name and pending_menus.has(from_number):
+                if not menu_jobs.submit(run_follow_up_job, message_sid, from_number, restaurant_name):
+                    print(f"Menu job queue full, turning away follow-up from {from_number}")
+                    spawn_background(send_whatsapp_message(from_number, BUSY_MESSAGE))
+                return Response(content="Thank you for using MenuMate! We will start working on your request, you are almost ready to order!", status_code=200)
+            
             # User sent text-only message - ask for menu photo
             if body and body.strip():
-                asyncio.create_task(send_whatsapp_message(
+                spawn_background(send_whatsapp_message(
                     from_number,
                     "📸 Please send a photo of the menu or restaurant along with your question!\n\n💡 Tip: You can include the restaurant name in your message along with the menu photo."
                 ))
             else:
                 # No image and no text - ask for menu photo
-                asyncio.create_task(send_whatsapp_message(
+                spawn_background(send_whatsapp_message(
                     from_number,
                     "📸 Please send a photo of the menu or restaurant along with your question!"
                 ))
             return Response(content="Thank you for using MenuMate! We will start working on your request, you are almost ready to order!", status_code=200)
         
-        # Get user question or use default
-        user_question = body if body else "What should I order?"
-        
         # CRITICAL: Respond to Twilio IMMEDIATELY with 200 OK
-        # Process everything in the background using asyncio.create_task
-        # This creates a fire-and-forget task that runs after we return
-        asyncio.create_task(process_menu_request(
+        # Process everything in the background on the menu job worker pool
+        queued = menu_jobs.submit(
+            run_menu_job,
+            message_sid,
             from_number,
-            image_url,
+            image_urls,
             user_question
-        ))
+        )
+        if not queued:
+            print(f"Menu job queue full, turning away request from {from_number}")
+            if message_sid and job_store:
+                job_store.mark_finished(message_sid, "rejected")
+            spawn_background(send_whatsapp_message(from_number, BUSY_MESSAGE))
         
         # Return immediately - Twilio is happy!
         return Response(content="Thank you for using MenuMate! We will start working on your request, you are almost ready to order!", status_code=200)
@@ -0,0 +1,412 @@
+"""
+In-process caches with LRU + TTL eviction and optional SQLite persistence.
+"""
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; perceptual hashing is skipped without it
+    Image = None
+
+# Shared SQLite file for all persistent caches (one table per cache).
+# Set to an empty string to keep every cache in memory only.
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "menumate_cache.db")
+
+# All caches created in this process, by name, for stats reporting
+CACHE_REGISTRY: Dict[str, Any] = {}
+
+
+class TTLCache:
+    """
+    Bounded LRU cache with a per-entry time-to-live.
+
+    With stale_seconds > 0, expired entries are kept for that much longer and
+    returned by get_stale() flagged as stale, for stale-while-revalidate use.
+    Entries live in memory; when db_path is set they are also mirrored to a
+    SQLite table and reloaded on startup, so the cache survives restarts.
+    Values must be JSON-serializable when persistence is enabled.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = 1000,
+        ttl_seconds: float = 3600,
+        db_path: Optional[str] = None,
+        stale_seconds: float = 0
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.stale_hits = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (value, stored_at, expires_at), least recently used first
+        self._entries: "OrderedDict[str, Tuple[Any, float, float]]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+
+        if db_path:
+            try:
+                self._open_db(db_path)
+            except sqlite3.Error as e:
+                print(f"Cache '{name}': could not open {db_path} ({e}), using memory only")
+                self._db = None
+
+        CACHE_REGISTRY[name] = self
+
+    def _open_db(self, db_path: str):
+        """Open the SQLite mirror and load unexpired entries into memory."""
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        with self._db_lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                f'CREATE TABLE IF NOT EXISTS "{self._table}" '
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                f'DELETE FROM "{self._table}" WHERE expires_at <= ?',
+                (time.time() - self.stale_seconds,)
+            )
+            rows = self._db.execute(
+                f'SELECT key, value, stored_at, expires_at FROM "{self._table}" ORDER BY stored_at'
+            ).fetchall()
+            self._db.commit()
+
+        for key, value, stored_at, expires_at in rows:
+            self._entries[key] = (json.loads(value), stored_at, expires_at)
+        while len(self._entries) > self.max_entries:
+            self._evict_oldest()
+        if self._entries:
+            print(f"Cache '{self.name}': loaded {len(self._entries)} entries from disk")
+
+    @property
+    def _table(self) -> str:
+        return f"cache_{self.name}"
+
+    def _db_write(self, sql: str, params: tuple):
+        if not self._db:
+            return
+        try:
+            with self._db_lock:
+                self._db.execute(sql, params)
+                self._db.commit()
+        except sqlite3.Error as e:
+            print(f"Cache '{self.name}': disk write failed: {e}")
+
+    def _remove(self, key: str):
+        self._entries.pop(key, None)
+        self._db_write(f'DELETE FROM "{self._table}" WHERE key = ?', (key,))
+
+    def _evict_oldest(self):
+        key, _ = self._entries.popitem(last=False)
+        self.evictions += 1
+        self._db_write(f'DELETE FROM "{self._table}" WHERE key = ?', (key,))
+
+    def get(self, key: str, default: Any = None, count: bool = True) -> Any:
+        """
+        Return the cached value for key, or default if missing or expired.
+
+        Args:
+            key: Cache key
+            default: Value returned on a miss
+            count: Record a hit or miss; pass False when the caller records
+                the outcome of a multi-step lookup itself via record_lookup()
+        """
+        entry = self._entries.get(key)
+        now = time.time()
+        if entry is None or entry[2] <= now:
+            if entry is not None and entry[2] + self.stale_seconds <= now:
+                self._remove(key)
+            if count:
+                self.misses += 1
+            return default
+
+        self._entries.move_to_end(key)
+        if count:
+            self.hits += 1
+        return entry[0]
+
+    def get_stale(self, key: str, count: bool = True) -> Tuple[Any, bool]:
+        """
+        Return (value, is_stale) for key, serving expired entries within the stale window.
+
+        Args:
+            key: Cache key
+            count: Record a hit, stale hit or miss
+
+        Returns:
+            (value, False) for a fresh entry, (value, True) for a stale one,
+            or (None, False) if missing or past the stale window
+        """
+        entry = self._entries.get(key)
+        now = time.time()
+        if entry is None or entry[2] + self.stale_seconds <= now:
+            if entry is not None:
+                self._remove(key)
+            if count:
+                self.misses += 1
+            return None, False
+
+        self._entries.move_to_end(key)
+        is_stale = entry[2] <= now
+        if count and is_stale:
+            self.stale_hits += 1
+        elif count:
+            self.hits += 1
+        return entry[0], is_stale
+
+    def record_lookup(self, hit: bool):
+        """Record the outcome of a lookup made with get(..., count=False)."""
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        """
+        Store value under key, evicting the least recently used entries if full.
+
+        Args:
+            key: Cache key
+            value: Value to store (JSON-serializable if persistent)
+            ttl_seconds: Override the cache's default TTL for this entry
+        """
+        now = time.time()
+        expires_at = now + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        self._entries[key] = (value, now, expires_at)
+        self._entries.move_to_end(key)
+        self._db_write(
+            f'INSERT OR REPLACE INTO "{self._table}" (key, value, stored_at, expires_at) VALUES (?, ?, ?, ?)',
+            (key, json.dumps(value), now, expires_at)
+        )
+        while len(self._entries) > self.max_entries:
+            self._evict_oldest()
+
+    def delete(self, key: str):
+        """Remove key from the cache if present."""
+        self._remove(key)
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        """Iterate over unexpired (key, value) pairs without touching LRU order or counters."""
+        now = time.time()
+        for key, (value, _, expires_at) in list(self._entries.items()):
+            if expires_at > now:
+                yield key, value
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict:
+        """Return size and hit/miss counters for this cache."""
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "stale_seconds": self.stale_seconds,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.stale_hits) / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "persistent": self._db is not None,
+        }
+
+
+class PendingMenuStore:
+    """
+    Menus parked per phone number while we wait for the user to send the
+    restaurant name in a follow-up message.
+
+    Holds the finished menu analysis, so the follow-up can go straight to the
+    review search. Bounded by entry count and by total bytes (least recently
+    parked evicted first); expired entries are dropped by a background
+    sweeper as well as on access. Memory only, since entries live minutes.
+    """
+
+    def __init__(self, name: str, max_entries: int, max_bytes: int, ttl_seconds: float, sweep_seconds: float = 60):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sweep_seconds = sweep_seconds
+        self.bytes = 0
+        self.parked = 0
+        self.resumed = 0
+        self.expired = 0
+        self.evictions = 0
+        self.rejected = 0
+        # phone number -> (entry, size in bytes, expires_at), least recently parked first
+        self._entries: "OrderedDict[str, Tuple[Dict, int, float]]" = OrderedDict()
+        self._sweeper: Optional[asyncio.Task] = None
+        CACHE_REGISTRY[name] = self
+
+    @staticmethod
+    def entry_size(entry: Dict) -> int:
+        """Approximate memory held by an entry: its JSON size."""
+        return len(json.dumps(entry, ensure_ascii=False).encode("utf-8"))
+
+    def _remove(self, phone_number: str) -> Optional[Dict]:
+        removed = self._entries.pop(phone_number, None)
+        if removed is None:
+            return None
+        self.bytes -= removed[1]
+        return removed[0]
+
+    def park(self, phone_number: str, entry: Dict) -> bool:
+        """
+        Park a menu for a phone number, replacing any menu already parked for it.
+
+        Args:
+            phone_number: User's WhatsApp number
+            entry: menu_analysis and user_question
+
+        Returns:
+            True if parked, False if the entry alone is larger than max_bytes
+        """
+        self._remove(phone_number)
+        size = self.entry_size(entry)
+        if size > self.max_bytes:
+            self.rejected += 1
+            print(f"Pending menu for {phone_number} is {size} bytes, over the {self.max_bytes} byte limit; not parking")
+            return False
+        while self._entries and (len(self._entries) >= self.max_entries or self.bytes + size > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+        self._entries[phone_number] = (entry, size, time.time() + self.ttl_seconds)
+        self.bytes += size
+        self.parked += 1
+        return True
+
+    def has(self, phone_number: str) -> bool:
+        """Return True if an unexpired menu is parked for this phone number."""
+        item = self._entries.get(phone_number)
+        return item is not None and item[2] > time.time()
+
+    def take(self, phone_number: str) -> Optional[Dict]:
+        """Remove and return the menu parked for this phone number, or None if there is none (or it expired)."""
+        item = self._entries.get(phone_number)
+        if item is None:
+            return None
+        entry = self._remove(phone_number)
+        if item[2] <= time.time():
+            self.expired += 1
+            return None
+        self.resumed += 1
+        return entry
+
+    def discard(self, phone_number: str):
+        """Forget any menu parked for this phone number."""
+        self._remove(phone_number)
+
+    def sweep(self) -> int:
+        """Drop expired entries. Returns how many were dropped."""
+        now = time.time()
+        expired = [phone for phone, (_, _, expires_at) in self._entries.items() if expires_at <= now]
+        for phone_number in expired:
+            self._remove(phone_number)
+        self.expired += len(expired)
+        return len(expired)
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(self.sweep_seconds)
+            dropped = self.sweep()
+            if dropped:
+                print(f"Pending menus: dropped {dropped} expired, {len(self._entries)} left ({self.bytes} bytes)")
+
+    def start_sweeper(self):
+        """Start the background sweeper. Safe to call more than once."""
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_forever(), name=f"{self.name}-sweeper")
+
+    async def stop_sweeper(self):
+        """Stop the background sweeper."""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict:
+        """Return entry and byte counts and how many menus were parked, resumed, expired and evicted."""
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "parked": self.parked,
+            "resumed": self.resumed,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "rejected": self.rejected,
+        }
+
+
+def get_cache_stats() -> Dict[str, Dict]:
+    """Return stats for every cache in this process, keyed by cache name."""
+    return {name: cache.stats() for name, cache in CACHE_REGISTRY.items()}
+
+
+def stable_digest(value: Any) -> str:
+    """Return a SHA-256 hex digest of a JSON-serializable value, independent of dict key order."""
+    encoded = json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def image_content_hash(image_bytes: bytes) -> str:
+    """Return a SHA-256 hex digest of the raw image bytes."""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def perceptual_hash(image_bytes: bytes, hash_size: int = 16) -> Optional[int]:
+    """
+    Compute a difference hash (dHash) of an image, hash_size^2 bits long.
+
+    Near-identical photos (re-compressed, resized, slightly different exposure)
+    produce hashes a few bits apart. The default 256-bit hash keeps enough
+    detail that different menus with similar layouts don't collide. Decoding a
+    full-resolution photo is CPU-bound; call this through asyncio.to_thread.
+
+    Returns:
+        The hash as an int, or None if Pillow is missing or the image can't be decoded
+    """
+    if Image is None:
+        return None
+    try:
+        with Image.open(BytesIO(image_bytes)) as image:
+            # Let the JPEG decoder downscale while decoding instead of inflating all pixels
+            image.draft("L", (hash_size * 8, hash_size * 8))
+            pixels = list(image.convert("L").resize((hash_size + 1, hash_size)).getdata())
+    except Exception as e:
+        print(f"Could not compute perceptual hash: {e}")
+        return None
+
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """Return the number of differing bits between two hashes."""
+    return bin(a ^ b).count("1")
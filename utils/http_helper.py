@@ -0,0 +1,108 @@
+"""
+Shared async HTTP client for all outbound calls (Serper, Twilio media, image checks).
+"""
+import os
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx)
+    H2_AVAILABLE = True
+except ImportError:
+    H2_AVAILABLE = False
+
+# Pool sizing. Connections are kept alive and reused across requests, so most
+# Serper calls skip the TCP + TLS handshake entirely.
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "60"))
+# Maximum concurrent requests to any single host
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "20"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true" and H2_AVAILABLE
+
+_client: Optional[httpx.AsyncClient] = None
+_host_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+
+def _create_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=HTTP2_ENABLED,
+        follow_redirects=True,
+        timeout=httpx.Timeout(10.0),
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS
+        )
+    )
+
+
+async def start_http_client():
+    """Create the process-wide HTTP client. Called on app startup."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _create_client()
+        print(f"HTTP client started (HTTP/2: {HTTP2_ENABLED})")
+
+
+async def close_http_client():
+    """Close the process-wide HTTP client and its pooled connections. Called on app shutdown."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        _host_semaphores.clear()
+        print("HTTP client closed")
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Return the shared HTTP client, creating it on first use.
+
+    The app lifecycle normally starts it; lazy creation keeps the helpers
+    usable from scripts that don't run the FastAPI app.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _create_client()
+    return _client
+
+
+def _host_semaphore(url: str) -> asyncio.Semaphore:
+    host = urlsplit(url).netloc
+    semaphore = _host_semaphores.get(host)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(HTTP_MAX_CONNECTIONS_PER_HOST)
+        _host_semaphores[host] = semaphore
+    return semaphore
+
+
+async def http_request(method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Send a request through the shared client, respecting the per-host limit.
+
+    Args:
+        method: HTTP method
+        url: Request URL
+        **kwargs: Passed through to httpx.AsyncClient.request (headers, json, auth, timeout...)
+
+    Returns:
+        The fully read httpx.Response
+    """
+    async with _host_semaphore(url):
+        return await get_http_client().request(method, url, **kwargs)
+
+
+@asynccontextmanager
+async def http_stream(method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+    """
+    Stream a response through the shared client, respecting the per-host limit.
+    The connection is released back to the pool when the block exits.
+    """
+    async with _host_semaphore(url):
+        async with get_http_client().stream(method, url, **kwargs) as response:
+            yield response
@@ -0,0 +1,187 @@
+"""
+Menu photo preprocessing before GPT-4o vision: rotate, downscale, re-encode, crop.
+"""
+import os
+import math
+import base64
+from io import BytesIO
+from typing import Dict, Optional, Tuple
+
+from PIL import Image, ImageFilter, ImageOps
+
+# Output format and quality for the re-encoded image ("jpeg" or "webp")
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "jpeg").lower()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+# "auto" picks low or high detail per image; "low"/"high" force one
+IMAGE_DETAIL = os.getenv("IMAGE_DETAIL", "auto").lower()
+# Crop to the detected text region before sending (off by default)
+IMAGE_CROP_TO_TEXT = os.getenv("IMAGE_CROP_TO_TEXT", "false").lower() == "true"
+
+# GPT-4o vision sizing: high detail fits the image in 2048x2048, scales the
+# short side down to 768, then bills 170 tokens per 512px tile plus 85 base.
+# Low detail is a flat 85 tokens for a 512x512 view.
+HIGH_DETAIL_MAX_SIDE = 2048
+HIGH_DETAIL_SHORT_SIDE = 768
+TILE_SIZE = 512
+BASE_TOKENS = 85
+TILE_TOKENS = 170
+
+# Running totals across all requests
+_totals = {"images": 0, "bytes_saved": 0, "tokens_saved": 0}
+
+
+def vision_target_size(width: int, height: int) -> Tuple[int, int]:
+    """Return the size GPT-4o actually looks at in high detail mode (never upscales)."""
+    scale = min(1.0, HIGH_DETAIL_MAX_SIDE / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, HIGH_DETAIL_SHORT_SIDE / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def estimate_vision_tokens(width: int, height: int, detail: str = "high") -> int:
+    """Estimate GPT-4o input tokens for an image of the given size and detail."""
+    if detail == "low":
+        return BASE_TOKENS
+    width, height = vision_target_size(width, height)
+    tiles = math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+    return BASE_TOKENS + TILE_TOKENS * tiles
+
+
+def choose_detail(width: int, height: int) -> str:
+    """
+    Pick the vision detail level for a preprocessed image.
+
+    An image that fits in one low-detail view gains nothing from high detail;
+    anything larger needs high detail for menu text to stay legible.
+    """
+    if IMAGE_DETAIL in ("low", "high"):
+        return IMAGE_DETAIL
+    return "low" if max(width, height) <= TILE_SIZE else "high"
+
+
+def find_text_region(image: Image.Image) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Find the bounding box of the dense-edge (text) region of an image.
+
+    Returns:
+        (left, top, right, bottom) with a small margin, or None if cropping
+        wouldn't remove a meaningful border
+    """
+    # Detect on a small copy for speed, then scale the box back up
+    width, height = image.size
+    scale = min(1.0, 1024 / max(width, height))
+    small = image.convert("L").resize((max(3, round(width * scale)), max(3, round(height * scale))))
+    edges = small.filter(ImageFilter.FIND_EDGES)
+    # The edge filter lights up the outermost pixels; ignore them
+    edges = edges.crop((1, 1, edges.width - 1, edges.height - 1))
+    mask = edges.point(lambda value: 255 if value > 40 else 0)
+    bbox = mask.getbbox()
+    if not bbox:
+        return None
+    bbox = [round((value + 1) / scale) for value in bbox]
+
+    margin_x, margin_y = int(width * 0.02), int(height * 0.02)
+    left = max(0, bbox[0] - margin_x)
+    top = max(0, bbox[1] - margin_y)
+    right = min(width, bbox[2] + margin_x)
+    bottom = min(height, bbox[3] + margin_y)
+
+    area_ratio = ((right - left) * (bottom - top)) / (width * height)
+    # Not worth it if it barely crops; suspicious if it would drop most of the photo
+    if area_ratio > 0.9 or area_ratio < 0.05:
+        return None
+    return left, top, right, bottom
+
+
+def preprocess_menu_image(image_bytes: bytes) -> Optional[Dict]:
+    """
+    Prepare a phone photo of a menu for GPT-4o vision.
+
+    Applies EXIF rotation, optionally crops to the text region, downscales to
+    the resolution the model tiles at, and re-encodes at IMAGE_QUALITY. JPEGs
+    are decoded at reduced size, so a 12 MP photo never inflates in full. This
+    is CPU-bound; call it via asyncio.to_thread.
+
+    Args:
+        image_bytes: Raw downloaded image bytes
+
+    Returns:
+        Dictionary with image_bytes, content_type, detail, bytes_saved and
+        tokens_saved, or None if the image can't be decoded
+    """
+    try:
+        with Image.open(BytesIO(image_bytes)) as original:
+            original_size = original.size
+            original_tokens = estimate_vision_tokens(*original_size, detail="high")
+            original_type = Image.MIME.get(original.format, "image/jpeg")
+            # Orientation tag 1 means the pixels are already upright
+            geometry_changed = original.getexif().get(0x0112, 1) != 1
+            # Let the JPEG decoder downscale while decoding instead of inflating all
+            # pixels; the target size doesn't depend on orientation, so do it before rotating
+            original.draft("RGB", vision_target_size(*original_size))
+            geometry_changed = geometry_changed or original.size != original_size
+            image = ImageOps.exif_transpose(original)
+            image = image.convert("RGB")
+    except Exception as e:
+        print(f"Could not preprocess image, sending original: {e}")
+        return None
+
+    if IMAGE_CROP_TO_TEXT:
+        region = find_text_region(image)
+        if region:
+            image = image.crop(region)
+            geometry_changed = True
+
+    target_size = vision_target_size(*image.size)
+    if target_size != image.size:
+        image = image.resize(target_size, Image.LANCZOS)
+        geometry_changed = True
+
+    detail = choose_detail(*image.size)
+    output = BytesIO()
+    if IMAGE_FORMAT == "webp":
+        image.save(output, "WEBP", quality=IMAGE_QUALITY)
+        content_type = "image/webp"
+    else:
+        image.save(output, "JPEG", quality=IMAGE_QUALITY, optimize=True)
+        content_type = "image/jpeg"
+    processed = output.getvalue()
+
+    if not geometry_changed and len(processed) >= len(image_bytes):
+        # Already upright, small and well-compressed; keep the original bytes
+        processed = image_bytes
+        content_type = original_type
+
+    bytes_saved = len(image_bytes) - len(processed)
+    tokens_saved = original_tokens - estimate_vision_tokens(*image.size, detail=detail)
+    _totals["images"] += 1
+    _totals["bytes_saved"] += bytes_saved
+    _totals["tokens_saved"] += tokens_saved
+    print(
+        f"Preprocessed menu image: {len(image_bytes)} -> {len(processed)} bytes "
+        f"({bytes_saved} saved), {image.size[0]}x{image.size[1]}, detail={detail}, "
+        f"~{tokens_saved} vision tokens saved"
+    )
+
+    return {
+        "image_bytes": processed,
+        "content_type": content_type,
+        "detail": detail,
+        "bytes_saved": bytes_saved,
+        "tokens_saved": tokens_saved,
+    }
+
+
+def encode_data_url(image_bytes: bytes, content_type: str = "image/jpeg") -> str:
+    """
+    Encode raw image bytes as a base64 data URL that OpenAI accepts.
+
+    Build it right before the request that needs it, so the ~1.33x larger
+    string isn't held for the rest of the pipeline.
+    """
+    return f"data:{content_type};base64,{base64.b64encode(image_bytes).decode('utf-8')}"
+
+
+def get_image_stats() -> Dict:
+    """Return running totals of images preprocessed, bytes saved and vision tokens saved."""
+    return dict(_totals)
@@ -0,0 +1,341 @@
+"""
+Background job scheduling: a bounded queue feeding a fixed pool of async workers,
+and a durable SQLite job store for deduplication and resume after restart.
+"""
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import threading
+import traceback
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from .metrics_helper import record_dropped_step
+
+# Maximum menu jobs processed at once, and how many more may wait in line.
+# When the queue is full new jobs are rejected so the caller can reply "busy".
+JOB_MAX_IN_FLIGHT = int(os.getenv("JOB_MAX_IN_FLIGHT", "8"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "50"))
+# How long shutdown waits for queued and running jobs to finish
+JOB_DRAIN_SECONDS = float(os.getenv("JOB_DRAIN_SECONDS", "60"))
+
+# Strong references to fire-and-forget tasks so they aren't garbage-collected mid-flight
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def spawn_background(coro: Awaitable) -> asyncio.Task:
+    """Run a coroutine in the background, keeping a reference until it finishes."""
+    task = asyncio.ensure_future(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+class JobScheduler:
+    """
+    Fixed pool of async workers fed by a bounded queue.
+
+    submit() never blocks: it returns False when the queue is full, giving the
+    webhook a fast way to shed load instead of starting unbounded tasks.
+    """
+
+    def __init__(self, name: str, max_in_flight: int, queue_size: int):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.queue_size = queue_size
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    def start(self):
+        """Start the worker pool. Safe to call more than once."""
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        for i in range(self.max_in_flight):
+            self._workers.append(asyncio.create_task(self._worker(), name=f"{self.name}-worker-{i}"))
+        print(f"Job scheduler '{self.name}' started ({self.max_in_flight} workers, queue {self.queue_size})")
+
+    async def stop(self, drain_seconds: float = JOB_DRAIN_SECONDS):
+        """Let queued and running jobs finish (up to drain_seconds), then stop the workers."""
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=drain_seconds)
+        except asyncio.TimeoutError:
+            print(
+                f"⚠️ Job scheduler '{self.name}' stopping with {self.in_flight} running "
+                f"and {self._queue.qsize()} queued jobs"
+            )
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        self._queue = None
+
+    def submit(self, job: Callable[..., Awaitable[Any]], *args) -> bool:
+        """
+        Queue job(*args) for a worker.
+
+        Returns:
+            True if queued, False if the queue is full (or the scheduler isn't running)
+        """
+        if not self._workers:
+            self.start()
+        try:
+            self._queue.put_nowait((job, args))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        return True
+
+    async def _worker(self):
+        while True:
+            job, args = await self._queue.get()
+            self.in_flight += 1
+            try:
+                await job(*args)
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                print(f"Unhandled error in job {getattr(job, '__name__', job)}: {e}")
+                print(traceback.format_exc())
+            finally:
+                self.in_flight -= 1
+                self._queue.task_done()
+
+    def stats(self) -> Dict:
+        """Return queue depth and job counters."""
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "queue_size": self.queue_size,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+
+# End-to-end latency budget per menu job. Required stages get whatever is
+# left (but at least JOB_BUDGET_MIN_STAGE_SECONDS); optional extras are
+# dropped as the remaining budget falls below each step's threshold, so diet
+# links go first, then worst-dish links, image generation and image search.
+JOB_BUDGET_SECONDS = float(os.getenv("JOB_BUDGET_SECONDS", "45"))
+JOB_BUDGET_MIN_STAGE_SECONDS = float(os.getenv("JOB_BUDGET_MIN_STAGE_SECONDS", "10"))
+# The review search isn't one of the droppable extras, so even with the budget
+# spent it gets this long (a Serper search rarely takes more than 2 s)
+JOB_BUDGET_REVIEW_SEARCH_MIN_SECONDS = float(os.getenv("JOB_BUDGET_REVIEW_SEARCH_MIN_SECONDS", "3"))
+# Remaining seconds needed to still attempt each optional step
+DEGRADATION_THRESHOLDS = {
+    "diet_links": float(os.getenv("BUDGET_DIET_LINKS_MIN_SECONDS", "20")),
+    "worst_links": float(os.getenv("BUDGET_WORST_LINKS_MIN_SECONDS", "16")),
+    "image_generation": float(os.getenv("BUDGET_IMAGE_GENERATION_MIN_SECONDS", "12")),
+    "image_search": float(os.getenv("BUDGET_IMAGE_SEARCH_MIN_SECONDS", "4")),
+}
+
+
+class LatencyBudget:
+    """
+    Deadline for one job, passed through its stages.
+
+    Stages size their timeouts from remaining(), and optional steps ask
+    allows() before starting, so a slow dependency early in the job thins
+    the answer instead of delaying it.
+    """
+
+    def __init__(self, total_seconds: float = JOB_BUDGET_SECONDS):
+        self.total_seconds = total_seconds
+        self.started = time.monotonic()
+        self.deadline = self.started + total_seconds
+        self.dropped: List[str] = []
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+    def timeout(self, cap: Optional[float] = None, floor: float = 0.0) -> float:
+        """
+        Return a timeout for the next stage: the remaining budget, raised to
+        floor (for stages the reply can't do without) and capped at cap.
+        """
+        timeout = max(self.remaining(), floor)
+        return min(cap, timeout) if cap is not None else timeout
+
+    def allows(self, step: str) -> bool:
+        """Return True if there is enough budget left for an optional step; records it as dropped if not."""
+        if self.remaining() >= DEGRADATION_THRESHOLDS[step]:
+            return True
+        if step not in self.dropped:
+            self.dropped.append(step)
+            print(f"⏳ Latency budget: {self.remaining():.1f}s left, dropping {step}")
+            record_dropped_step(step)
+        return False
+
+
+# Durable job store. Each incoming webhook is recorded by Twilio MessageSid
+# before we answer, so duplicate deliveries are dropped and jobs lost to a
+# restart are resumed from their last checkpointed stage.
+JOB_STORE_ENABLED = os.getenv("JOB_STORE_ENABLED", "true").lower() == "true"
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", "menumate_jobs.db")
+# Jobs interrupted more than this many times are abandoned instead of resumed
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+# Finished jobs are kept this long to recognize duplicate deliveries
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", str(24 * 3600)))
+# How often finished jobs past the retention window are deleted
+JOB_PURGE_INTERVAL_SECONDS = float(os.getenv("JOB_PURGE_INTERVAL_SECONDS", "3600"))
+
+
+class JobStore:
+    """
+    SQLite-backed record of jobs and their per-stage checkpoints.
+
+    Job status moves from "queued" to "running" to a final "done", "failed"
+    or "rejected". Jobs still queued or running at startup were interrupted
+    and can be resumed.
+    """
+
+    def __init__(self, db_path: str):
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            # With WAL, NORMAL only risks the last commits on power loss (not corruption),
+            # and skips an fsync per commit on the event loop
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "job_id TEXT PRIMARY KEY, payload TEXT NOT NULL, status TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS job_checkpoints ("
+                "job_id TEXT NOT NULL, stage TEXT NOT NULL, value TEXT NOT NULL, "
+                "PRIMARY KEY (job_id, stage))"
+            )
+            self._db.commit()
+        self.duplicates = 0
+        self._purger: Optional[asyncio.Task] = None
+        self.purge()
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            cursor = self._db.execute(sql, params)
+            self._db.commit()
+            return cursor
+
+    def record(self, job_id: str, payload: Dict, status: str = "queued") -> bool:
+        """
+        Record a new job.
+
+        Returns:
+            True if recorded, False if a job with this ID already exists (duplicate delivery)
+        """
+        now = time.time()
+        cursor = self._execute(
+            "INSERT OR IGNORE INTO jobs (job_id, payload, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (job_id, json.dumps(payload), status, now, now)
+        )
+        if cursor.rowcount == 0:
+            self.duplicates += 1
+            return False
+        return True
+
+    def mark_started(self, job_id: str):
+        """Mark a job as running and count the attempt."""
+        self._execute(
+            "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE job_id = ?",
+            (time.time(), job_id)
+        )
+
+    def mark_finished(self, job_id: str, status: str = "done"):
+        """Mark a job as finished ("done", "failed" or "rejected") and drop its checkpoints."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ?",
+                (status, time.time(), job_id)
+            )
+            self._db.execute("DELETE FROM job_checkpoints WHERE job_id = ?", (job_id,))
+            self._db.commit()
+
+    def get_checkpoints(self, job_id: str) -> Dict[str, Any]:
+        """Return the saved stage outputs for a job, keyed by stage name."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT stage, value FROM job_checkpoints WHERE job_id = ?", (job_id,)
+            ).fetchall()
+        return {stage: json.loads(value) for stage, value in rows}
+
+    def save_checkpoint(self, job_id: str, stage: str, value: Any):
+        """Save the output of a finished stage so a resumed job can skip it."""
+        self._execute(
+            "INSERT OR REPLACE INTO job_checkpoints (job_id, stage, value) VALUES (?, ?, ?)",
+            (job_id, stage, json.dumps(value))
+        )
+
+    def take_interrupted(self, max_attempts: int = JOB_MAX_ATTEMPTS) -> List[Tuple[str, Dict]]:
+        """
+        Return jobs left queued or running by a previous process, to be resumed.
+        Jobs that already used max_attempts are marked failed instead.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT job_id, payload, attempts FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+            ).fetchall()
+        resumable = []
+        for job_id, payload, attempts in rows:
+            if attempts >= max_attempts:
+                print(f"Abandoning job {job_id} after {attempts} interrupted attempts")
+                self.mark_finished(job_id, "failed")
+            else:
+                resumable.append((job_id, json.loads(payload)))
+        return resumable
+
+    def purge(self, older_than_seconds: float = JOB_RETENTION_SECONDS) -> int:
+        """Delete finished jobs older than the retention window. Returns how many were deleted."""
+        cursor = self._execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed', 'rejected') AND updated_at < ?",
+            (time.time() - older_than_seconds,)
+        )
+        return cursor.rowcount
+
+    async def _purge_forever(self, interval_seconds: float):
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                deleted = await asyncio.to_thread(self.purge)
+            except sqlite3.Error as e:
+                print(f"Job store purge failed: {e}")
+                continue
+            if deleted:
+                print(f"Job store: purged {deleted} finished jobs")
+
+    def start_purger(self, interval_seconds: float = JOB_PURGE_INTERVAL_SECONDS):
+        """Start purging old finished jobs periodically. Safe to call more than once."""
+        if self._purger is None or self._purger.done():
+            self._purger = asyncio.create_task(self._purge_forever(interval_seconds), name="job-store-purger")
+
+    async def stop_purger(self):
+        """Stop the periodic purge."""
+        if self._purger is not None:
+            self._purger.cancel()
+            await asyncio.gather(self._purger, return_exceptions=True)
+            self._purger = None
+
+    def stats(self) -> Dict:
+        """Return job counts by status and the number of duplicate deliveries dropped."""
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {"by_status": dict(rows), "duplicates_dropped": self.duplicates}
@@ -0,0 +1,239 @@
+"""
+Per-stage timing spans and Prometheus metrics for the menu pipeline.
+"""
+import os
+import time
+import uuid
+import threading
+import contextvars
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Print one line per finished span (request ID, stage, duration, outcome)
+METRICS_LOG_SPANS = os.getenv("METRICS_LOG_SPANS", "true").lower() == "true"
+
+# Histogram bucket upper bounds in seconds, covering cache hits up to slow vision calls
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+# Request ID of the job being processed. Tasks started with create_task/gather
+# copy the current context, so concurrent branches of a job keep its ID.
+_request_id: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+
+_lock = threading.Lock()
+# stage -> [bucket counts..., +Inf count], sum of seconds
+_stage_buckets: Dict[str, List[int]] = {}
+_stage_sums: Dict[str, float] = {}
+# (stage, error) -> count
+_stage_errors: Dict[Tuple[str, str], int] = {}
+# stage -> spans currently open
+_stage_in_flight: Dict[str, int] = {}
+# optional step -> times dropped to stay within a job's latency budget
+_dropped_steps: Dict[str, int] = {}
+
+
+def new_request_id() -> str:
+    """Return a short random request ID."""
+    return uuid.uuid4().hex[:12]
+
+
+def set_request_id(request_id: Optional[str] = None) -> str:
+    """
+    Set the request ID for the current task and everything it starts.
+
+    Args:
+        request_id: ID to use (e.g. the Twilio MessageSid); a random one if None
+
+    Returns:
+        The request ID that was set
+    """
+    request_id = request_id or new_request_id()
+    _request_id.set(request_id)
+    return request_id
+
+
+def get_request_id() -> str:
+    """Return the request ID of the current task ("-" outside a request)."""
+    return _request_id.get()
+
+
+class Span:
+    """
+    Timed section of the pipeline, used as a context manager.
+
+    Records its duration in the stage latency histogram and counts as in flight
+    while open. An exception leaving the block counts as an error; stages that
+    signal failure by return value call fail() instead.
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.error: Optional[str] = None
+        self._started = 0.0
+
+    def fail(self, error: str = "failed"):
+        """Mark the span as failed without raising."""
+        self.error = error
+
+    def __enter__(self) -> "Span":
+        with _lock:
+            _stage_in_flight[self.stage] = _stage_in_flight.get(self.stage, 0) + 1
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._started
+        if exc_type is not None and self.error is None:
+            self.error = _error_label(exc)
+        _record(self.stage, duration, self.error)
+        if METRICS_LOG_SPANS:
+            outcome = f"error={self.error}" if self.error else "ok"
+            print(f"[{get_request_id()}] {self.stage} {duration * 1000:.0f}ms {outcome}")
+        return False
+
+
+def _error_label(error: BaseException) -> str:
+    """Label an exception by HTTP status when it has one (httpx, OpenAI, Twilio), else by type."""
+    status = (
+        getattr(getattr(error, "response", None), "status_code", None)
+        or getattr(error, "status_code", None)
+        or getattr(error, "status", None)
+    )
+    return f"http_{status}" if isinstance(status, int) else type(error).__name__
+
+
+def span(stage: str) -> Span:
+    """Return a timing span for a pipeline stage: `with span("vision"): ...`."""
+    return Span(stage)
+
+
+def _record(stage: str, duration: float, error: Optional[str]):
+    with _lock:
+        _stage_in_flight[stage] = _stage_in_flight.get(stage, 1) - 1
+        buckets = _stage_buckets.setdefault(stage, [0] * (len(LATENCY_BUCKETS) + 1))
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if duration <= bound:
+                buckets[i] += 1
+                break
+        else:
+            buckets[-1] += 1
+        _stage_sums[stage] = _stage_sums.get(stage, 0.0) + duration
+        if error:
+            _stage_errors[(stage, error)] = _stage_errors.get((stage, error), 0) + 1
+
+
+def record_dropped_step(step: str):
+    """Count an optional step skipped to stay within a job's latency budget."""
+    with _lock:
+        _dropped_steps[step] = _dropped_steps.get(step, 0) + 1
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_stage_metrics() -> List[str]:
+    """Render the stage latency histograms, error counters and in-flight gauges."""
+    with _lock:
+        buckets = {stage: list(counts) for stage, counts in _stage_buckets.items()}
+        sums = dict(_stage_sums)
+        errors = dict(_stage_errors)
+        in_flight = dict(_stage_in_flight)
+        dropped = dict(_dropped_steps)
+
+    lines = [
+        "# HELP menumate_stage_duration_seconds Time spent in each pipeline stage.",
+        "# TYPE menumate_stage_duration_seconds histogram",
+    ]
+    for stage in sorted(buckets):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), buckets[stage]):
+            cumulative += count
+            le = bound if bound == "+Inf" else repr(float(bound))
+            lines.append(f"menumate_stage_duration_seconds_bucket{_labels({'stage': stage, 'le': le})} {cumulative}")
+        lines.append(f"menumate_stage_duration_seconds_sum{_labels({'stage': stage})} {sums[stage]!r}")
+        lines.append(f"menumate_stage_duration_seconds_count{_labels({'stage': stage})} {cumulative}")
+
+    lines += [
+        "# HELP menumate_stage_errors_total Failed pipeline stages by error type.",
+        "# TYPE menumate_stage_errors_total counter",
+    ]
+    for (stage, error), count in sorted(errors.items()):
+        lines.append(f"menumate_stage_errors_total{_labels({'stage': stage, 'error': error})} {count}")
+
+    lines += [
+        "# HELP menumate_stage_in_flight Pipeline stages currently running.",
+        "# TYPE menumate_stage_in_flight gauge",
+    ]
+    for stage, count in sorted(in_flight.items()):
+        lines.append(f"menumate_stage_in_flight{_labels({'stage': stage})} {count}")
+
+    lines += [
+        "# HELP menumate_budget_dropped_steps_total Optional steps skipped to stay within the job latency budget.",
+        "# TYPE menumate_budget_dropped_steps_total counter",
+    ]
+    for step, count in sorted(dropped.items()):
+        lines.append(f"menumate_budget_dropped_steps_total{_labels({'step': step})} {count}")
+    return lines
+
+
+# stats() fields that only ever go up. They are exported as counters with a
+# _total suffix, so rate() and increase() treat process restarts correctly.
+COUNTER_FIELDS = frozenset({
+    "hits", "stale_hits", "misses", "evictions", "parked", "resumed", "expired",
+    "completed", "failed", "rejected", "opened", "retries", "hedges", "batches", "queries",
+})
+
+
+def render_stats_gauges(
+    prefix: str,
+    stats_by_label: Dict[str, Dict],
+    label: Optional[str] = None,
+    help_text: str = "",
+    counters: Iterable[str] = COUNTER_FIELDS
+) -> List[str]:
+    """
+    Render the numeric fields of one or more stats() dicts as gauges, or as
+    counters (prefix_field_total) for the fields named in counters.
+
+    Args:
+        prefix: Metric name prefix (e.g. "menumate_cache"); each field becomes prefix_field
+        stats_by_label: Stats dicts keyed by label value; use {"": stats} for a single unlabeled dict
+        label: Label name for the keys of stats_by_label
+        help_text: HELP text shared by the metrics
+        counters: Field names that are monotonic counters
+
+    Returns:
+        Exposition lines, grouped by metric as Prometheus requires
+    """
+    counters = frozenset(counters)
+    fields: Dict[str, List[Tuple[str, float]]] = {}
+    for label_value, stats in stats_by_label.items():
+        for field, value in stats.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            fields.setdefault(field, []).append((label_value, value))
+
+    lines = []
+    for field, samples in fields.items():
+        is_counter = field in counters
+        name = f"{prefix}_{field}_total" if is_counter else f"{prefix}_{field}"
+        lines.append(f"# HELP {name} {help_text or field}")
+        lines.append(f"# TYPE {name} {'counter' if is_counter else 'gauge'}")
+        for label_value, value in samples:
+            labels = {label: label_value} if label else {}
+            lines.append(f"{name}{_labels(labels)} {_format_number(value)}")
+    return lines
+
+
+def render_metrics(extra_lines: Iterable[str] = ()) -> str:
+    """Return the full Prometheus text exposition: stage metrics followed by extra_lines."""
+    return "\n".join([*render_stage_metrics(), *extra_lines]) + "\n"
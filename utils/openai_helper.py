@@ -2,41 +2,351 @@
 OpenAI helper functions for image analysis and image generation.
 """
 import os
+import copy
+import json
 import asyncio
-from openai import OpenAI
-from typing import Dict, Optional
+from openai import AsyncOpenAI
+from typing import AsyncIterator, Dict, Optional, Tuple, Union
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+from .cache_helper import (
+    TTLCache,
+    CACHE_DB_PATH,
+    stable_digest,
+    image_content_hash,
+    perceptual_hash,
+    hamming_distance
+)
+from .image_helper import encode_data_url
+from .metrics_helper import span
+from .resilience_helper import call_with_resilience, OPENAI_HEDGE_AFTER_SECONDS
 
+# OPENAI_BASE_URL points the client at a local stub server for offline benchmarks.
+# The SDK's own retries are off; call_with_resilience retries behind the "openai" breaker.
+client = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    base_url=os.getenv("OPENAI_BASE_URL") or None,
+    max_retries=0
+)
 
-async def analyze_menu_image(image_url: str, user_question: str = "What should I order?") -> Dict:
+
+class ModelLimiter:
+    """
+    Caps concurrent OpenAI calls for one model family and counts in-flight
+    and queued calls, so bursts queue visibly instead of piling up unbounded.
+    """
+    
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.in_flight = 0
+        self.queued = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+    
+    async def acquire(self):
+        """Wait for a free slot. Prefer `async with limiter:` unless the slot outlives a block."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        self.queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+    
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+    
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+    
+    def stats(self) -> Dict:
+        return {"limit": self.limit, "in_flight": self.in_flight, "queued": self.queued}
+
+
+# Maximum concurrent calls per model family
+VISION_LIMITER = ModelLimiter("vision", int(os.getenv("OPENAI_VISION_CONCURRENCY", "8")))
+TEXT_LIMITER = ModelLimiter("text", int(os.getenv("OPENAI_TEXT_CONCURRENCY", "16")))
+IMAGE_GENERATION_LIMITER = ModelLimiter("image_generation", int(os.getenv("OPENAI_IMAGE_CONCURRENCY", "4")))
+
+
+def get_openai_stats() -> Dict[str, Dict]:
+    """Return limit, in-flight and queued counts for each OpenAI model family."""
+    return {
+        limiter.name: limiter.stats()
+        for limiter in (VISION_LIMITER, TEXT_LIMITER, IMAGE_GENERATION_LIMITER)
+    }
+
+
+async def create_chat_completion(limiter: ModelLimiter, stage: str, **kwargs):
+    """
+    Run a chat completion under the given model family's concurrency limit.
+    
+    The call is timed as a span of the given pipeline stage, including any
+    wait for a free slot and any retries. Each attempt takes its own slot, so
+    backoff sleeps don't hold one.
+    """
+    async def attempt():
+        async with limiter:
+            return await client.chat.completions.create(**kwargs)
+    
+    with span(stage):
+        return await call_with_resilience("openai", attempt, hedge_after=OPENAI_HEDGE_AFTER_SECONDS)
+
+
+async def create_image(**kwargs):
+    """Run an image generation under the image generation concurrency limit (retried, never hedged)."""
+    async def attempt():
+        async with IMAGE_GENERATION_LIMITER:
+            return await client.images.generate(**kwargs)
+    
+    with span("image_generation"):
+        return await call_with_resilience("openai", attempt)
+
+
+async def stream_chat_completion(limiter: ModelLimiter, stage: str, **kwargs) -> AsyncIterator[str]:
+    """
+    Stream a chat completion under the given model family's concurrency limit,
+    yielding the content text as it arrives.
+    
+    Opening the stream is retried like any completion, each attempt taking
+    its own slot so backoff sleeps don't hold one. The successful attempt's
+    slot is held until the stream is fully read (or the caller stops reading).
+    """
+    async def attempt():
+        await limiter.acquire()
+        try:
+            return await client.chat.completions.create(stream=True, **kwargs)
+        except BaseException:
+            limiter.release()
+            raise
+    
+    with span(stage):
+        stream = await call_with_resilience("openai", attempt)
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            limiter.release()
+            await stream.close()
+
+
+async def close_openai_client():
+    """Close the OpenAI client's connection pool. Called on app shutdown."""
+    await client.close()
+
+# "single": one vision call returns the structured JSON directly (default)
+# "two_pass": free-text vision analysis, then a second call to structure it
+MENU_ANALYSIS_MODE = os.getenv("MENU_ANALYSIS_MODE", "single").lower()
+
+MENU_ANALYSIS_SYSTEM_PROMPT = """You are an expert at analyzing restaurant menus and restaurant photos. 
+                    Extract the following information:
+                    1. Restaurant name (if visible)
+                    2. All menu items listed (dish names, descriptions)
+                    3. Language of the menu (if non-English, also translate dish names to English)
+                    4. Cuisine type
+                    5. Any notable characteristics about the restaurant or menu
+                    
+                    Return a structured analysis of the menu."""
+
+# Menu analysis cache, keyed by a hash of the downloaded image bytes.
+# The same physical menu is photographed again and again at a restaurant.
+MENU_CACHE_ENABLED = os.getenv("MENU_CACHE_ENABLED", "true").lower() == "true"
+# Also match near-identical photos by perceptual hash (needs Pillow). Off by
+# default: a false match serves another restaurant's menu, so only enable it
+# where the same menus really are photographed over and over.
+MENU_CACHE_PHASH = os.getenv("MENU_CACHE_PHASH", "false").lower() == "true"
+# Maximum differing bits (out of 256) for two photos to count as the same menu
+MENU_CACHE_PHASH_DISTANCE = int(os.getenv("MENU_CACHE_PHASH_DISTANCE", "8"))
+MENU_CACHE_PHASH_SIZE = 16
+
+menu_analysis_cache = TTLCache(
+    "menu_analysis",
+    max_entries=int(os.getenv("MENU_CACHE_MAX_ENTRIES", "500")),
+    ttl_seconds=float(os.getenv("MENU_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+    db_path=CACHE_DB_PATH
+)
+
+# Recommendation cache, keyed by a digest of the reviews, menu items and
+# restaurant name. Warm restaurants skip the recommendation completion.
+RECOMMENDATION_CACHE_ENABLED = os.getenv("RECOMMENDATION_CACHE_ENABLED", "true").lower() == "true"
+
+# Stream the recommendation completion and report each dish as soon as its
+# name is complete, so link and photo lookups overlap the rest of the generation
+RECOMMENDATION_STREAMING = os.getenv("RECOMMENDATION_STREAMING", "true").lower() == "true"
+RECOMMENDATION_SECTIONS = ("best_reviewed", "worst_reviewed", "diet_option")
+
+recommendation_cache = TTLCache(
+    "recommendations",
+    max_entries=int(os.getenv("RECOMMENDATION_CACHE_MAX_ENTRIES", "1000")),
+    ttl_seconds=float(os.getenv("RECOMMENDATION_CACHE_TTL_SECONDS", str(6 * 3600))),
+    db_path=CACHE_DB_PATH
+)
+
+# Strict JSON schema for single-call extraction; mirrors the two-pass output
+MENU_ANALYSIS_SCHEMA = {
+    "name": "menu_analysis",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "restaurant_name": {
+                "type": ["string", "null"],
+                "description": "Restaurant name if visible, otherwise null"
+            },
+            "menu_items": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "All dish names on the menu (translated to English if needed)"
+            },
+            "cuisine_type": {"type": "string"},
+            "language": {"type": "string"},
+            "analysis": {
+                "type": "string",
+                "description": "Short free-text summary of the menu or restaurant, at most 3 sentences"
+            }
+        },
+        "required": ["restaurant_name", "menu_items", "cuisine_type", "language", "analysis"],
+        "additionalProperties": False
+    }
+}
+
+
+async def get_cached_menu_analysis(image_bytes: bytes) -> tuple[Optional[Dict], str, Optional[int]]:
+    """
+    Look up a cached menu analysis by exact content hash, then by perceptual hash.
+    
+    Args:
+        image_bytes: Raw downloaded image bytes
+        
+    Returns:
+        Tuple of (analysis or None, content_hash, perceptual_hash or None)
+    """
+    content_hash = image_content_hash(image_bytes)
+    entry = menu_analysis_cache.get(content_hash, count=False)
+    if entry:
+        print("Menu analysis cache hit (exact image)")
+        menu_analysis_cache.record_lookup(hit=True)
+        return entry["analysis"], content_hash, entry.get("phash")
+    
+    phash = None
+    if MENU_CACHE_PHASH:
+        # Decoding the photo takes too long to do on the event loop
+        phash = await asyncio.to_thread(perceptual_hash, image_bytes, MENU_CACHE_PHASH_SIZE)
+    if phash is not None:
+        best_key, best_distance = None, MENU_CACHE_PHASH_DISTANCE + 1
+        for key, value in menu_analysis_cache.items():
+            # Entries hashed at another size (older 64-bit hashes) can't be compared
+            if value.get("phash") is None or value.get("phash_size") != MENU_CACHE_PHASH_SIZE:
+                continue
+            distance = hamming_distance(phash, value["phash"])
+            if distance < best_distance:
+                best_key, best_distance = key, distance
+        if best_key:
+            entry = menu_analysis_cache.get(best_key, count=False)
+            if entry:
+                print(f"Menu analysis cache hit (similar image, distance {best_distance})")
+                menu_analysis_cache.record_lookup(hit=True)
+                return entry["analysis"], content_hash, phash
+    
+    menu_analysis_cache.record_lookup(hit=False)
+    return None, content_hash, phash
+
+
+def image_content_part(image: Union[str, bytes], detail: str, content_type: str) -> Dict:
+    """
+    Build the image part of a vision message.
+    
+    Raw bytes are base64-encoded here, at the last moment, so the larger data
+    URL string only lives for the duration of the request.
+    """
+    url = encode_data_url(image, content_type) if isinstance(image, bytes) else image
+    return {"type": "image_url", "image_url": {"url": url, "detail": detail}}
+
+
+async def analyze_menu_image(
+    image: Union[str, bytes],
+    user_question: str = "What should I order?",
+    image_bytes: Optional[bytes] = None,
+    detail: str = "high",
+    content_type: str = "image/jpeg"
+) -> Dict:
     """
     Analyze a menu/restaurant image using GPT-4o vision model.
     
+    By default a single vision call returns the structured JSON via JSON-schema
+    output. Set MENU_ANALYSIS_MODE=two_pass to use the older analyze-then-structure flow.
+    
+    When image_bytes are given, results are cached by image content (and by
+    perceptual hash for near-identical photos), so repeat photos of the same
+    menu skip the vision call entirely.
+    
     Args:
-        image_url: URL of the image to analyze
+        image: URL of the image to analyze, or the raw image bytes
         user_question: User's question about the menu
+        image_bytes: Raw image bytes used as the cache key (defaults to image
+            when it is bytes; no caching for a URL without image_bytes)
+        detail: Vision detail level ("low" or "high")
+        content_type: MIME type of image when it is bytes
+        
+    Returns:
+        Dictionary containing restaurant name, menu items, language, and other context
+    """
+    if image_bytes is None and isinstance(image, bytes):
+        image_bytes = image
+    
+    if not (MENU_CACHE_ENABLED and image_bytes):
+        return await analyze_menu_image_uncached(image, user_question, detail, content_type)
+    
+    cached, content_hash, phash = await get_cached_menu_analysis(image_bytes)
+    if cached:
+        return dict(cached)
+    
+    menu_analysis = await analyze_menu_image_uncached(image, user_question, detail, content_type)
+    if "error" not in menu_analysis:
+        menu_analysis_cache.set(
+            content_hash,
+            {"analysis": menu_analysis, "phash": phash, "phash_size": MENU_CACHE_PHASH_SIZE}
+        )
+    return menu_analysis
+
+
+async def analyze_menu_image_uncached(
+    image: Union[str, bytes],
+    user_question: str = "What should I order?",
+    detail: str = "high",
+    content_type: str = "image/jpeg"
+) -> Dict:
+    """
+    Run the menu analysis against GPT-4o without consulting the cache.
+    
+    Args:
+        image: URL of the image to analyze, or the raw image bytes
+        user_question: User's question about the menu
+        detail: Vision detail level ("low" or "high")
+        content_type: MIME type of image when it is bytes
         
     Returns:
         Dictionary containing restaurant name, menu items, language, and other context
     """
     try:
-        # Run blocking OpenAI calls in thread pool
-        response = await asyncio.to_thread(
-            client.chat.completions.create,
+        if MENU_ANALYSIS_MODE == "two_pass":
+            return await analyze_menu_image_two_pass(image, user_question, detail, content_type)
+        
+        # Single vision call that returns the structured schema directly
+        response = await create_chat_completion(
+            VISION_LIMITER,
+            "vision",
             model="gpt-4o",
             messages=[
                 {
                     "role": "system",
-                    "content": """You are an expert at analyzing restaurant menus and restaurant photos. 
-                    Extract the following information:
-                    1. Restaurant name (if visible)
-                    2. All menu items listed (dish names, descriptions)
-                    3. Language of the menu (if non-English, also translate dish names to English)
-                    4. Cuisine type
-                    5. Any notable characteristics about the restaurant or menu
-                    
-                    Return a structured analysis of the menu."""
+                    "content": MENU_ANALYSIS_SYSTEM_PROMPT
                 },
                 {
                     "role": "user",
@@ -45,13 +355,74 @@ async def analyze_menu_image(image_url: str, user_question: str = "What should I
                             "type": "text",
                             "text": user_question + "\n\nPlease analyze this menu/restaurant image and extract all relevant information."
                         },
+                        image_content_part(image, detail, content_type)
+                    ]
+                }
+            ],
+            response_format={"type": "json_schema", "json_schema": MENU_ANALYSIS_SCHEMA},
+            max_tokens=1500
+        )
+        
+        # A long menu can run out of tokens mid-JSON; the two-pass flow degrades
+        # gracefully there (truncated text, then a separate structuring call)
+        if response.choices[0].finish_reason == "length":
+            print("Structured menu analysis was cut off at max_tokens, retrying with two-pass analysis")
+            return await analyze_menu_image_two_pass(image, user_question, detail, content_type)
+        
+        structured_data = json.loads(response.choices[0].message.content)
+        structured_data["raw_analysis"] = structured_data.get("analysis", "")
+        
+        return structured_data
+        
+    except Exception as e:
+        return {
+            "error": str(e),
+            "restaurant_name": None,
+            "menu_items": [],
+            "cuisine_type": "unknown",
+            "language": "unknown",
+            "analysis": ""
+        }
+
+
+async def analyze_menu_image_two_pass(
+    image: Union[str, bytes],
+    user_question: str = "What should I order?",
+    detail: str = "high",
+    content_type: str = "image/jpeg"
+) -> Dict:
+    """
+    Analyze a menu image with a free-text vision call, then structure it with a second call.
+    
+    Used when MENU_ANALYSIS_MODE is "two_pass".
+    
+    Args:
+        image: URL of the image to analyze, or the raw image bytes
+        user_question: User's question about the menu
+        detail: Vision detail level ("low" or "high")
+        content_type: MIME type of image when it is bytes
+        
+    Returns:
+        Dictionary containing restaurant name, menu items, language, and other context
+    """
+    try:
+        response = await create_chat_completion(
+            VISION_LIMITER,
+            "vision",
+            model="gpt-4o",
+            messages=[
+                {
+                    "role": "system",
+                    "content": MENU_ANALYSIS_SYSTEM_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": [
                         {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": image_url,  # Can be regular URL or data URL
-                                "detail": "high"
-                            }
-                        }
+                            "type": "text",
+                            "text": user_question + "\n\nPlease analyze this menu/restaurant image and extract all relevant information."
+                        },
+                        image_content_part(image, detail, content_type)
                     ]
                 }
             ],
@@ -62,8 +433,9 @@ async def analyze_menu_image(image_url: str, user_question: str = "What should I
         
         # Parse the analysis to extract structured data
         # Use GPT to extract structured JSON
-        structure_response = await asyncio.to_thread(
-            client.chat.completions.create,
+        structure_response = await create_chat_completion(
+            TEXT_LIMITER,
+            "structuring",
             model="gpt-4o",
             messages=[
                 {
@@ -87,7 +459,6 @@ async def analyze_menu_image(image_url: str, user_question: str = "What should I
             response_format={"type": "json_object"}
         )
         
-        import json
         structured_data = json.loads(structure_response.choices[0].message.content)
         structured_data["raw_analysis"] = analysis_text
         
@@ -104,36 +475,33 @@ async def analyze_menu_image(image_url: str, user_question: str = "What should I
         }
 
 
-async def summarize_reviews_and_recommend(reviews_data: str, menu_items: list, restaurant_name: str) -> Dict:
+def recommendation_cache_key(reviews_data: str, menu_items: list, restaurant_name: str) -> str:
     """
-    Use GPT-4o to analyze reviews and provide three recommendations:
-    1. Best reviewed option
-    2. Worst reviewed option (to avoid)
-    3. Best option if on a diet (with ingredient details)
+    Build a stable cache key for a recommendation from its prompt inputs.
     
-    Args:
-        reviews_data: Text containing Google reviews snippets
-        menu_items: List of menu items found in the menu
-        restaurant_name: Name of the restaurant
-        
-    Returns:
-        Dictionary with best_reviewed, worst_reviewed, diet_option, and explanations
+    Menu items are normalized and sorted, so the same menu read in a
+    different order or casing maps to the same key.
     """
-    try:
-        menu_items_str = ", ".join(menu_items) if menu_items else "Not specified"
-        
-        response = await asyncio.to_thread(
-            client.chat.completions.create,
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "system",
-                    "content": """You are a food critic and restaurant advisor. Analyze Google reviews 
+    normalized_items = sorted({" ".join(str(item).casefold().split()) for item in menu_items or []})
+    return stable_digest({
+        "restaurant_name": " ".join((restaurant_name or "").casefold().split()),
+        "menu_items": normalized_items,
+        "reviews_data": (reviews_data or "").strip(),
+    })
+
+
+def recommendation_messages(reviews_data: str, menu_items: list, restaurant_name: str) -> list:
+    """Build the chat messages asking for the best, worst and diet recommendations."""
+    menu_items_str = ", ".join(menu_items) if menu_items else "Not specified"
+    return [
+        {
+            "role": "system",
+            "content": """You are a food critic and restaurant advisor. Analyze Google reviews 
                     and provide three recommendations based on reviews. Be concise but informative."""
-                },
-                {
-                    "role": "user",
-                    "content": f"""Restaurant: {restaurant_name}
+        },
+        {
+            "role": "user",
+            "content": f"""Restaurant: {restaurant_name}
                     
 Available menu items: {menu_items_str}
 
@@ -176,34 +544,231 @@ Return your response in this JSON format:
         "ingredients": "list of main ingredients and why it's diet-friendly"
     }}
 }}"""
-                }
-            ],
+        }
+    ]
+
+
+def fallback_recommendation(menu_items: list, error: Exception, dishes: Optional[Dict[str, str]] = None) -> Dict:
+    """
+    Recommendation used when the completion fails.
+    
+    Args:
+        menu_items: Menu items, the first of which stands in for the best dish
+        error: The failure, shown in place of review highlights
+        dishes: Dish names already streamed per section; kept so the reply
+            matches lookups that were started for them
+    """
+    dishes = dishes or {}
+    return {
+        "best_reviewed": {
+            "dish": dishes.get("best_reviewed") or (menu_items[0] if menu_items else "Ask the waiter for recommendations"),
+            "explanation": "Unable to analyze reviews at this time.",
+            "highlights": str(error)
+        },
+        "worst_reviewed": {
+            "dish": dishes.get("worst_reviewed") or "Not available",
+            "explanation": "Unable to analyze reviews.",
+            "complaints": ""
+        },
+        "diet_option": {
+            "dish": dishes.get("diet_option") or "Not available",
+            "explanation": "Unable to analyze reviews.",
+            "ingredients": ""
+        }
+    }
+
+
+async def summarize_reviews_and_recommend(
+    reviews_data: str,
+    menu_items: list,
+    restaurant_name: str,
+    use_cache: bool = True
+) -> Dict:
+    """
+    Use GPT-4o to analyze reviews and provide three recommendations:
+    1. Best reviewed option
+    2. Worst reviewed option (to avoid)
+    3. Best option if on a diet (with ingredient details)
+    
+    Successful recommendations are cached on their inputs. Pass use_cache=False
+    to force a fresh completion (the result still replaces the cached one).
+    
+    Args:
+        reviews_data: Text containing Google reviews snippets
+        menu_items: List of menu items found in the menu
+        restaurant_name: Name of the restaurant
+        use_cache: Whether a cached recommendation may be returned
+        
+    Returns:
+        Dictionary with best_reviewed, worst_reviewed, diet_option, and explanations
+    """
+    cache_key = None
+    if RECOMMENDATION_CACHE_ENABLED:
+        cache_key = recommendation_cache_key(reviews_data, menu_items, restaurant_name)
+        if use_cache:
+            cached = recommendation_cache.get(cache_key)
+            if cached is not None:
+                print(f"Recommendation cache hit for: {restaurant_name}")
+                return copy.deepcopy(cached)
+    
+    try:
+        response = await create_chat_completion(
+            TEXT_LIMITER,
+            "recommendation",
+            model="gpt-4o",
+            messages=recommendation_messages(reviews_data, menu_items, restaurant_name),
             response_format={"type": "json_object"},
             max_tokens=800
         )
         
-        import json
         recommendation = json.loads(response.choices[0].message.content)
+        if cache_key:
+            recommendation_cache.set(cache_key, recommendation)
         return recommendation
         
     except Exception as e:
-        return {
-            "best_reviewed": {
-                "dish": menu_items[0] if menu_items else "Ask the waiter for recommendations",
-                "explanation": "Unable to analyze reviews at this time.",
-                "highlights": str(e)
-            },
-            "worst_reviewed": {
-                "dish": "Not available",
-                "explanation": "Unable to analyze reviews.",
-                "complaints": ""
-            },
-            "diet_option": {
-                "dish": "Not available",
-                "explanation": "Unable to analyze reviews.",
-                "ingredients": ""
-            }
-        }
+        return fallback_recommendation(menu_items, e)
+
+
+class RecommendationStreamParser:
+    """
+    Incremental JSON scanner for a streamed recommendation.
+    
+    Fed the completion text chunk by chunk, it reports each section
+    (best_reviewed, worst_reviewed, diet_option) as soon as that section's
+    "dish" string has been closed, without waiting for the rest of the JSON.
+    Only tracks what it needs: string boundaries, nesting depth and the key
+    being filled at each depth.
+    """
+    
+    def __init__(self):
+        self.text = ""
+        self.dishes: Dict[str, str] = {}
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._string_start = 0
+        self._expecting_key = False
+        self._keys: Dict[int, str] = {}
+    
+    def feed(self, chunk: str) -> list:
+        """
+        Add a chunk of completion text.
+        
+        Returns:
+            (section, dish name) pairs completed by this chunk, in order
+        """
+        self.text += chunk
+        completed = []
+        while self._pos < len(self.text):
+            char = self.text[self._pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    value = json.loads(self.text[self._string_start:self._pos + 1])
+                    section = self._on_string(value)
+                    if section:
+                        completed.append((section, value))
+            elif char == '"':
+                self._in_string = True
+                self._string_start = self._pos
+            elif char == "{":
+                self._depth += 1
+                self._expecting_key = True
+            elif char == "}":
+                self._keys.pop(self._depth, None)
+                self._depth -= 1
+            elif char == ",":
+                self._expecting_key = True
+            elif char == ":":
+                self._expecting_key = False
+            self._pos += 1
+        return completed
+    
+    def _on_string(self, value: str) -> Optional[str]:
+        if self._expecting_key:
+            self._keys[self._depth] = value
+            return None
+        section = self._keys.get(1)
+        if (
+            self._depth == 2
+            and self._keys.get(2) == "dish"
+            and section in RECOMMENDATION_SECTIONS
+            and section not in self.dishes
+        ):
+            self.dishes[section] = value
+            return section
+        return None
+
+
+async def stream_recommendation(
+    reviews_data: str,
+    menu_items: list,
+    restaurant_name: str,
+    use_cache: bool = True
+) -> AsyncIterator[Tuple[str, Dict]]:
+    """
+    Like summarize_reviews_and_recommend, but report each dish as soon as it is known.
+    
+    With RECOMMENDATION_STREAMING the completion is streamed and parsed as it
+    arrives, so callers can start per-dish lookups while the rest is still
+    being generated. Otherwise (or on a cache hit) everything is yielded at once.
+    
+    Yields:
+        (section, {"dish": name}) for best_reviewed, worst_reviewed and
+        diet_option in the order the model writes them, then
+        ("recommendation", full recommendation dict) last
+    """
+    cache_key = None
+    if RECOMMENDATION_CACHE_ENABLED:
+        cache_key = recommendation_cache_key(reviews_data, menu_items, restaurant_name)
+    if not RECOMMENDATION_STREAMING:
+        recommendation = await summarize_reviews_and_recommend(reviews_data, menu_items, restaurant_name, use_cache)
+    else:
+        recommendation = recommendation_cache.get(cache_key) if cache_key and use_cache else None
+        if recommendation is not None:
+            print(f"Recommendation cache hit for: {restaurant_name}")
+            recommendation = copy.deepcopy(recommendation)
+    if recommendation is not None:
+        for section in RECOMMENDATION_SECTIONS:
+            if isinstance(recommendation.get(section), dict):
+                yield section, {"dish": recommendation[section].get("dish", "")}
+        yield "recommendation", recommendation
+        return
+    
+    parser = RecommendationStreamParser()
+    try:
+        async for chunk in stream_chat_completion(
+            TEXT_LIMITER,
+            "recommendation",
+            model="gpt-4o",
+            messages=recommendation_messages(reviews_data, menu_items, restaurant_name),
+            response_format={"type": "json_object"},
+            max_tokens=800
+        ):
+            for section, dish in parser.feed(chunk):
+                yield section, {"dish": dish}
+        recommendation = json.loads(parser.text)
+    except Exception as e:
+        recommendation = fallback_recommendation(menu_items, e, parser.dishes)
+        for section in RECOMMENDATION_SECTIONS:
+            if section not in parser.dishes:
+                yield section, {"dish": recommendation[section]["dish"]}
+        yield "recommendation", recommendation
+        return
+    
+    if cache_key:
+        recommendation_cache.set(cache_key, recommendation)
+    # Sections the parser missed (unexpected shape) are reported from the full result
+    for section in RECOMMENDATION_SECTIONS:
+        if section not in parser.dishes and isinstance(recommendation.get(section), dict):
+            yield section, {"dish": recommendation[section].get("dish", "")}
+    yield "recommendation", recommendation
 
 
 async def generate_dish_image(restaurant_name: str, dish_name: str, cuisine_type: str = "unknown") -> Optional[str]:
@@ -228,8 +793,7 @@ async def generate_dish_image(restaurant_name: str, dish_name: str, cuisine_type
         
         print(f"Generating DALL-E 3 image with prompt: {prompt[:100]}...")
         
-        response = await asyncio.to_thread(
-            client.images.generate,
+        response = await create_image(
             model="dall-e-3",
             prompt=prompt,
             size="1024x1024",
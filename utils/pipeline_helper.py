@@ -0,0 +1,263 @@
+"""
+Small stage-graph engine for the menu pipeline.
+
+Stages declare the values they read and the values they produce; the
+scheduler starts every stage as soon as its inputs exist, so independent
+stages overlap without hand-written gather calls.
+"""
+import time
+import asyncio
+import inspect
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from .metrics_helper import span
+
+
+class StopPipeline(Exception):
+    """Raised by a stage to end the run early, e.g. after telling the user why."""
+
+
+class Stage:
+    """
+    One step of a pipeline.
+
+    The stage function is called with one keyword argument per input and
+    returns its output (a dict keyed by output name when it has several).
+    It may be sync or async. An async generator stage instead yields
+    (output name, value) pairs, and each value is published as soon as it is
+    yielded, so downstream stages can start before the stage has finished.
+
+    Args:
+        name: Stage name, used in traces and the stage's timing span
+        func: Function computing the outputs from the inputs
+        inputs: Names of the values the stage needs before it can start
+        outputs: Names of the values it produces (defaults to the stage name)
+        timeout: Seconds, or a function of the current values returning seconds
+            (or None for no limit), evaluated when the stage starts
+        optional: If True, an error or timeout yields `default` for every output
+            instead of failing the run
+        default: Output value used when the stage is skipped or (if optional) fails
+        when: Function of the current values; if it returns False the stage is
+            skipped and its outputs are set to `default`
+        checkpoint: Load the outputs from the run's checkpoints when present
+            (skipping the stage) and save them when the stage finishes. Pass a
+            list of output names to checkpoint only those (e.g. leaving out
+            bytes); the others are set to `default` when loading
+        cleanup: Called with each output when the run ends, e.g. to cancel a
+            speculative task no later stage consumed
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable,
+        inputs: Sequence[str] = (),
+        outputs: Union[str, Sequence[str], None] = None,
+        timeout: Union[float, Callable[[Dict[str, Any]], Optional[float]], None] = None,
+        optional: bool = False,
+        default: Any = None,
+        when: Optional[Callable[[Dict[str, Any]], bool]] = None,
+        checkpoint: Union[bool, Sequence[str]] = False,
+        cleanup: Optional[Callable[[Any], None]] = None
+    ):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        if outputs is None:
+            outputs = name
+        self.outputs = (outputs,) if isinstance(outputs, str) else tuple(outputs)
+        self.timeout = timeout
+        self.optional = optional
+        self.default = default
+        self.when = when
+        self.checkpoint = self.outputs if checkpoint is True else tuple(checkpoint or ())
+        self.cleanup = cleanup
+
+    def __repr__(self) -> str:
+        return f"Stage({self.name!r}, inputs={self.inputs}, outputs={self.outputs})"
+
+
+class Pipeline:
+    """
+    A named set of stages, run as a dependency graph.
+
+    Every input must be either an initial value or some stage's output; this
+    is checked when the pipeline is built, not halfway through a run.
+    """
+
+    def __init__(self, name: str, stages: Iterable[Stage], initial_values: Iterable[str] = ()):
+        self.name = name
+        self.stages: List[Stage] = list(stages)
+        available = set(initial_values)
+        for stage in self.stages:
+            available.update(stage.outputs)
+        for stage in self.stages:
+            missing = [value for value in stage.inputs if value not in available]
+            if missing:
+                raise ValueError(f"Pipeline '{name}': stage '{stage.name}' needs unknown inputs {missing}")
+
+    async def run(
+        self,
+        values: Dict[str, Any],
+        checkpoints: Optional[Dict[str, Any]] = None,
+        save_checkpoint: Optional[Callable[[str, Any], None]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Run all stages, each as soon as its inputs are available.
+
+        Args:
+            values: Initial values (request parameters, the job's latency budget...)
+            checkpoints: Outputs saved by an earlier attempt, for checkpointed stages
+            save_checkpoint: Callback receiving (output name, value) for checkpointed stages
+
+        Returns:
+            All values at the end of the run, or None if a stage raised StopPipeline
+
+        Raises:
+            Whatever a required (non-optional) stage raised; the other running
+            stages are cancelled first
+        """
+        values = dict(values)
+        checkpoints = checkpoints or {}
+        started = time.monotonic()
+        trace: List[Tuple[str, float, float, str]] = []
+        pending: List[Stage] = []
+        for stage in self.stages:
+            if stage.checkpoint and all(name in checkpoints for name in stage.checkpoint):
+                for name in stage.outputs:
+                    values[name] = checkpoints.get(name, stage.default)
+                trace.append((stage.name, 0.0, 0.0, "checkpoint"))
+            else:
+                pending.append(stage)
+        running: Dict[asyncio.Task, Tuple[Stage, float]] = {}
+        finished: List[Stage] = []
+        # Set by streaming stages when they publish an output before finishing
+        progress = asyncio.Event()
+
+        try:
+            while pending or running:
+                # Skipped stages publish their defaults immediately, which can unblock more stages
+                progressed = True
+                while progressed:
+                    progressed = False
+                    for stage in list(pending):
+                        if not all(name in values for name in stage.inputs):
+                            continue
+                        pending.remove(stage)
+                        progressed = True
+                        if stage.when is not None and not stage.when(values):
+                            self._publish(stage, None, values, skipped=True)
+                            trace.append((stage.name, time.monotonic() - started, time.monotonic() - started, "skipped"))
+                            continue
+                        task = asyncio.create_task(self._run_stage(stage, values, progress))
+                        running[task] = (stage, time.monotonic() - started)
+
+                if not running:
+                    if pending:
+                        raise RuntimeError(
+                            f"Pipeline '{self.name}' is stuck: {[stage.name for stage in pending]} can never start"
+                        )
+                    break
+
+                progress.clear()
+                waiter = asyncio.ensure_future(progress.wait())
+                try:
+                    done, _ = await asyncio.wait([*running, waiter], return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    waiter.cancel()
+                for task in done:
+                    if task is waiter:
+                        continue
+                    stage, stage_started = running.pop(task)
+                    result, outcome = task.result()
+                    self._publish(stage, result, values)
+                    finished.append(stage)
+                    trace.append((stage.name, stage_started, time.monotonic() - started, outcome))
+                    if stage.checkpoint and save_checkpoint and outcome == "ok":
+                        for name in stage.checkpoint:
+                            save_checkpoint(name, values[name])
+        except StopPipeline as e:
+            print(f"Pipeline '{self.name}' stopped early: {e or 'stage asked to stop'}")
+            return None
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+            for stage in finished:
+                if stage.cleanup:
+                    for name in stage.outputs:
+                        stage.cleanup(values.get(name))
+            self._print_trace(trace, time.monotonic() - started)
+        return values
+
+    async def _run_stage(self, stage: Stage, values: Dict[str, Any], progress: asyncio.Event) -> Tuple[Any, str]:
+        """Run one stage under its timeout and span. Returns (result, outcome)."""
+        kwargs = {name: values[name] for name in stage.inputs}
+        timeout = stage.timeout(values) if callable(stage.timeout) else stage.timeout
+        if inspect.isasyncgenfunction(stage.func):
+            call = self._stream(stage, kwargs, values, progress)
+        else:
+            call = self._call(stage.func, kwargs)
+        with span(f"stage_{stage.name}") as stage_span:
+            try:
+                return await asyncio.wait_for(call, timeout=timeout), "ok"
+            except (StopPipeline, asyncio.CancelledError):
+                raise
+            except asyncio.TimeoutError:
+                if not stage.optional:
+                    raise
+                limit = f" after {timeout:.1f}s" if timeout is not None else ""
+                print(f"⏱️ Stage '{stage.name}' timed out{limit}, continuing without it")
+                stage_span.fail("timeout")
+                return None, "timeout"
+            except Exception as e:
+                if not stage.optional:
+                    raise
+                print(f"⚠️ Stage '{stage.name}' failed, continuing without it: {e}")
+                stage_span.fail(type(e).__name__)
+                return None, "error"
+
+    @staticmethod
+    async def _call(func: Callable, kwargs: Dict[str, Any]) -> Any:
+        result = func(**kwargs)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    @staticmethod
+    async def _stream(stage: Stage, kwargs: Dict[str, Any], values: Dict[str, Any], progress: asyncio.Event) -> Dict[str, Any]:
+        """
+        Drive an async generator stage, publishing each yielded output right
+        away. Returns everything it yielded, for the final publish.
+        """
+        yielded: Dict[str, Any] = {}
+        generator = stage.func(**kwargs)
+        try:
+            async for name, value in generator:
+                if name not in stage.outputs:
+                    raise ValueError(f"Stage '{stage.name}' yielded unknown output '{name}'")
+                yielded[name] = values[name] = value
+                progress.set()
+        finally:
+            await generator.aclose()
+        return yielded
+
+    @staticmethod
+    def _publish(stage: Stage, result: Any, values: Dict[str, Any], skipped: bool = False):
+        if skipped or result is None and (stage.optional or len(stage.outputs) > 1):
+            # Keep anything a streaming stage published before it failed
+            for name in stage.outputs:
+                values.setdefault(name, stage.default)
+        elif len(stage.outputs) == 1:
+            values[stage.outputs[0]] = result
+        else:
+            for name in stage.outputs:
+                values[name] = result.get(name, stage.default)
+
+    def _print_trace(self, trace: List[Tuple[str, float, float, str]], total: float):
+        steps = ", ".join(
+            f"{name} {start:.2f}-{end:.2f}s" + ("" if outcome == "ok" else f" ({outcome})")
+            for name, start, end, outcome in trace
+        )
+        print(f"Pipeline '{self.name}' finished in {total:.2f}s: {steps}")
@@ -0,0 +1,264 @@
+"""
+Retries, hedged requests and circuit breakers shared by the external API helpers
+(Serper, OpenAI, Twilio).
+"""
+import os
+import time
+import random
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+import httpx
+import openai
+
+T = TypeVar("T")
+
+# Transient failures (timeouts, network errors, 429, 5xx) are retried up to
+# RETRY_MAX_ATTEMPTS attempts in total, sleeping a random "full jitter" delay
+# between 0 and min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * 2^n).
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY_SECONDS = float(os.getenv("RETRY_BASE_DELAY_SECONDS", "0.25"))
+RETRY_MAX_DELAY_SECONDS = float(os.getenv("RETRY_MAX_DELAY_SECONDS", "4"))
+
+# A dependency that fails BREAKER_FAILURE_THRESHOLD times in a row is cut off
+# for BREAKER_RESET_SECONDS; calls fail fast with CircuitOpenError meanwhile.
+# Then a single probe call decides whether it closes again.
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+# Send a duplicate request if the first hasn't answered after this many
+# seconds and take whichever finishes first (0 disables hedging). Off by
+# default since every hedge is a second billed call.
+SERPER_HEDGE_AFTER_SECONDS = float(os.getenv("SERPER_HEDGE_AFTER_SECONDS", "0"))
+OPENAI_HEDGE_AFTER_SECONDS = float(os.getenv("OPENAI_HEDGE_AFTER_SECONDS", "0"))
+
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit breaker is open."""
+
+    def __init__(self, dependency: str):
+        super().__init__(f"{dependency} circuit breaker is open")
+        self.dependency = dependency
+
+
+class CircuitBreaker:
+    """
+    Per-dependency circuit breaker.
+
+    "closed": calls go through; consecutive transient failures are counted.
+    "open": calls are rejected until reset_seconds have passed.
+    "half_open": one probe call is let through; success closes the breaker,
+    failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.probe_in_flight = False
+        self.opened = 0
+        self.rejected = 0
+        self.retries = 0
+        self.hedges = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_seconds:
+            return "open"
+        return "half_open"
+
+    def allow_request(self) -> bool:
+        """Return True if a call may go out now; counts the rejection if not."""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            print(f"🟢 Circuit breaker '{self.name}' closed")
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        reopening = self.probe_in_flight
+        self.probe_in_flight = False
+        if reopening or (self.opened_at is None and self.consecutive_failures >= self.failure_threshold):
+            self.opened_at = time.monotonic()
+            self.opened += 1
+            print(
+                f"🔴 Circuit breaker '{self.name}' opened after {self.consecutive_failures} "
+                f"consecutive failures, failing fast for {self.reset_seconds:.0f}s"
+            )
+
+    def stats(self) -> Dict:
+        """Return breaker state (as open/half_open flags), failure streak and call counters."""
+        state = self.state
+        return {
+            "open": int(state == "open"),
+            "half_open": int(state == "half_open"),
+            "consecutive_failures": self.consecutive_failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+            "retries": self.retries,
+            "hedges": self.hedges,
+        }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(dependency: str) -> CircuitBreaker:
+    """Return the circuit breaker for a dependency, creating it on first use."""
+    breaker = _breakers.get(dependency)
+    if breaker is None:
+        breaker = CircuitBreaker(dependency, BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS)
+        _breakers[dependency] = breaker
+    return breaker
+
+
+def get_resilience_stats() -> Dict[str, Dict]:
+    """Return circuit breaker state and retry/hedge counters for each dependency."""
+    return {name: breaker.stats() for name, breaker in _breakers.items()}
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    status = (
+        getattr(getattr(error, "response", None), "status_code", None)
+        or getattr(error, "status_code", None)
+        or getattr(error, "status", None)
+    )
+    return status if isinstance(status, int) else None
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """
+    Return True for failures worth retrying and counting against the breaker:
+    timeouts, network errors, 408/409/429 and 5xx. Other 4xx are our own
+    mistakes and would fail the same way again.
+    """
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, (asyncio.TimeoutError, httpx.TransportError, openai.APIConnectionError)):
+        return True
+    status = _status_code(error)
+    return status is not None and (status in RETRYABLE_STATUS_CODES or status >= 500)
+
+
+def backoff_delay(attempt: int, base: float = RETRY_BASE_DELAY_SECONDS, cap: float = RETRY_MAX_DELAY_SECONDS) -> float:
+    """Return a full-jitter delay before retry number attempt + 1."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    """Return the server's Retry-After in seconds, if the error response carries one."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    try:
+        return float(headers.get("retry-after")) if headers else None
+    except (TypeError, ValueError):
+        return None
+
+
+async def _hedged(call: Callable[[], Awaitable[T]], hedge_after: float, breaker: CircuitBreaker) -> T:
+    """
+    Run call(); if it hasn't finished after hedge_after seconds, run a second
+    copy alongside it and return the first successful result.
+    """
+    tasks = [asyncio.ensure_future(call())]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+        if not done:
+            breaker.hedges += 1
+            tasks.append(asyncio.ensure_future(call()))
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def call_with_resilience(
+    dependency: str,
+    call: Callable[[], Awaitable[T]],
+    max_attempts: int = RETRY_MAX_ATTEMPTS,
+    base_delay: float = RETRY_BASE_DELAY_SECONDS,
+    hedge_after: float = 0,
+    retry_on: Callable[[BaseException], bool] = is_transient_error
+) -> T:
+    """
+    Call an external API through its dependency's circuit breaker, retrying
+    transient failures with jittered exponential backoff.
+
+    Only use retries and hedging for calls that are safe to repeat. For
+    non-idempotent calls, pass a retry_on that only accepts errors proving the
+    request was not processed (e.g. refused connections, 429/503).
+
+    Args:
+        dependency: Breaker name ("serper", "openai", "twilio")
+        call: Zero-argument function that starts one attempt (called again for each retry or hedge)
+        max_attempts: Attempts in total, including the first
+        base_delay: Backoff base in seconds
+        hedge_after: Seconds before a duplicate request is sent (0 disables hedging)
+        retry_on: Predicate deciding which errors are retried; the breaker counts is_transient_error failures regardless
+
+    Returns:
+        The result of the first successful attempt
+
+    Raises:
+        CircuitOpenError: If the breaker is open (no request is sent)
+        The last attempt's exception if every attempt failed
+    """
+    breaker = get_breaker(dependency)
+    for attempt in range(max_attempts):
+        if not breaker.allow_request():
+            raise CircuitOpenError(dependency)
+        try:
+            if hedge_after > 0:
+                result = await _hedged(call, hedge_after, breaker)
+            else:
+                result = await call()
+        except asyncio.CancelledError:
+            # Cancelled from outside (timeout, shutdown): not the dependency's fault
+            breaker.probe_in_flight = False
+            raise
+        except Exception as e:
+            # Whether the dependency is unhealthy doesn't depend on whether
+            # this particular call can safely be repeated
+            if is_transient_error(e) or retry_on(e):
+                breaker.record_failure()
+            else:
+                # The dependency answered; the request itself was wrong
+                breaker.record_success()
+            if not retry_on(e) or attempt + 1 >= max_attempts or breaker.state != "closed":
+                raise
+            delay = backoff_delay(attempt, base_delay)
+            retry_after = _retry_after(e)
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, RETRY_MAX_DELAY_SECONDS))
+            breaker.retries += 1
+            print(f"{dependency} call failed (attempt {attempt + 1}/{max_attempts}): {e}. Retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
+    raise CircuitOpenError(dependency)
@@ -2,15 +2,240 @@
 Serper.dev API helper for searching Google Reviews and Images.
 """
 import os
+import re
 import asyncio
-import requests
-from typing import Optional, Dict
+import httpx
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .cache_helper import TTLCache, CACHE_DB_PATH
+from .http_helper import http_request
+from .metrics_helper import span
+from .resilience_helper import call_with_resilience, CircuitOpenError, SERPER_HEDGE_AFTER_SECONDS
+
+# Serper API root; point it at a local stub server for offline benchmarks
+SERPER_BASE_URL = os.getenv("SERPER_BASE_URL", "https://google.serper.dev").rstrip("/")
+
+# Review snippets barely change hour to hour: serve fresh entries for
+# REVIEW_CACHE_TTL_SECONDS, then serve them stale for REVIEW_CACHE_STALE_SECONDS
+# more while a background refresh runs. No-result and error responses are
+# cached for the much shorter REVIEW_CACHE_NEGATIVE_TTL_SECONDS.
+REVIEW_CACHE_ENABLED = os.getenv("REVIEW_CACHE_ENABLED", "true").lower() == "true"
+REVIEW_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("REVIEW_CACHE_NEGATIVE_TTL_SECONDS", "300"))
+REVIEW_CACHE_PERSIST = os.getenv("REVIEW_CACHE_PERSIST", "true").lower() == "true"
+
+review_cache = TTLCache(
+    "reviews",
+    max_entries=int(os.getenv("REVIEW_CACHE_MAX_ENTRIES", "2000")),
+    ttl_seconds=float(os.getenv("REVIEW_CACHE_TTL_SECONDS", str(6 * 3600))),
+    stale_seconds=float(os.getenv("REVIEW_CACHE_STALE_SECONDS", str(24 * 3600))),
+    db_path=CACHE_DB_PATH if REVIEW_CACHE_PERSIST else None
+)
+
+# Per-(restaurant, dish) caches for review links and dish photos. The LLM tends
+# to recommend the same dishes, so repeat recommendations skip Serper and the
+# image verification GET. "Not found" results expire sooner than real hits.
+DISH_CACHE_ENABLED = os.getenv("DISH_CACHE_ENABLED", "true").lower() == "true"
+DISH_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("DISH_CACHE_NEGATIVE_TTL_SECONDS", "1800"))
+
+review_link_cache = TTLCache(
+    "review_links",
+    max_entries=int(os.getenv("DISH_CACHE_MAX_ENTRIES", "5000")),
+    ttl_seconds=float(os.getenv("DISH_CACHE_TTL_SECONDS", str(3 * 24 * 3600))),
+    db_path=CACHE_DB_PATH
+)
+# Image results kept per dish; they are verified concurrently and the first
+# reachable one is sent
+DISH_IMAGE_CANDIDATES = int(os.getenv("DISH_IMAGE_CANDIDATES", "3"))
+
+dish_image_cache = TTLCache(
+    "dish_images",
+    max_entries=int(os.getenv("DISH_CACHE_MAX_ENTRIES", "5000")),
+    ttl_seconds=float(os.getenv("DISH_CACHE_TTL_SECONDS", str(3 * 24 * 3600))),
+    db_path=CACHE_DB_PATH
+)
+
+# Per-dish searches (review links, dish photos) waiting up to
+# SERPER_BATCH_WINDOW_SECONDS are sent together as one Serper request with an
+# array of queries, at most SERPER_BATCH_MAX_QUERIES per request. This merges
+# the lookups of one reply that start together and those of concurrent jobs.
+SERPER_BATCH_ENABLED = os.getenv("SERPER_BATCH_ENABLED", "true").lower() == "true"
+SERPER_BATCH_WINDOW_SECONDS = float(os.getenv("SERPER_BATCH_WINDOW_SECONDS", "0.05"))
+SERPER_BATCH_MAX_QUERIES = int(os.getenv("SERPER_BATCH_MAX_QUERIES", "20"))
+
+# Review searches currently running, by cache key. Concurrent misses for the same
+# restaurant share one Serper call, and background refreshes are not repeated.
+_review_searches_in_flight: Dict[str, asyncio.Task] = {}
+
+
+async def serper_post(url: str, headers: Dict, payload: Any) -> httpx.Response:
+    """
+    POST a Serper query through the "serper" circuit breaker.
+    
+    Searches are read-only, so timeouts, 429s and 5xx are retried (and
+    optionally hedged) before the error reaches the caller.
+    """
+    async def attempt() -> httpx.Response:
+        response = await http_request("POST", url, headers=headers, json=payload, timeout=10)
+        response.raise_for_status()
+        return response
+    
+    return await call_with_resilience("serper", attempt, hedge_after=SERPER_HEDGE_AFTER_SECONDS)
+
+
+class SerperBatcher:
+    """
+    Collects queries for one Serper endpoint and sends them as batch requests.
+    
+    The first query opens a window of window_seconds; everything submitted
+    before it closes (or until max_queries is reached) goes out in one POST
+    and each caller gets its own result back. A failed batch fails every
+    query in it.
+    """
+    
+    def __init__(self, name: str, path: str, window_seconds: float, max_queries: int):
+        self.name = name
+        self.path = path
+        self.window_seconds = window_seconds
+        self.max_queries = max(1, max_queries)
+        self.batches = 0
+        self.queries = 0
+        self.largest_batch = 0
+        self._pending: List[Tuple[Dict, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Strong references to batches in flight so they aren't garbage-collected
+        self._sending: Set[asyncio.Task] = set()
+    
+    async def search(self, payload: Dict) -> Dict:
+        """
+        Queue a query for the next batch and wait for its result.
+        
+        Args:
+            payload: One Serper query ({"q": ..., "num": ...})
+            
+        Returns:
+            The Serper response for this query
+            
+        Raises:
+            Whatever the batch request raised (httpx.HTTPError, CircuitOpenError...)
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((payload, future))
+        if len(self._pending) >= self.max_queries:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_seconds, self._flush)
+        return await future
+    
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # Callers that gave up (timed out, cancelled) before the window closed don't need a query
+        batch = [(payload, future) for payload, future in self._pending if not future.done()]
+        self._pending = []
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._send(batch))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+    
+    async def _send(self, batch: List[Tuple[Dict, asyncio.Future]]):
+        self.batches += 1
+        self.queries += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        headers = {
+            "X-API-KEY": os.getenv("SERPER_API_KEY", ""),
+            "Content-Type": "application/json"
+        }
+        url = f"{SERPER_BASE_URL}{self.path}"
+        try:
+            if len(batch) == 1:
+                response = await serper_post(url, headers, batch[0][0])
+                results = [response.json()]
+            else:
+                response = await serper_post(url, headers, [payload for payload, _ in batch])
+                results = response.json()
+                if not isinstance(results, list) or len(results) != len(batch):
+                    raise ValueError(f"Serper batch of {len(batch)} queries returned an unexpected response")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+    
+    def stats(self) -> Dict:
+        """Return batch counters and the average batch size."""
+        return {
+            "batches": self.batches,
+            "queries": self.queries,
+            "average_batch_size": round(self.queries / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "pending": len(self._pending),
+        }
+
+
+link_search_batcher = SerperBatcher("link_search", "/search", SERPER_BATCH_WINDOW_SECONDS, SERPER_BATCH_MAX_QUERIES)
+image_search_batcher = SerperBatcher("image_search", "/images", SERPER_BATCH_WINDOW_SECONDS, SERPER_BATCH_MAX_QUERIES)
+
+
+async def serper_search(batcher: SerperBatcher, payload: Dict) -> Dict:
+    """
+    Run one Serper query through its endpoint's batcher, or directly when
+    batching is disabled.
+    
+    Returns:
+        The decoded Serper response for the query
+    """
+    if SERPER_BATCH_ENABLED:
+        return await batcher.search(payload)
+    headers = {
+        "X-API-KEY": os.getenv("SERPER_API_KEY", ""),
+        "Content-Type": "application/json"
+    }
+    response = await serper_post(f"{SERPER_BASE_URL}{batcher.path}", headers, payload)
+    return response.json()
+
+
+def get_serper_batch_stats() -> Dict[str, Dict]:
+    """Return batch counters for each batched Serper endpoint."""
+    return {batcher.name: batcher.stats() for batcher in (link_search_batcher, image_search_batcher)}
+
+
+def normalize_restaurant_name(name: Optional[str]) -> str:
+    """
+    Normalize a restaurant name for comparisons and cache keys.
+    
+    Lowercases, strips punctuation and collapses whitespace, so
+    "Chez Janou!" and "chez  janou" compare equal.
+    
+    Args:
+        name: Restaurant name (may be None)
+        
+    Returns:
+        Normalized name, or an empty string if name is empty
+    """
+    if not name:
+        return ""
+    name = re.sub(r"[^\w\s]", " ", name.casefold())
+    return " ".join(name.split())
+
+
+def review_cache_key(restaurant_name: str, location: Optional[str] = None) -> str:
+    """Build the review cache key from the normalized restaurant name and location."""
+    return f"{normalize_restaurant_name(restaurant_name)}|{normalize_restaurant_name(location)}"
 
 
 async def search_google_reviews(restaurant_name: str, location: Optional[str] = None) -> str:
     """
     Search for Google reviews of a restaurant using Serper.dev API.
     
+    Results are cached per normalized restaurant name and location. Stale
+    entries are returned immediately while a background refresh runs.
+    
     Args:
         restaurant_name: Name of the restaurant
         location: Optional location (city, address) to narrow search
@@ -18,9 +243,68 @@ async def search_google_reviews(restaurant_name: str, location: Optional[str] =
     Returns:
         String containing review snippets and ratings
     """
+    if not os.getenv("SERPER_API_KEY"):
+        return "No API key configured for reviews search."
+    
+    if not REVIEW_CACHE_ENABLED:
+        reviews, _ = await fetch_google_reviews(restaurant_name, location)
+        return reviews
+    
+    key = review_cache_key(restaurant_name, location)
+    cached, is_stale = review_cache.get_stale(key)
+    # Negative entries are never served stale; they just expire
+    if cached is not None and (cached["found"] or not is_stale):
+        if is_stale and key not in _review_searches_in_flight:
+            print(f"Serving stale reviews for {restaurant_name}, refreshing in background")
+            start_review_search(key, restaurant_name, location)
+        return cached["reviews"]
+    
+    # Shield the shared search so one caller cancelling doesn't cancel it for the others
+    task = _review_searches_in_flight.get(key) or start_review_search(key, restaurant_name, location)
+    return await asyncio.shield(task)
+
+
+def start_review_search(key: str, restaurant_name: str, location: Optional[str]) -> asyncio.Task:
+    """
+    Start a review search that stores its result in the cache, deduplicated per key.
+    
+    Returns:
+        The running task, which resolves to the review text
+    """
+    async def search_and_store() -> str:
+        try:
+            reviews, found = await fetch_google_reviews(restaurant_name, location)
+            entry = {"reviews": reviews, "found": found}
+            if found:
+                review_cache.set(key, entry)
+            else:
+                # Don't let a failed refresh replace a good entry that's still servable
+                previous, _ = review_cache.get_stale(key, count=False)
+                if not (previous and previous["found"]):
+                    review_cache.set(key, entry, ttl_seconds=REVIEW_CACHE_NEGATIVE_TTL_SECONDS)
+            return reviews
+        finally:
+            _review_searches_in_flight.pop(key, None)
+    
+    task = asyncio.create_task(search_and_store())
+    _review_searches_in_flight[key] = task
+    return task
+
+
+async def fetch_google_reviews(restaurant_name: str, location: Optional[str] = None) -> tuple[str, bool]:
+    """
+    Search Serper.dev for Google reviews of a restaurant, bypassing the cache.
+    
+    Args:
+        restaurant_name: Name of the restaurant
+        location: Optional location (city, address) to narrow search
+        
+    Returns:
+        Tuple of (review text or user-facing fallback message, True if reviews were found)
+    """
     api_key = os.getenv("SERPER_API_KEY")
     if not api_key:
-        return "No API key configured for reviews search."
+        return "No API key configured for reviews search.", False
     
     # Build search query
     query = f"{restaurant_name} reviews"
@@ -28,7 +312,7 @@ async def search_google_reviews(restaurant_name: str, location: Optional[str] =
         query += f" {location}"
     
     try:
-        url = "https://google.serper.dev/search"
+        url = f"{SERPER_BASE_URL}/search"
         headers = {
             "X-API-KEY": api_key,
             "Content-Type": "application/json"
@@ -39,10 +323,8 @@ async def search_google_reviews(restaurant_name: str, location: Optional[str] =
             "num": 10  # Get top 10 results
         }
         
-        response = await asyncio.to_thread(
-            requests.post, url, headers=headers, json=payload, timeout=10
-        )
-        response.raise_for_status()
+        with span("review_search"):
+            response = await serper_post(url, headers, payload)
         data = response.json()
         
         # Extract review snippets from organic results
@@ -65,20 +347,29 @@ async def search_google_reviews(restaurant_name: str, location: Optional[str] =
         reviews_combined = "\n\n".join(reviews_text)
         
         if not reviews_combined.strip():
-            return f"No reviews found for {restaurant_name}. You may want to try asking the staff for recommendations."
+            return f"No reviews found for {restaurant_name}. You may want to try asking the staff for recommendations.", False
         
-        return reviews_combined
+        return reviews_combined, True
         
-    except requests.exceptions.RequestException as e:
-        return f"Error searching reviews: {str(e)}. Try asking the staff for recommendations."
+    except CircuitOpenError:
+        return "Review search is temporarily unavailable. Try asking the staff for recommendations.", False
+    except httpx.HTTPError as e:
+        return f"Error searching reviews: {str(e)}. Try asking the staff for recommendations.", False
     except Exception as e:
-        return f"Unexpected error: {str(e)}"
+        return f"Unexpected error: {str(e)}", False
+
+
+def dish_cache_key(restaurant_name: str, dish_name: str) -> str:
+    """Build the (restaurant, dish) cache key from normalized names."""
+    return f"{normalize_restaurant_name(restaurant_name)}|{normalize_restaurant_name(dish_name)}"
 
 
 async def get_review_link_for_dish(restaurant_name: str, dish_name: str) -> Optional[str]:
     """
     Get a review link for a specific dish by searching Google.
     
+    Results (including "no link found") are cached per (restaurant, dish).
+    
     Args:
         restaurant_name: Name of the restaurant
         dish_name: Name of the dish
@@ -86,30 +377,51 @@ async def get_review_link_for_dish(restaurant_name: str, dish_name: str) -> Opti
     Returns:
         URL to a review page mentioning the dish, or None if not found
     """
+    if not DISH_CACHE_ENABLED:
+        link, _ = await fetch_review_link_for_dish(restaurant_name, dish_name)
+        return link
+    
+    key = dish_cache_key(restaurant_name, dish_name)
+    cached = review_link_cache.get(key)
+    if cached is not None:
+        return cached["link"]
+    
+    link, ok = await fetch_review_link_for_dish(restaurant_name, dish_name)
+    if ok:
+        review_link_cache.set(
+            key,
+            {"link": link},
+            ttl_seconds=None if link else DISH_CACHE_NEGATIVE_TTL_SECONDS
+        )
+    return link
+
+
+async def fetch_review_link_for_dish(restaurant_name: str, dish_name: str) -> tuple[Optional[str], bool]:
+    """
+    Search Serper.dev for a review link for a dish, bypassing the cache.
+    
+    Args:
+        restaurant_name: Name of the restaurant
+        dish_name: Name of the dish
+        
+    Returns:
+        Tuple of (link or None, True if the search completed without error)
+    """
     api_key = os.getenv("SERPER_API_KEY")
     if not api_key:
-        return None
+        return None, False
     
     # Build search query for dish reviews
     query = f"{restaurant_name} {dish_name} review"
     
     try:
-        url = "https://google.serper.dev/search"
-        headers = {
-            "X-API-KEY": api_key,
-            "Content-Type": "application/json"
-        }
-        
         payload = {
             "q": query,
             "num": 5  # Get top 5 results
         }
         
-        response = await asyncio.to_thread(
-            requests.post, url, headers=headers, json=payload, timeout=10
-        )
-        response.raise_for_status()
-        data = response.json()
+        with span("link_lookup"):
+            data = await serper_search(link_search_batcher, payload)
         
         # Get the first relevant result link, prioritizing Google Reviews
         google_links = []
@@ -129,86 +441,112 @@ async def get_review_link_for_dish(restaurant_name: str, dish_name: str) -> Opti
         
         # Return Google link if available, otherwise return first other link
         if google_links:
-            return google_links[0]
+            return google_links[0], True
         elif other_links:
-            return other_links[0]
+            return other_links[0], True
         
         # If no organic results, try answerBox
         if "answerBox" in data:
             link = data["answerBox"].get("link")
             if link:
-                return link
+                return link, True
         
-        return None
+        return None, True
         
     except Exception as e:
         print(f"Error getting review link for {dish_name}: {e}")
-        return None
+        return None, False
 
 
-async def search_dish_image(restaurant_name: str, dish_name: str) -> tuple[Optional[str], Optional[str]]:
+async def search_dish_image(restaurant_name: str, dish_name: str) -> List[Tuple[str, Optional[str]]]:
     """
     Search for real photos of a dish from Google Images (often from reviews).
     This finds actual user-uploaded photos from Google Reviews or restaurant sites.
     
+    Results are cached per (restaurant, dish). The candidates are not checked
+    for reachability here; see download_and_verify_image_url.
+    
     Args:
         restaurant_name: Name of the restaurant
         dish_name: Name of the dish to search for
         
     Returns:
-        Tuple of (image_url, review_link) where:
-        - image_url: URL of the first relevant image found, or None if no image found
+        Up to DISH_IMAGE_CANDIDATES (image_url, review_link) tuples, best first, where:
+        - image_url: URL of a relevant image
         - review_link: URL to the source page (Google Review, etc.), or None if not available
     """
+    if not DISH_CACHE_ENABLED:
+        candidates, _ = await fetch_dish_image(restaurant_name, dish_name)
+        return candidates
+    
+    key = dish_cache_key(restaurant_name, dish_name)
+    cached = dish_image_cache.get(key)
+    if cached is not None:
+        print(f"Dish image cache hit for: {dish_name}")
+        if "candidates" not in cached:
+            # Entry written before candidates were kept
+            return [(cached["image_url"], cached["source_link"])] if cached["image_url"] else []
+        return [tuple(candidate) for candidate in cached["candidates"]]
+    
+    candidates, ok = await fetch_dish_image(restaurant_name, dish_name)
+    if ok:
+        dish_image_cache.set(
+            key,
+            {"candidates": candidates},
+            ttl_seconds=None if candidates else DISH_CACHE_NEGATIVE_TTL_SECONDS
+        )
+    return candidates
+
+
+async def fetch_dish_image(restaurant_name: str, dish_name: str) -> tuple[List[Tuple[str, Optional[str]]], bool]:
+    """
+    Search Serper.dev Google Images for dish photos, bypassing the cache.
+    
+    Args:
+        restaurant_name: Name of the restaurant
+        dish_name: Name of the dish to search for
+        
+    Returns:
+        Tuple of ((image_url, review_link) candidates, True if the search completed without error)
+    """
     api_key = os.getenv("SERPER_API_KEY")
     if not api_key:
         print("No SERPER_API_KEY configured for image search")
-        return None, None
+        return [], False
     
     # Build search query - search for restaurant + dish name
     # This often returns review photos
     query = f"{restaurant_name} {dish_name}"
     
     try:
-        url = "https://google.serper.dev/images"
-        headers = {
-            "X-API-KEY": api_key,
-            "Content-Type": "application/json"
-        }
-        
         payload = {
             "q": query,
             "num": 5  # Get top 5 images
         }
         
         print(f"Searching Google Images for: {query}")
-        response = await asyncio.to_thread(
-            requests.post, url, headers=headers, json=payload, timeout=10
-        )
-        response.raise_for_status()
-        data = response.json()
+        with span("image_search"):
+            data = await serper_search(image_search_batcher, payload)
+        
+        # Extract image URLs and source links from the top results
+        candidates = []
+        for image in data.get("images", [])[:DISH_IMAGE_CANDIDATES]:
+            image_url = image.get("imageUrl") or image.get("url")
+            review_link = image.get("link") or image.get("sourceUrl") or image.get("contextUrl")
+            
+            # Only keep URLs Twilio can fetch
+            if image_url and image_url.startswith(("http://", "https://")):
+                candidates.append((image_url, review_link))
+        
+        if candidates:
+            print(f"Found {len(candidates)} candidate dish images, first: {candidates[0][0][:80]}...")
+        else:
+            print("No relevant images found in Google Images search")
+        return candidates, True
         
-        # Extract image URLs and source links from results
-        if "images" in data and len(data["images"]) > 0:
-            # Get the first image that looks relevant
-            for image in data["images"][:3]:  # Check top 3 images
-                image_url = image.get("imageUrl") or image.get("url")
-                review_link = image.get("link") or image.get("sourceUrl") or image.get("contextUrl")
-                
-                if image_url:
-                    # Verify it's a valid image URL
-                    if image_url.startswith(("http://", "https://")):
-                        print(f"Found real dish image: {image_url[:80]}...")
-                        if review_link:
-                            print(f"Found review link: {review_link[:80]}...")
-                        return image_url, review_link
-        
-        print("No relevant images found in Google Images search")
-        return None, None
-        
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"Error searching for dish image: {e}")
-        return None, None
+        return [], False
     except Exception as e:
         print(f"Unexpected error searching images: {e}")
-        return None, None
+        return [], False
@@ -2,27 +2,226 @@
 Twilio WhatsApp API helper for sending messages and downloading media.
 """
 import os
+import time
 import asyncio
-import requests
-import base64
 from twilio.rest import Client
-from typing import Optional, Dict
+from twilio.http.async_http_client import AsyncTwilioHttpClient
+from twilio.base.exceptions import TwilioRestException
+from typing import List, Optional, Dict
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from .cache_helper import TTLCache, CACHE_DB_PATH
+from .http_helper import http_request, http_stream
+from .metrics_helper import span
+from .resilience_helper import call_with_resilience, CircuitOpenError
+
+
+# Outbound send queue. Every reply goes through a bounded queue drained by a
+# few workers, paced by a token bucket sized to the sender number's throughput.
+# 429s, 5xx and network errors are retried with exponential backoff behind
+# the "twilio" circuit breaker.
+TWILIO_SEND_RATE_PER_SECOND = float(os.getenv("TWILIO_SEND_RATE_PER_SECOND", "10"))
+TWILIO_SEND_BURST = int(os.getenv("TWILIO_SEND_BURST", "10"))
+TWILIO_SEND_WORKERS = int(os.getenv("TWILIO_SEND_WORKERS", "4"))
+TWILIO_SEND_QUEUE_SIZE = int(os.getenv("TWILIO_SEND_QUEUE_SIZE", "1000"))
+TWILIO_SEND_MAX_RETRIES = int(os.getenv("TWILIO_SEND_MAX_RETRIES", "3"))
+TWILIO_SEND_RETRY_BASE_SECONDS = float(os.getenv("TWILIO_SEND_RETRY_BASE_SECONDS", "0.5"))
+# How long shutdown waits for queued messages to go out
+TWILIO_SEND_DRAIN_SECONDS = float(os.getenv("TWILIO_SEND_DRAIN_SECONDS", "10"))
+
+# Errors raised before a send request reaches Twilio (DNS, refused connection,
+# connect timeout), the only network failures that are safe to retry
+CONNECTION_SETUP_ERRORS = tuple(
+    error for error in (
+        aiohttp.ClientConnectorError,
+        getattr(aiohttp, "ConnectionTimeoutError", None),
+    ) if error is not None
+)
+
+# Twilio REST API root; point it at a local stub server for offline benchmarks
+TWILIO_API_BASE_URL = os.getenv("TWILIO_API_BASE_URL", "https://api.twilio.com").rstrip("/")
+
+# Largest media download accepted (WhatsApp itself caps images at 5 MB)
+MAX_MEDIA_BYTES = int(os.getenv("MAX_MEDIA_BYTES", str(8 * 1024 * 1024)))
+
+# Dish photo URLs are checked (HEAD, or a one-byte ranged GET) before Twilio is
+# asked to fetch them. Results are cached per URL; unreachable URLs are
+# retried after the shorter IMAGE_VERIFY_NEGATIVE_TTL_SECONDS.
+IMAGE_VERIFY_TIMEOUT_SECONDS = float(os.getenv("IMAGE_VERIFY_TIMEOUT_SECONDS", "5"))
+IMAGE_VERIFY_NEGATIVE_TTL_SECONDS = float(os.getenv("IMAGE_VERIFY_NEGATIVE_TTL_SECONDS", "600"))
+
+image_verification_cache = TTLCache(
+    "image_verifications",
+    max_entries=int(os.getenv("IMAGE_VERIFY_CACHE_MAX_ENTRIES", "5000")),
+    ttl_seconds=float(os.getenv("IMAGE_VERIFY_CACHE_TTL_SECONDS", str(6 * 3600))),
+    db_path=CACHE_DB_PATH
+)
+
+_twilio_client: Optional[Client] = None
+_send_queue: Optional[asyncio.Queue] = None
+_send_workers: List[asyncio.Task] = []
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter: allows `burst` sends at once, refilled at `rate` per second.
+    """
+    
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+    
+    async def acquire(self):
+        """Wait until a token is available, then take it."""
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+_send_rate_limiter = TokenBucket(TWILIO_SEND_RATE_PER_SECOND, TWILIO_SEND_BURST)
 
 
 def get_twilio_client() -> Optional[Client]:
     """
-    Initialize and return Twilio client.
+    Return the long-lived Twilio client, creating it on first use.
+    
+    The client uses Twilio's async HTTP client, so sends never block the event loop.
+    Must be called from within a running event loop.
     
     Returns:
         Twilio Client instance or None if credentials are missing
     """
+    global _twilio_client
+    if _twilio_client is not None:
+        return _twilio_client
+    
     account_sid = os.getenv("TWILIO_ACCOUNT_SID")
     auth_token = os.getenv("TWILIO_AUTH_TOKEN")
     
     if not account_sid or not auth_token:
         return None
     
-    return Client(account_sid, auth_token)
+    _twilio_client = Client(account_sid, auth_token, http_client=AsyncTwilioHttpClient())
+    if TWILIO_API_BASE_URL != "https://api.twilio.com":
+        _twilio_client.api.base_url = TWILIO_API_BASE_URL
+    return _twilio_client
+
+
+def is_twilio_media_url(url: Optional[str]) -> bool:
+    """Return True if url is served by the Twilio API and needs our credentials to download."""
+    if not url:
+        return False
+    host = urlsplit(url).netloc
+    return host == "api.twilio.com" or host == urlsplit(TWILIO_API_BASE_URL).netloc
+
+
+def start_whatsapp_sender():
+    """Start the outbound send workers. Called on app startup (or lazily on first send)."""
+    global _send_queue
+    if _send_workers:
+        return
+    _send_queue = asyncio.Queue(maxsize=TWILIO_SEND_QUEUE_SIZE)
+    for i in range(TWILIO_SEND_WORKERS):
+        _send_workers.append(asyncio.create_task(_send_worker(_send_queue), name=f"whatsapp-sender-{i}"))
+
+
+async def stop_whatsapp_sender():
+    """Drain queued messages (up to TWILIO_SEND_DRAIN_SECONDS), stop the workers and close the client."""
+    global _twilio_client, _send_queue
+    if _send_queue is not None:
+        try:
+            await asyncio.wait_for(_send_queue.join(), timeout=TWILIO_SEND_DRAIN_SECONDS)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Shutting down with {_send_queue.qsize()} WhatsApp messages unsent")
+    for worker in _send_workers:
+        worker.cancel()
+    await asyncio.gather(*_send_workers, return_exceptions=True)
+    _send_workers.clear()
+    _send_queue = None
+    
+    if _twilio_client is not None:
+        await _twilio_client.http_client.close()
+        _twilio_client = None
+
+
+def get_sender_stats() -> Dict:
+    """Return the outbound send queue depth and worker count."""
+    return {
+        "queued": _send_queue.qsize() if _send_queue is not None else 0,
+        "workers": len(_send_workers),
+        "rate_per_second": TWILIO_SEND_RATE_PER_SECOND,
+    }
+
+
+def is_retryable_send_error(error: Exception) -> bool:
+    """
+    Return True only for send failures where Twilio cannot have accepted the message.
+    
+    messages.create isn't idempotent: retrying after a read timeout or a
+    dropped response can deliver the reply twice. So only 429 and 503 (the
+    request was refused) and failures to open the connection are retried.
+    """
+    if isinstance(error, TwilioRestException):
+        return error.status in (429, 503)
+    return isinstance(error, CONNECTION_SETUP_ERRORS)
+
+
+async def _send_worker(queue: asyncio.Queue):
+    """Take queued messages and send them, paced by the rate limiter."""
+    while True:
+        message_params, result = await queue.get()
+        try:
+            sent = await _send_with_retries(message_params)
+            if not result.done():
+                result.set_result(sent)
+        except Exception as e:
+            if not result.done():
+                result.set_exception(e)
+        finally:
+            queue.task_done()
+
+
+async def _send_with_retries(message_params: Dict) -> bool:
+    """Send one message, retrying transient failures with jittered exponential backoff."""
+    client = get_twilio_client()
+    if not client:
+        print("Twilio client not initialized - check credentials")
+        return False
+    
+    async def attempt():
+        await _send_rate_limiter.acquire()
+        return await client.messages.create_async(**message_params)
+    
+    try:
+        message = await call_with_resilience(
+            "twilio",
+            attempt,
+            max_attempts=TWILIO_SEND_MAX_RETRIES + 1,
+            base_delay=TWILIO_SEND_RETRY_BASE_SECONDS,
+            retry_on=is_retryable_send_error
+        )
+        print(f"Message sent: {message.sid}")
+        return True
+    except CircuitOpenError as e:
+        print(f"Not sending WhatsApp message: {e}")
+        return False
+    except Exception as e:
+        import traceback
+        print(f"Error sending WhatsApp message: {e}")
+        print(f"Full error details: {traceback.format_exc()}")
+        media_url = message_params.get("media_url")
+        if media_url:
+            print(f"Failed to send media URL: {media_url[0][:100]}")
+        return False
 
 
 async def send_whatsapp_message(
@@ -33,6 +232,9 @@ async def send_whatsapp_message(
     """
     Send a WhatsApp message via Twilio.
     
+    The message is queued for the send workers, which rate-limit and retry;
+    this coroutine waits for the final outcome.
+    
     Args:
         to_number: Recipient's WhatsApp number (e.g., "+1234567890" or "whatsapp:+1234567890")
         message: Message text to send
@@ -41,8 +243,7 @@ async def send_whatsapp_message(
     Returns:
         True if message sent successfully, False otherwise
     """
-    client = get_twilio_client()
-    if not client:
+    if not get_twilio_client():
         print("Twilio client not initialized - check credentials")
         return False
     
@@ -56,27 +257,24 @@ async def send_whatsapp_message(
     if not to_number.startswith("whatsapp:"):
         to_number = f"whatsapp:{to_number}"
     
-    try:
-        message_params = {
-            "from_": whatsapp_number,  # Use from_ because 'from' is a Python keyword
-            "to": to_number,
-            "body": message
-        }
-        
-        if media_url:
-            message_params["media_url"] = [media_url]
-        
-        message = client.messages.create(**message_params)
-        print(f"Message sent: {message.sid}")
-        return True
-        
-    except Exception as e:
-        import traceback
-        print(f"Error sending WhatsApp message: {e}")
-        print(f"Full error details: {traceback.format_exc()}")
-        if media_url:
-            print(f"Failed to send media URL: {media_url[:100]}")
-        return False
+    message_params = {
+        "from_": whatsapp_number,  # Use from_ because 'from' is a Python keyword
+        "to": to_number,
+        "body": message
+    }
+    
+    if media_url:
+        message_params["media_url"] = [media_url]
+    
+    start_whatsapp_sender()
+    # Timed from enqueue to outcome, so rate-limit waits and retries show up too
+    with span("twilio_send") as stage:
+        result = asyncio.get_running_loop().create_future()
+        await _send_queue.put((message_params, result))
+        sent = await result
+        if not sent:
+            stage.fail()
+    return sent
 
 
 def truncate_text(text: str, max_length: int) -> str:
@@ -222,18 +420,102 @@ def format_recommendation_message(
     return message
 
 
-async def download_twilio_media(media_url: str) -> Optional[str]:
+def format_follow_up_message(
+    best_reviewed: Dict,
+    worst_reviewed: Dict,
+    diet_option: Dict,
+    image_source: Optional[str] = None,
+    review_link: Optional[str] = None,
+    best_review_link: Optional[str] = None,
+    worst_review_link: Optional[str] = None,
+    diet_review_link: Optional[str] = None
+) -> str:
+    """
+    Format the follow-up message sent after a progressive recommendation.
+    
+    Carries what arrives after the text recommendation: the dish photo's
+    caption and source, and the review links for the three dishes.
+    
+    Args:
+        best_reviewed: Dict with the best reviewed dish
+        worst_reviewed: Dict with the worst reviewed dish
+        diet_option: Dict with the diet option dish
+        image_source: Source of the dish image ("google" or "generated" or None)
+        review_link: URL to the review page if image is from Google
+        best_review_link: URL to reviews for best reviewed dish
+        worst_review_link: URL to reviews for worst reviewed dish
+        diet_review_link: URL to reviews for diet option
+        
+    Returns:
+        Formatted message string, or an empty string if there is nothing to add
+    """
+    sections = []
+    
+    if image_source:
+        caption = f"🖼️ Here's what *{best_reviewed.get('dish', 'the best dish')}* looks like"
+        if image_source == "google":
+            caption += "\n📷 *Photo:* Real customer photo from Google Reviews"
+            if review_link:
+                caption += f"\n🔗 *View Review:* {review_link}"
+        elif image_source == "generated":
+            caption += "\n🎨 *Photo:* AI-generated image"
+        sections.append(caption)
+    
+    links = []
+    for emoji, dish, link in (
+        ("✅", best_reviewed.get("dish"), best_review_link),
+        ("❌", worst_reviewed.get("dish"), worst_review_link),
+        ("🥗", diet_option.get("dish"), diet_review_link),
+    ):
+        if link:
+            links.append(f"{emoji} *{dish}*\n🔗 {link}")
+    if links:
+        sections.append("📝 *Reviews:*\n\n" + "\n\n".join(links))
+    
+    return truncate_text("\n\n".join(sections), 1500) if sections else ""
+
+
+def sniff_image_type(data: bytes) -> Optional[str]:
     """
-    Download media from Twilio Media URL and convert to base64 data URL.
+    Detect the image MIME type from the first bytes of a file.
     
-    Twilio Media URLs require authentication, so we download using Twilio credentials
-    and convert to base64 format that OpenAI can use.
+    Only the formats GPT-4o vision accepts (JPEG, PNG, GIF, WebP) are
+    recognized; anything else, such as HEIC, is rejected before we pay for a
+    vision call that would fail.
+    
+    Args:
+        data: At least the first 12 bytes of the file
+        
+    Returns:
+        MIME type (e.g., "image/jpeg"), or None if it isn't a supported image format
+    """
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+async def download_twilio_media(media_url: str) -> Optional[tuple[bytes, str]]:
+    """
+    Download media from a Twilio Media URL as raw bytes.
+    
+    Twilio Media URLs require authentication, so we download using Twilio credentials.
+    The body is streamed with a hard MAX_MEDIA_BYTES limit (checked against
+    Content-Length first), and the image type is sniffed from the content rather
+    than trusted from the headers. The bytes are kept once; callers build a data
+    URL only when they actually need one.
     
     Args:
         media_url: Twilio Media URL (e.g., https://api.twilio.com/.../Media/...)
         
     Returns:
-        Base64 data URL string (e.g., "data:image/jpeg;base64,...") or None if fails
+        Tuple of (image_bytes, content_type), or None if the download fails,
+        is too large or isn't an image
     """
     account_sid = os.getenv("TWILIO_ACCOUNT_SID")
     auth_token = os.getenv("TWILIO_AUTH_TOKEN")
@@ -244,62 +526,143 @@ async def download_twilio_media(media_url: str) -> Optional[str]:
     
     try:
         # Download image with Basic Auth using Twilio credentials
-        response = await asyncio.to_thread(
-            requests.get,
+        async with http_stream(
+            "GET",
             media_url,
             auth=(account_sid, auth_token),
             timeout=30
-        )
-        response.raise_for_status()
+        ) as response:
+            response.raise_for_status()
+            
+            content_length = int(response.headers.get("Content-Length") or 0)
+            if content_length > MAX_MEDIA_BYTES:
+                print(f"Twilio media too large ({content_length} bytes), rejecting before download")
+                return None
+            
+            buffer = bytearray()
+            async for chunk in response.aiter_bytes():
+                buffer.extend(chunk)
+                if len(buffer) > MAX_MEDIA_BYTES:
+                    print(f"Twilio media exceeded {MAX_MEDIA_BYTES} bytes, aborting download")
+                    return None
         
-        # Get content type
-        content_type = response.headers.get('Content-Type', 'image/jpeg')
-        
-        # Convert to base64
-        image_base64 = base64.b64encode(response.content).decode('utf-8')
-        
-        # Create data URL format that OpenAI accepts
-        data_url = f"data:{content_type};base64,{image_base64}"
+        content_type = sniff_image_type(bytes(buffer[:16]))
+        if not content_type:
+            print(f"Twilio media is not a supported image (Content-Type: {response.headers.get('Content-Type')})")
+            return None
         
-        return data_url
+        return bytes(buffer), content_type
         
     except Exception as e:
         print(f"Error downloading Twilio media: {e}")
         return None
 
 
-async def download_and_verify_image_url(image_url: str) -> Optional[str]:
+async def check_image_url(image_url: str) -> bool:
     """
-    Download an image from a URL and verify it's accessible.
+    Check that a URL serves an image without downloading it.
+    
+    Sends a HEAD first; hosts that refuse HEAD or don't report an image type
+    get a GET for the first byte only. Either way the connection goes back
+    to the pool before returning.
+    
+    Args:
+        image_url: URL of the image to check
+        
+    Returns:
+        True if the URL answered with an image content type
+    """
+    try:
+        response = await http_request("HEAD", image_url, timeout=IMAGE_VERIFY_TIMEOUT_SECONDS)
+        content_type = response.headers.get('Content-Type', '').lower()
+        if response.is_success and content_type.startswith('image/'):
+            return True
+        if response.status_code in (404, 410):
+            print(f"Image URL not found (HTTP {response.status_code})")
+            return False
+    except Exception as e:
+        print(f"HEAD request failed for image URL, trying a ranged GET: {e}")
+    
+    try:
+        async with http_stream(
+            "GET",
+            image_url,
+            headers={"Range": "bytes=0-0"},
+            timeout=IMAGE_VERIFY_TIMEOUT_SECONDS
+        ) as response:
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type', '').lower()
+    except Exception as e:
+        print(f"Error verifying image URL: {e}")
+        return False
+    
+    if not content_type.startswith('image/'):
+        print(f"URL does not point to an image (Content-Type: {content_type})")
+        return False
+    return True
+
+
+async def download_and_verify_image_url(image_url: str, use_cache: bool = True) -> Optional[str]:
+    """
+    Verify an image URL is accessible before handing it to Twilio.
     Returns the original URL if accessible, or None if not.
     
-    This is useful for verifying DALL-E URLs before sending to Twilio.
+    Results are cached per URL, so photos that keep getting recommended are
+    only checked once per IMAGE_VERIFY_CACHE_TTL_SECONDS. Pass use_cache=False
+    for one-off URLs such as DALL-E's.
     
     Args:
         image_url: URL of the image to verify
+        use_cache: Whether to read and store the cached result
         
     Returns:
         The original URL if accessible, None if not
     """
-    try:
-        print(f"Verifying image URL is accessible: {image_url[:80]}...")
-        response = await asyncio.to_thread(
-            requests.get,
+    if use_cache:
+        cached = image_verification_cache.get(image_url)
+        if cached is not None:
+            return image_url if cached["ok"] else None
+    
+    print(f"Verifying image URL is accessible: {image_url[:80]}...")
+    ok = await check_image_url(image_url)
+    if use_cache:
+        image_verification_cache.set(
             image_url,
-            timeout=10,
-            stream=True  # Don't download full content, just verify
+            {"ok": ok},
+            ttl_seconds=None if ok else IMAGE_VERIFY_NEGATIVE_TTL_SECONDS
         )
-        response.raise_for_status()
-        
-        # Check if it's actually an image
-        content_type = response.headers.get('Content-Type', '').lower()
-        if not content_type.startswith('image/'):
-            print(f"URL does not point to an image (Content-Type: {content_type})")
-            return None
-        
-        print(f"Image URL verified: {content_type}")
-        return image_url
+    if ok:
+        print(f"Image URL verified: {image_url[:80]}")
+    return image_url if ok else None
+
+
+async def first_accessible_image_url(image_urls: List[str]) -> Optional[int]:
+    """
+    Verify several candidate image URLs concurrently.
+    
+    Returns as soon as one passes, cancelling the remaining checks.
+    
+    Args:
+        image_urls: Candidate URLs, best first
         
-    except Exception as e:
-        print(f"Error verifying image URL: {e}")
+    Returns:
+        Index of the first URL to pass verification, or None if none did
+    """
+    if not image_urls:
+        return None
+    tasks = {
+        asyncio.ensure_future(download_and_verify_image_url(url)): index
+        for index, url in enumerate(image_urls)
+    }
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            passed = [tasks[task] for task in done if task.result()]
+            if passed:
+                return min(passed)
         return None
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()